@@ -0,0 +1,179 @@
+"""
+Benchmark the orchestration overhead of ``run_astrometry.py``.
+
+A fake ``solve-field`` (see :mod:`msumastro.tests.fake_solve_field`) with a
+known latency stands in for astrometry.net, so the time that is *not* spent
+in the solver -- copying files, reading them with ``CCDData``, cleaning up
+after the solver, logging -- can be measured directly.
+
+For each camera and each value of ``--jobs`` a fresh directory of synthetic
+light frames is created and :func:`astrometry_for_directory` is run on it.
+The report lists, for every run::
+
+    wall       total elapsed time, in seconds
+    solver     time spent inside the fake solver, summed over files
+    overhead   per-file time spent outside the solver, in seconds
+    files/s    throughput
+
+The per-file overhead is ``(jobs * wall - solver) / n_files``; with a single
+job it is exactly the time spent outside the solver.
+
+EXAMPLES
+--------
+
+    Compare one, two and four jobs on 20 frames from each camera with a
+    quarter second solve time::
+
+        python benchmarks/astrometry_pipeline.py --frames 20 --latency 0.25 \\
+            --jobs 1 2 4
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from msumastro.header_processing.feder import ApogeeAltaU9, ApogeeAspenCG16
+from msumastro.scripts import run_astrometry
+from msumastro.tests.fake_solve_field import install_fake_solve_field
+
+CAMERAS = {
+    'alta': ApogeeAltaU9,
+    'aspen': ApogeeAspenCG16,
+}
+
+
+def make_frames(directory, instrument, n_frames):
+    """
+    Write synthetic light frames with pointing for an instrument.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which the frames are written.
+    instrument : msumastro.header_processing.feder.Instrument
+        Instrument whose image size and FITS name are used.
+    n_frames : int
+        Number of frames to write.
+    """
+    data = np.zeros([instrument.rows, instrument.columns], dtype=np.uint16)
+    hdu = fits.PrimaryHDU(data)
+    hdu.header['imagetyp'] = 'LIGHT'
+    hdu.header['instrume'] = instrument.fits_names[0]
+    hdu.header['exptime'] = 30.0
+    hdu.header['ra'] = '14:03:12.58'
+    hdu.header['dec'] = '+54:20:55.50'
+    for i in range(n_frames):
+        hdu.writeto(os.path.join(directory, 'light_{0:04d}.fit'.format(i)))
+
+
+def solver_time(log_file):
+    """
+    Total time, in seconds, recorded by the fake solver.
+    """
+    try:
+        with open(log_file) as f:
+            return sum(float(line.split()[-2]) for line in f)
+    except IOError:
+        return 0.0
+
+
+def run_once(camera, n_frames, jobs, work_root, **astrometry_options):
+    """
+    Time one run of :func:`astrometry_for_directory`.
+
+    Returns
+    -------
+    dict
+        Wall time, total solver time, per-file overhead and throughput.
+    """
+    source = tempfile.mkdtemp(dir=work_root)
+    destination = tempfile.mkdtemp(dir=work_root)
+    log_file = os.path.join(work_root, 'solver.log')
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    os.environ[str('FAKE_SOLVE_FIELD_LOG')] = str(log_file)
+
+    make_frames(source, CAMERAS[camera](), n_frames)
+    start = time.time()
+    run_astrometry.astrometry_for_directory([source],
+                                            destination=destination,
+                                            no_log_destination=True,
+                                            jobs=jobs,
+                                            **astrometry_options)
+    wall = time.time() - start
+    solver = solver_time(log_file)
+    shutil.rmtree(source)
+    shutil.rmtree(destination)
+    return {'wall': wall,
+            'solver': solver,
+            'overhead': (jobs * wall - solver) / n_frames,
+            'throughput': n_frames / wall}
+
+
+def construct_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=10,
+                        help='Number of frames per camera; default is 10.')
+    parser.add_argument('--camera', choices=sorted(CAMERAS), action='append',
+                        help='Camera(s) to benchmark; default is all.')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4],
+                        help='Values of --jobs to benchmark.')
+    parser.add_argument('--latency', default='0',
+                        help='Fake solve time in seconds, or a "low,high" '
+                             'range.')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Fraction of solves that fail.')
+    parser.add_argument('--output-lines', type=int, default=10,
+                        help='Lines of output printed by each solve.')
+    parser.add_argument('--work-dir', default=None,
+                        help='Directory in which frames are written; '
+                             'default is a temporary directory.')
+    return parser
+
+
+def main(arglist=None):
+    args = construct_parser().parse_args(arglist)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    work_root = tempfile.mkdtemp(dir=args.work_dir)
+    bin_dir = os.path.join(work_root, 'bin')
+    os.mkdir(bin_dir)
+    install_fake_solve_field(bin_dir, latency=args.latency,
+                             failure_rate=args.failure_rate,
+                             output_lines=args.output_lines)
+    os.environ[str('PATH')] = os.pathsep.join([bin_dir,
+                                               os.environ.get('PATH', '')])
+
+    row_format = '{0:<8}{1:>6}{2:>10}{3:>10}{4:>12}{5:>10}'
+    print(row_format.format('camera', 'jobs', 'wall', 'solver',
+                            'overhead', 'files/s'))
+    results = []
+    try:
+        for camera in args.camera or sorted(CAMERAS):
+            for jobs in args.jobs:
+                result = run_once(camera, args.frames, jobs, work_root)
+                result.update(camera=camera, jobs=jobs)
+                results.append(result)
+                print(row_format.format(
+                    camera, jobs,
+                    '{0:.2f}'.format(result['wall']),
+                    '{0:.2f}'.format(result['solver']),
+                    '{0:.3f}'.format(result['overhead']),
+                    '{0:.2f}'.format(result['throughput'])))
+    finally:
+        shutil.rmtree(work_root)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark writing and reading triage manifests in each format.
+
+A synthetic manifest with the given number of rows and columns, a mix of
+string and floating point header values with some missing, is written in
+each available format with :func:`msumastro.manifest.write_manifest` and
+then read back, both completely and just a few columns, with
+:func:`msumastro.manifest.read_manifest`. The report lists, for each
+format::
+
+    write      time to write the manifest, in seconds
+    read       time to read every column, in seconds
+    subset     time to read the columns given by --columns, in seconds
+    MB         size of the file
+
+EXAMPLES
+--------
+
+    Compare formats for a semester-sized manifest::
+
+        python benchmarks/manifest_reload.py --rows 40000 --columns 200
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from astropy.table import Table, MaskedColumn
+
+from msumastro.manifest import (available_formats, manifest_name,
+                                read_manifest, write_manifest)
+
+
+def make_manifest(n_rows, n_columns, seed=0):
+    """
+    Manifest-like table with string, float and partly missing columns.
+    """
+    random = np.random.RandomState(seed)
+    table = Table(masked=True)
+    table['file'] = ['image_{0:06d}.fit'.format(i) for i in range(n_rows)]
+    for i in range(n_columns - 1):
+        name = 'key{0:03d}'.format(i)
+        mask = random.uniform(size=n_rows) < 0.05
+        if i % 4 == 0:
+            data = random.choice(['LIGHT', 'DARK', 'FLAT', 'BIAS'],
+                                 size=n_rows)
+        else:
+            data = random.normal(size=n_rows)
+        table[name] = MaskedColumn(data, mask=mask)
+    return table
+
+
+def time_call(function, *args, **kwd):
+    start = time.time()
+    function(*args, **kwd)
+    return time.time() - start
+
+
+def construct_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=4000,
+                        help='Number of rows; default is 4000.')
+    parser.add_argument('--columns', type=int, default=200,
+                        help='Number of columns; default is 200.')
+    parser.add_argument('--subset', nargs='+',
+                        default=['file', 'key000', 'key001'],
+                        help='Columns read in the subset test.')
+    parser.add_argument('--format', action='append',
+                        choices=available_formats(),
+                        help='Format(s) to benchmark; default is all that '
+                             'are available.')
+    return parser
+
+
+def main(arglist=None):
+    args = construct_parser().parse_args(arglist)
+    table = make_manifest(args.rows, args.columns)
+    work_dir = tempfile.mkdtemp()
+
+    row_format = '{0:<10}{1:>10}{2:>10}{3:>10}{4:>10}'
+    print(row_format.format('format', 'write', 'read', 'subset', 'MB'))
+    results = []
+    try:
+        for format in args.format or available_formats():
+            name = os.path.join(work_dir,
+                                manifest_name('Manifest.txt', format))
+            result = {
+                'format': format,
+                'write': time_call(write_manifest, table, name,
+                                   format=format),
+                'read': time_call(read_manifest, name),
+                'subset': time_call(read_manifest, name,
+                                    columns=args.subset),
+                'size': os.path.getsize(name) / 2**20}
+            results.append(result)
+            print(row_format.format(format,
+                                    '{0:.3f}'.format(result['write']),
+                                    '{0:.3f}'.format(result['read']),
+                                    '{0:.3f}'.format(result['subset']),
+                                    '{0:.1f}'.format(result['size'])))
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""
+An SQLite catalog of the FITS headers in an archive.
+
+Questions like "all R-band flats taken with the Aspen between these dates"
+otherwise need an `~msumastro.ImageFileCollection` built for every
+directory in the archive. The catalog instead keeps the header of each file
+in SQLite: the keywords most often searched on are columns of the ``files``
+table, each with an index, and every other card is in the ``cards`` table.
+
+The catalog is brought up to date with :meth:`HeaderCatalog.update`, which
+reads only files that are new or whose size or modification time changed,
+and searched with :meth:`HeaderCatalog.query`.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import OrderedDict
+import logging
+import os
+import sqlite3
+
+from astropy.io import fits
+from astropy.table import Table, MaskedColumn
+from astropy.extern import six
+
+from .fits_walk import fits_files, walk_fits_directories
+from .header_scanner import ScannedHeader, scan_header
+
+__all__ = ['HeaderCatalog']
+
+logger = logging.getLogger(__name__)
+
+# Indexed columns of the files table and the header keywords they come
+# from, first keyword found wins. ra and dec are in degrees.
+_KEYWORDS = OrderedDict([
+    ('imagetyp', ['imagetyp']),
+    ('object', ['object']),
+    ('filter', ['filter']),
+    ('exptime', ['exptime', 'exposure']),
+    ('date_obs', ['date-obs']),
+    ('instrume', ['instrume']),
+    ('airmass', ['airmass', 'secz']),
+    ('ra', ['ra', 'objctra']),
+    ('dec', ['dec', 'objctdec']),
+])
+
+_TEXT_COLUMNS = set(['imagetyp', 'object', 'filter', 'date_obs',
+                     'instrume'])
+
+_COMMENTARY = set(['', 'COMMENT', 'HISTORY'])
+
+
+def _degrees(value, hours=False):
+    """
+    Convert an angle, a number or a sexagesimal string, to degrees.
+
+    Returns ``None`` if the value cannot be converted.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if not isinstance(value, six.string_types):
+        return float(value)
+    parts = value.replace(':', ' ').split()
+    try:
+        numbers = [abs(float(p)) for p in parts]
+    except ValueError:
+        return None
+    if not numbers:
+        return None
+    degrees = sum(n / 60 ** i for i, n in enumerate(numbers))
+    if parts[0].startswith('-'):
+        degrees = -degrees
+    return degrees * 15 if hours and len(parts) > 1 else degrees
+
+
+def _card_value(value):
+    # sqlite has no boolean type
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, complex):
+        return str(value)
+    return value
+
+
+class HeaderCatalog(object):
+    """
+    SQLite catalog of FITS headers, updated incrementally.
+
+    Parameters
+    ----------
+    path : str
+        Name of the SQLite file holding the catalog; created if it does not
+        exist.
+
+    Attributes
+    ----------
+    path
+    COLUMNS : list of str
+        Indexed columns that can be searched on directly in :meth:`query`.
+    """
+
+    COLUMNS = list(_KEYWORDS)
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            directory TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            imagetyp TEXT COLLATE NOCASE,
+            object TEXT COLLATE NOCASE,
+            filter TEXT COLLATE NOCASE,
+            exptime REAL,
+            date_obs TEXT,
+            instrume TEXT COLLATE NOCASE,
+            airmass REAL,
+            ra REAL,
+            dec REAL
+        );
+        CREATE TABLE IF NOT EXISTS cards (
+            file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+            keyword TEXT NOT NULL,
+            value
+        );
+        CREATE INDEX IF NOT EXISTS files_directory ON files(directory);
+        CREATE INDEX IF NOT EXISTS files_imagetyp ON files(imagetyp);
+        CREATE INDEX IF NOT EXISTS files_object ON files(object);
+        CREATE INDEX IF NOT EXISTS files_filter ON files(filter);
+        CREATE INDEX IF NOT EXISTS files_exptime ON files(exptime);
+        CREATE INDEX IF NOT EXISTS files_date_obs ON files(date_obs);
+        CREATE INDEX IF NOT EXISTS files_instrume ON files(instrume);
+        CREATE INDEX IF NOT EXISTS files_ra_dec ON files(ra, dec);
+        CREATE INDEX IF NOT EXISTS cards_file ON cards(file_id);
+        CREATE INDEX IF NOT EXISTS cards_keyword_value
+            ON cards(keyword, value);
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.executescript(self._SCHEMA)
+
+    @property
+    def path(self):
+        """
+        str, Name of the catalog file.
+        """
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Save any changes and close the catalog.
+        """
+        self._connection.commit()
+        self._connection.close()
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def _add(self, file_name, header, stat):
+        values = {'path': file_name,
+                  'directory': os.path.dirname(file_name),
+                  'size': stat.st_size,
+                  'mtime': stat.st_mtime}
+        for column, keywords in _KEYWORDS.items():
+            value = None
+            for keyword in keywords:
+                if keyword in header:
+                    value = header[keyword]
+                    break
+            if column in ('ra', 'dec'):
+                value = _degrees(value, hours=(column == 'ra'))
+            elif column in _TEXT_COLUMNS and value is not None:
+                value = six.text_type(value)
+            elif value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            values[column] = value
+
+        self._connection.execute('DELETE FROM files WHERE path = ?',
+                                 (file_name,))
+        names = list(values)
+        cursor = self._connection.execute(
+            'INSERT INTO files ({0}) VALUES ({1})'.format(
+                ', '.join(names), ', '.join('?' * len(names))),
+            [values[name] for name in names])
+        file_id = cursor.lastrowid
+        self._connection.executemany(
+            'INSERT INTO cards (file_id, keyword, value) VALUES (?, ?, ?)',
+            [(file_id, keyword, _card_value(value))
+             for keyword, value in header.items()
+             if keyword not in _COMMENTARY])
+
+    def update_directory(self, directory, files=None, header_cache=None):
+        """
+        Bring the catalog up to date for the FITS files in one directory.
+
+        Parameters
+        ----------
+        directory : str
+            Directory whose files are cataloged; subdirectories are not.
+        files : list of str, optional
+            Names of the FITS files in `directory`; found if omitted.
+        header_cache : `~msumastro.header_cache.HeaderCache`, optional
+            Cache from which to take headers, e.g. one just filled by
+            triage; headers not in it are read and added to it.
+
+        Returns
+        -------
+        int
+            Number of files read.
+        """
+        directory = os.path.abspath(directory)
+        if files is None:
+            files = fits_files(directory)
+        known = dict((path, (size, mtime)) for path, size, mtime in
+                     self._connection.execute(
+                         'SELECT path, size, mtime FROM files '
+                         'WHERE directory = ?', (directory,)))
+        n_read = 0
+        for name in files:
+            file_name = os.path.join(directory, name)
+            stat = os.stat(file_name)
+            if known.pop(file_name, None) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                header = self._read_header(file_name, header_cache)
+            except (IOError, OSError) as e:
+                logger.warning('Unable to read header of %s: %s',
+                               file_name, e)
+                continue
+            self._add(file_name, header, stat)
+            n_read += 1
+        # Anything left in known is no longer in the directory.
+        self._connection.executemany('DELETE FROM files WHERE path = ?',
+                                     [(path,) for path in known])
+        self._connection.commit()
+        return n_read
+
+    @staticmethod
+    def _read_header(file_name, header_cache=None):
+        if header_cache is not None:
+            raw = header_cache.header_bytes(file_name)
+            try:
+                return ScannedHeader.from_bytes(raw)
+            except ValueError:
+                return fits.Header.fromstring(raw.decode('ascii', 'replace'))
+        try:
+            return scan_header(file_name)
+        except (ValueError, IOError, EOFError):
+            return fits.getheader(file_name)
+
+    def update(self, root, recursive=True):
+        """
+        Bring the catalog up to date for the FITS files under a directory.
+
+        Only files that are new or whose size or modification time has
+        changed are read. Files that no longer exist in a directory that is
+        walked are removed from the catalog.
+
+        Parameters
+        ----------
+        root : str
+            Directory at which to start.
+        recursive : bool, optional
+            If ``False``, catalog only the files directly in `root`.
+
+        Returns
+        -------
+        int
+            Number of files read.
+        """
+        root = os.path.abspath(root)
+        if not recursive:
+            return self.update_directory(root)
+        n_read = 0
+        walked = set()
+        for directory, files in walk_fits_directories(root):
+            walked.add(directory)
+            n_read += self.update_directory(directory, files=files)
+        # Directories that no longer hold any FITS files.
+        below = [d for d, in self._connection.execute(
+            'SELECT DISTINCT directory FROM files')
+            if (d == root or d.startswith(root + os.sep)) and
+            d not in walked]
+        for directory in below:
+            self.update_directory(directory, files=[])
+        logger.info('Catalog %s: read %d files', self.path, n_read)
+        return n_read
+
+    def query(self, where=None, **criteria):
+        """
+        Find files whose headers match some criteria.
+
+        Each criterion is a column of the catalog (see `COLUMNS`) or any
+        other header keyword, and a value. Since ``-`` cannot be part of a
+        python name, ``_`` in a keyword matches either ``_`` or ``-``, e.g.
+        ``cd1_1`` finds ``CD1_1`` and ``date_obs`` finds ``DATE-OBS``. The
+        value can be:
+
+        + a single value, which selects files with exactly that value;
+          strings are compared ignoring case.
+        + a string containing ``*``, which stands for any characters, e.g.
+          ``'*aspen*'``; strings are compared ignoring case.
+        + a tuple ``(low, high)``, which selects values in that range,
+          inclusive; either end may be ``None``.
+        + a list, which selects files with any of the values.
+
+        Parameters
+        ----------
+        where : str, optional
+            Additional SQL condition on the ``files`` table.
+        criteria
+            Criteria that must all be met.
+
+        Returns
+        -------
+        astropy.table.Table
+            One row per file, with the path of the file and the indexed
+            columns; missing values are masked.
+
+        Examples
+        --------
+        >>> catalog.query(imagetyp='flat', filter='R', instrume='*aspen*',
+        ...               date_obs=('2015-03-01',
+        ...                         '2015-04-01'))  # doctest: +SKIP
+        >>> catalog.query(imagetyp='light', object='SZ Lyn',
+        ...               airmass=(None, 1.5))  # doctest: +SKIP
+        """
+        conditions = []
+        parameters = []
+        for name, value in criteria.items():
+            if name in _KEYWORDS:
+                column = name
+            else:
+                # Other keywords are looked up in the cards table.
+                column = 'value'
+            condition, values = self._condition(column, value)
+            if column == 'value':
+                keywords = sorted(set([name.upper(),
+                                       name.upper().replace('_', '-')]))
+                condition = ('id IN (SELECT file_id FROM cards WHERE '
+                             'keyword IN ({0}) AND {1})'.format(
+                                 ', '.join('?' * len(keywords)), condition))
+                values = keywords + values
+            conditions.append(condition)
+            parameters.extend(values)
+        if where:
+            conditions.append('({0})'.format(where))
+
+        columns = ['path'] + self.COLUMNS
+        sql = 'SELECT {0} FROM files'.format(', '.join(columns))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY path'
+        rows = self._connection.execute(sql, parameters).fetchall()
+        return self._table(columns, rows)
+
+    @staticmethod
+    def _condition(column, value):
+        if isinstance(value, tuple):
+            low, high = value
+            parts = []
+            values = []
+            if low is not None:
+                parts.append('{0} >= ?'.format(column))
+                values.append(low)
+            if high is not None:
+                parts.append('{0} <= ?'.format(column))
+                values.append(high)
+            return '(' + (' AND '.join(parts) or '1') + ')', values
+        if isinstance(value, list):
+            parts = [HeaderCatalog._condition(column, v) for v in value]
+            return ('(' + (' OR '.join(p[0] for p in parts) or '0') + ')',
+                    [v for p in parts for v in p[1]])
+        if isinstance(value, six.string_types) and '*' in value:
+            # LIKE ignores case; escape its own wildcards.
+            pattern = (value.replace('\\', '\\\\').replace('%', '\\%')
+                       .replace('_', '\\_').replace('*', '%'))
+            return "{0} LIKE ? ESCAPE '\\'".format(column), [pattern]
+        if column == 'value' and isinstance(value, six.string_types):
+            # Card values do not have a collation of their own.
+            return '{0} = ? COLLATE NOCASE'.format(column), [value]
+        return '{0} = ?'.format(column), [value]
+
+    @staticmethod
+    def _table(columns, rows):
+        table = Table(masked=True)
+        for i, name in enumerate(columns):
+            values = [row[i] for row in rows]
+            mask = [v is None for v in values]
+            if name == 'path' or name in _TEXT_COLUMNS:
+                data = ['' if v is None else v for v in values]
+                dtype = str
+            else:
+                data = [0.0 if v is None else v for v in values]
+                dtype = float
+            table[name] = MaskedColumn(data=data, mask=mask, dtype=dtype,
+                                       name=name)
+        return table
+
+    def header(self, file_name):
+        """
+        Cataloged header cards of a file, as a dictionary.
+
+        Parameters
+        ----------
+        file_name : str
+            Path of the file.
+
+        Returns
+        -------
+        OrderedDict
+            Keyword to value, in the order of the header; empty if the file
+            is not in the catalog.
+        """
+        rows = self._connection.execute(
+            'SELECT keyword, value FROM cards JOIN files '
+            'ON cards.file_id = files.id WHERE files.path = ? '
+            'ORDER BY cards.rowid', (os.path.abspath(file_name),))
+        return OrderedDict(rows.fetchall())
@@ -169,3 +169,30 @@ def simbad_down():
     except (name_resolve.NameResolveError, timeout):
         simbad_down = True
     return simbad_down
+
+
+@pytest.fixture
+def fake_solve_field(tmpdir, monkeypatch):
+    """
+    Put a fake astrometry.net ``solve-field`` at the front of ``PATH``.
+
+    The fake is configured through the ``FAKE_SOLVE_FIELD_*`` environment
+    variables described in :mod:`msumastro.tests.fake_solve_field`; use
+    ``monkeypatch.setenv`` in a test to change them.
+
+    Returns
+    -------
+    str
+        Path to the fake executable.
+    """
+    from .tests.fake_solve_field import install_fake_solve_field, ENV_PREFIX
+
+    for name in list(os.environ):
+        if name.startswith(ENV_PREFIX):
+            monkeypatch.delenv(name)
+    bin_dir = tmpdir.mkdir('fake_bin')
+    executable = install_fake_solve_field(bin_dir.strpath)
+    monkeypatch.setenv(str('PATH'),
+                       os.pathsep.join([bin_dir.strpath,
+                                        os.environ.get('PATH', '')]))
+    return executable
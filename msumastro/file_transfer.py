@@ -0,0 +1,632 @@
+"""
+Putting files into a directory tree by copying, moving or linking them.
+
+Copying a night of images doubles the disk space and I/O it takes. A hard
+link or a reflink (a copy-on-write clone, on file systems like btrfs and
+XFS that support it) gives the destination its own name for the same data
+without copying it, and a symbolic link points back at the original.
+Neither a hard link nor a reflink can cross file systems, so when one
+cannot be made the file is copied instead.
+
+A :class:`PlacementJournal` records a plan of where each file goes and
+which files have been placed, so that an interrupted sort can be finished
+rather than started over. Copies are written under a temporary name and
+renamed once complete, so a file in the destination is never part of a
+copy, and a file already in the destination is never replaced.
+
+Copies made with a :class:`TransferManifest` are checked without reading
+anything twice: the original is hashed as it is read, and the copy, once
+flushed to disk, must be the size of the original, which catches copies
+truncated by flaky network storage. The hash of the original is listed in
+the manifest, in the format of ``sha1sum``, so the copies can be checked
+against it later.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import errno
+import hashlib
+import io
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+__all__ = ['LINK_MODES', 'HASH_ALGORITHM', 'TransferError', 'hash_file',
+           'copy_verified', 'transfer_file', 'is_placed', 'makedirs',
+           'PlacementJournal', 'TransferManifest']
+
+logger = logging.getLogger(__name__)
+
+#: Ways of placing a file in its destination.
+LINK_MODES = ('copy', 'move', 'hardlink', 'symlink', 'reflink')
+
+#: Hash used to verify copies; the same as the astrometry ledger uses.
+HASH_ALGORITHM = 'sha1'
+
+# Bytes read and written at a time when copying a file.
+_CHUNK = 1024 * 1024
+
+# Size of a FITS block, by which adding checksum cards can lengthen a file.
+_FITS_BLOCK = 2880
+
+# ioctl that clones one file into another on Linux, from <linux/fs.h>.
+_FICLONE = 0x40049409
+
+# Errors meaning a link cannot be made here, so the file should be copied:
+# different file systems, or links not supported by the file system.
+_CANNOT_LINK = set([errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY,
+                    errno.EOPNOTSUPP, errno.EMLINK,
+                    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)])
+
+
+class TransferError(IOError):
+    """
+    A copy of a file does not match the original.
+    """
+    pass
+
+
+def hash_file(path, algorithm=HASH_ALGORITHM):
+    """
+    Hexadecimal digest of the contents of a file.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_verified(source, destination, algorithm=HASH_ALGORITHM):
+    """
+    Copy a file, and its metadata, and check that the copy is complete.
+
+    The original is hashed as it is read, so it is read only once, and the
+    copy is not read back. The copy is flushed to disk and removed unless
+    its size is the number of bytes read, which must also be the size of
+    the original once it has been read.
+
+    Parameters
+    ----------
+    source : str
+        Path of the file.
+    destination : str
+        Path of the copy.
+    algorithm : str, optional
+        Name of a hash in `hashlib`.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the original.
+
+    Raises
+    ------
+    TransferError
+        If the copy is not the size of the original.
+    """
+    read = hashlib.new(algorithm)
+    n_read = 0
+    with io.open(source, 'rb') as src:
+        # Unbuffered, so that each write says how much was written.
+        with io.open(destination, 'wb', buffering=0) as dst:
+            for chunk in iter(lambda: src.read(_CHUNK), b''):
+                read.update(chunk)
+                n_read += len(chunk)
+                view = memoryview(chunk)
+                while len(view):
+                    view = view[dst.write(view):]
+            os.fsync(dst.fileno())
+            copied_size = os.fstat(dst.fileno()).st_size
+        source_size = os.fstat(src.fileno()).st_size
+    if not copied_size == source_size == n_read:
+        os.remove(destination)
+        raise TransferError(errno.EIO,
+                            'Copy does not match original ({0} bytes, {1} '
+                            'expected)'.format(copied_size, n_read), source)
+    shutil.copystat(source, destination)
+    return read.hexdigest()
+
+
+def _reflink(source, destination):
+    """
+    Clone `source` to `destination`, sharing data blocks until either is
+    modified.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported here')
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            except (IOError, OSError):
+                dst.close()
+                os.remove(destination)
+                raise
+    shutil.copystat(source, destination)
+
+
+def _destination(source, destination_dir, name):
+    return os.path.join(destination_dir, name or os.path.basename(source))
+
+
+def _partial(destination):
+    """
+    Temporary name under which a copy is written before it is complete.
+    """
+    directory, name = os.path.split(destination)
+    return os.path.join(directory, '.' + name + '.part')
+
+
+def _check_free(destination):
+    """
+    Raise an error if there is already a file at `destination`.
+    """
+    if os.path.lexists(destination):
+        raise OSError(errno.EEXIST, 'File exists', destination)
+
+
+def transfer_file(source, destination_dir, link_mode='copy', name=None,
+                  manifest=None, prepare=None):
+    """
+    Place a file in a directory.
+
+    Parameters
+    ----------
+    source : str
+        Path of the file.
+    destination_dir : str
+        Directory in which to place it.
+    link_mode : str, optional
+        One of `LINK_MODES`:
+
+        + ``'copy'``: copy the file and its metadata, like `shutil.copy2`.
+        + ``'move'``: move the file, like `shutil.move`.
+        + ``'hardlink'``: make a hard link to the file.
+        + ``'symlink'``: make a symbolic link to the absolute path of the
+          file.
+        + ``'reflink'``: make a copy-on-write clone of the file.
+
+        A hard link or reflink that cannot be made, for instance because
+        the destination is on a different file system, is replaced by a
+        copy.
+    name : str, optional
+        Name of the file in `destination_dir`; default is the name of
+        `source`.
+    manifest : TransferManifest, optional
+        If given, every copy made, including a move to a different file
+        system, is made with :func:`copy_verified`, and the hash of every
+        file placed other than by a link is recorded in the manifest. A
+        file moved within a file system, which is only renamed, and a
+        copy changed by `prepare` are read once more to hash them.
+    prepare : callable, optional
+        Called with the path of the file placed, unless it is a link, to
+        change it, e.g. to add FITS checksums. A copy is changed before it
+        is given its name, and keeps the modification time of the original.
+
+    Returns
+    -------
+    str
+        The link mode actually used; ``'copy'`` if a link could not be made.
+
+    Raises
+    ------
+    OSError
+        If there is already a file of that name in `destination_dir`; it is
+        left alone.
+    TransferError
+        If a verified copy does not match the original; a file being moved
+        is left where it was.
+
+    Notes
+    -----
+    Copies, including reflinks, are made under a temporary name in
+    `destination_dir` and renamed when complete, so a copy that is cut short
+    never has the name of the file.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError('Unknown link mode {0}'.format(link_mode))
+    destination = _destination(source, destination_dir, name)
+    _check_free(destination)
+
+    def copy(source, destination, make=None):
+        partial = _partial(destination)
+        digest = None
+        try:
+            if make is not None:
+                make(source, partial)
+            elif manifest is None:
+                shutil.copy2(source, partial)
+            else:
+                digest = copy_verified(source, partial,
+                                       algorithm=manifest.algorithm)
+            if prepare is not None:
+                prepare(partial)
+                shutil.copystat(source, partial)
+                digest = None
+            if manifest is not None and digest is None:
+                digest = hash_file(partial, manifest.algorithm)
+            _check_free(destination)
+            os.rename(partial, destination)
+        except BaseException:
+            if os.path.lexists(partial):
+                os.remove(partial)
+            raise
+        if manifest is not None:
+            manifest.record(destination, digest)
+
+    if link_mode == 'move':
+        try:
+            os.rename(source, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            copy(source, destination)
+            os.remove(source)
+        else:
+            if prepare is not None:
+                prepare(destination)
+            if manifest is not None:
+                manifest.record(destination,
+                                hash_file(destination, manifest.algorithm))
+    elif link_mode == 'symlink':
+        os.symlink(os.path.abspath(source), destination)
+    elif link_mode in ('hardlink', 'reflink'):
+        try:
+            if link_mode == 'hardlink':
+                os.link(source, destination)
+            else:
+                copy(source, destination, make=_reflink)
+        except (IOError, OSError) as e:
+            if e.errno not in _CANNOT_LINK:
+                raise
+            logger.debug('Unable to %s %s to %s (%s); copying instead',
+                         link_mode, source, destination_dir, e)
+            link_mode = 'copy'
+            copy(source, destination)
+    else:
+        copy(source, destination)
+    return link_mode
+
+
+def is_placed(source, destination_dir, link_mode='copy', name=None,
+              fits_checksum=False):
+    """
+    Whether a file has already been placed in a directory.
+
+    A copy counts as placed only if it has the size and modification time of
+    the original, so a different file of the same name is not mistaken for
+    it.
+
+    Parameters
+    ----------
+    source : str
+        Path of the file.
+    destination_dir : str
+        Directory in which it should be.
+    link_mode : str, optional
+        How it was placed; see :func:`transfer_file`.
+    name : str, optional
+        Name it should have; default is the name of `source`.
+    fits_checksum : bool, optional
+        If ``True``, FITS checksums were added to copies, which can make a
+        copy longer than the original by whole FITS blocks.
+
+    Returns
+    -------
+    bool
+    """
+    destination = _destination(source, destination_dir, name)
+    if link_mode == 'symlink':
+        return (os.path.islink(destination) and
+                os.readlink(destination) == os.path.abspath(source))
+    if not os.path.isfile(destination):
+        return False
+    if link_mode == 'move':
+        return not os.path.lexists(source)
+    try:
+        source_stat = os.stat(source)
+    except OSError:
+        return False
+    if os.path.samefile(source, destination):
+        return link_mode == 'hardlink'
+    # A copy, or a link that could only be made as a copy.
+    destination_stat = os.stat(destination)
+    grown = destination_stat.st_size - source_stat.st_size
+    if fits_checksum:
+        same_size = grown >= 0 and grown % _FITS_BLOCK == 0
+    else:
+        same_size = grown == 0
+    return (same_size and
+            int(source_stat.st_mtime) == int(destination_stat.st_mtime))
+
+
+def makedirs(directory):
+    """
+    Make a directory and any missing parents; it may already exist.
+    """
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+
+
+class PlacementJournal(object):
+    """
+    Plan for placing files in a directory tree and the progress made on it,
+    kept in SQLite.
+
+    Parameters
+    ----------
+    path : str
+        Name of the SQLite database file; it is created if it does not exist.
+
+    Notes
+    -----
+    The plan is a list of files and the directory in which each goes, and
+    optionally the name it is given there, together with the link mode, the
+    directories the files came from and the one they go to.
+    Each file is marked as done once it has been placed. Marks are committed
+    in groups, so after a crash a few files that were placed may still be
+    listed as pending; use :func:`is_placed` to recognize them.
+    """
+
+    #: Name of the journal file used by :meth:`for_directory`.
+    DEFAULT_NAME = '.msumastro_sort_journal.sqlite'
+
+    # Number of files marked between commits.
+    COMMIT_EVERY = 100
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS plan (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS placements (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            name TEXT,
+            done INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.executescript(self._SCHEMA)
+        self._uncommitted = 0
+
+    @classmethod
+    def for_directory(cls, directory):
+        """
+        Journal kept in a hidden file in `directory`.
+        """
+        return cls(os.path.join(directory, cls.DEFAULT_NAME))
+
+    @property
+    def path(self):
+        """
+        str, Name of the journal file.
+        """
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Commit any marks not yet committed and close the database.
+        """
+        self._connection.commit()
+        self._connection.close()
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM placements').fetchone()[0]
+
+    @property
+    def has_plan(self):
+        """
+        bool, ``True`` if a plan has been written.
+        """
+        row = self._connection.execute(
+            "SELECT 1 FROM plan WHERE key = 'link_mode'").fetchone()
+        return row is not None
+
+    def info(self, key):
+        """
+        Value recorded with the plan: ``'source'``, ``'destination'``,
+        ``'link_mode'`` or ``'created'``; ``None`` if there is no plan.
+        """
+        row = self._connection.execute(
+            'SELECT value FROM plan WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def write_plan(self, placements, source=None, link_mode='copy',
+                   destination=None):
+        """
+        Replace the plan.
+
+        Parameters
+        ----------
+        placements : list of (str, str) or (str, str, str)
+            Path of each file, the directory in which it goes and,
+            optionally, its name there.
+        source : str, optional
+            Directory the files are placed from.
+        link_mode : str, optional
+            How the files are placed; see :func:`transfer_file`.
+        destination : str, optional
+            Directory in which the tree is made.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM placements')
+            self._connection.execute('DELETE FROM plan')
+            self._connection.executemany(
+                'INSERT INTO plan (key, value) VALUES (?, ?)',
+                [('source', source), ('destination', destination),
+                 ('link_mode', link_mode), ('created', str(time.time()))])
+            self._connection.executemany(
+                'INSERT INTO placements (source, destination, name) '
+                'VALUES (?, ?, ?)',
+                [(p[0], p[1], p[2] if len(p) > 2 else None)
+                 for p in placements])
+
+    def pending(self):
+        """
+        Placements not yet done.
+
+        Returns
+        -------
+        list of (int, str, str, str)
+            Id of each placement, path of the file, its directory and its
+            name there, which is ``None`` if it keeps its own name.
+        """
+        return self._connection.execute(
+            'SELECT id, source, destination, name FROM placements '
+            'WHERE done = 0 ORDER BY id').fetchall()
+
+    def mark_done(self, placement_id):
+        """
+        Record that a file has been placed.
+        """
+        self._connection.execute(
+            'UPDATE placements SET done = 1, error = NULL WHERE id = ?',
+            (placement_id,))
+        self._count_change()
+
+    def mark_failed(self, placement_id, error):
+        """
+        Record why a file could not be placed; it stays pending.
+        """
+        self._connection.execute(
+            'UPDATE placements SET error = ? WHERE id = ?',
+            (str(error), placement_id))
+        self._count_change()
+
+    def _count_change(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._connection.commit()
+            self._uncommitted = 0
+
+
+class TransferManifest(object):
+    """
+    List of the hash of each file copied into a directory tree.
+
+    Parameters
+    ----------
+    path : str
+        Name of the manifest file. Lines are added to it if it exists.
+    algorithm : str, optional
+        Name of a hash in `hashlib`.
+
+    Notes
+    -----
+    Each line is the hexadecimal digest of a file, two spaces and the path
+    of the file relative to the directory of the manifest, the format
+    written by ``sha1sum``; ``sha1sum -c`` checks the files against it. A
+    file copied again gets a new line, which supersedes the earlier one.
+    Lines are written as each file is recorded, so the manifest is complete
+    even if copying is interrupted. One manifest can be shared by several
+    threads.
+    """
+
+    #: Name, less the extension, which is the name of the hash, of the
+    #: manifest file used by :meth:`for_directory`.
+    DEFAULT_NAME = 'transfers'
+
+    def __init__(self, path, algorithm=HASH_ALGORITHM):
+        hashlib.new(algorithm)  # fail early on an unknown hash
+        self._path = path
+        self._algorithm = algorithm
+        self._directory = os.path.dirname(os.path.abspath(path))
+        self._lock = threading.Lock()
+        self._file = io.open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def for_directory(cls, directory, algorithm=HASH_ALGORITHM):
+        """
+        Manifest kept in `directory`, e.g. ``transfers.sha1``.
+        """
+        return cls(os.path.join(directory,
+                                cls.DEFAULT_NAME + '.' + algorithm),
+                   algorithm=algorithm)
+
+    @property
+    def path(self):
+        """
+        str, Name of the manifest file.
+        """
+        return self._path
+
+    @property
+    def algorithm(self):
+        """
+        str, Name of the hash.
+        """
+        return self._algorithm
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Close the manifest file.
+        """
+        self._file.close()
+
+    def record(self, path, digest):
+        """
+        Add the hash of a file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+        digest : str
+            Hexadecimal digest of its contents.
+        """
+        relative = os.path.relpath(os.path.abspath(path), self._directory)
+        with self._lock:
+            self._file.write('{0}  {1}\n'.format(digest, relative))
+            self._file.flush()
+
+    def read(self):
+        """
+        Hashes recorded so far.
+
+        Returns
+        -------
+        dict
+            Hexadecimal digest of each file, keyed by its path relative to
+            the directory of the manifest.
+        """
+        with self._lock:
+            self._file.flush()
+        digests = {}
+        with io.open(self._path, encoding='utf-8') as f:
+            for line in f:
+                digest, _, relative = line.rstrip('\n').partition('  ')
+                if relative:
+                    digests[relative] = digest
+        return digests
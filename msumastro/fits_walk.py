@@ -0,0 +1,171 @@
+"""
+Finding the directories of an archive that contain FITS files.
+
+The archive is walked with ``os.scandir``, which returns the type of each
+entry along with its name, so no extra ``stat`` call is needed per file.
+Hidden directories, like ``.git``, and any directories the caller excludes
+are not descended into.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import OrderedDict
+import logging
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    # python 2, which has scandir only as a separate package
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FITS_EXTENSIONS', 'MANIFEST_SUFFIX', 'is_fits_name',
+           'fits_files', 'walk_fits_directories', 'source_directories']
+
+#: Extensions of the files treated as FITS files, as in ImageFileCollection.
+FITS_EXTENSIONS = ['fit', 'fits', 'fts']
+
+_SUFFIXES = tuple('.' + extension + compression
+                  for extension in FITS_EXTENSIONS
+                  for compression in ['', '.gz', '.bz2'])
+
+#: Ending of the name of a manifest saved as a FITS table, which is not an
+#: image; see :mod:`msumastro.manifest`.
+MANIFEST_SUFFIX = '.manifest.fits'
+
+
+def is_fits_name(name):
+    """
+    Whether a file name has one of the FITS extensions, possibly compressed
+    with gzip or bzip2, and is not the name of a manifest.
+    """
+    return name.endswith(_SUFFIXES) and not name.endswith(MANIFEST_SUFFIX)
+
+
+def _entries(directory, follow_links):
+    """
+    Names of the subdirectories and of the FITS files in a directory.
+    """
+    subdirectories = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_dir(follow_symlinks=follow_links):
+                subdirectories.append(entry.name)
+            elif is_fits_name(entry.name) and entry.is_file():
+                files.append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            full_name = os.path.join(directory, name)
+            if os.path.isdir(full_name):
+                if follow_links or not os.path.islink(full_name):
+                    subdirectories.append(name)
+            elif is_fits_name(name) and os.path.isfile(full_name):
+                files.append(name)
+    return sorted(subdirectories), sorted(files)
+
+
+def fits_files(directory):
+    """
+    Names, in sorted order, of the FITS files in a directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to list; subdirectories are not searched.
+
+    Returns
+    -------
+    list of str
+    """
+    return _entries(directory, False)[1]
+
+
+def walk_fits_directories(root, exclude=None, follow_links=False):
+    """
+    Find the directories under a root directory that contain FITS files.
+
+    Parameters
+    ----------
+    root : str
+        Directory at which to start; it is included if it contains FITS
+        files.
+    exclude : list of str, optional
+        Directories that are neither returned nor descended into.
+    follow_links : bool, optional
+        If ``True``, descend into symbolic links to directories.
+
+    Yields
+    ------
+    directory : str
+        Path of a directory, starting with `root`, that contains FITS
+        files. Directories are yielded in sorted, depth-first order.
+    files : list of str
+        Names of the FITS files in `directory`, sorted.
+    """
+    excluded = set(os.path.realpath(d) for d in exclude or [])
+    # Directories already walked, so that links cannot cause a loop.
+    seen = set()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        real_directory = os.path.realpath(directory)
+        if real_directory in seen:
+            continue
+        seen.add(real_directory)
+        try:
+            subdirectories, files = _entries(directory, follow_links)
+        except OSError as e:
+            # e.g. permission denied; skip rather than abandon the walk.
+            logger.warning('Unable to list directory %s: %s', directory, e)
+            continue
+        if files:
+            yield directory, files
+        # Reversed so that the first subdirectory is walked first.
+        for name in reversed(subdirectories):
+            path = os.path.join(directory, name)
+            if name.startswith('.') or os.path.realpath(path) in excluded:
+                continue
+            stack.append(path)
+
+
+def source_directories(roots, exclude=None, recursive=False):
+    """
+    Directories whose files are gathered into one tree, e.g. by sorting.
+
+    Parameters
+    ----------
+    roots : list of str
+        Directories given by the user.
+    exclude : list of str, optional
+        Directories not to include when `recursive` is ``True``, such as the
+        one the tree is made in.
+    recursive : bool, optional
+        If ``True``, include every directory below `roots` that contains
+        FITS files instead of only `roots` themselves.
+
+    Returns
+    -------
+    OrderedDict
+        Each directory and a prefix that tells its files apart from files
+        of the same name in the others: its path relative to the root it is
+        in, or the name of the root itself, with ``_`` for each separator.
+    """
+    prefixes = OrderedDict()
+    for root in roots:
+        if recursive:
+            found = [d for d, _ in walk_fits_directories(root,
+                                                         exclude=exclude)]
+        else:
+            found = [root]
+        for directory in found:
+            relative = os.path.relpath(directory, root)
+            if relative == os.curdir:
+                relative = os.path.basename(os.path.abspath(root))
+            prefixes[directory] = relative.replace(os.sep, '_')
+    return prefixes
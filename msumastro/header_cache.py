@@ -0,0 +1,234 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import logging
+import os
+import sqlite3
+import zlib
+
+from astropy.io import fits
+
+from .header_scanner import read_header_bytes
+
+__all__ = ['HeaderCache', 'read_raw_header']
+
+logger = logging.getLogger(__name__)
+
+
+def read_raw_header(file_name, ext=0):
+    """
+    Header cards of one extension of a FITS file, as stored in the cache.
+
+    The header is read with the scanner, or with astropy if the scanner
+    cannot read the file.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the FITS file.
+    ext : int, optional
+        Extension whose header is wanted.
+
+    Returns
+    -------
+    bytes
+        The header cards, 80 bytes each.
+    """
+    try:
+        return read_header_bytes(file_name, ext=ext)
+    except (ValueError, IOError, EOFError):
+        # Let astropy deal with anything the scanner cannot read.
+        return fits.getheader(file_name, ext).tostring().encode('ascii')
+
+
+class HeaderCache(object):
+    """
+    Cache of FITS headers, stored in SQLite and keyed by file stat.
+
+    Each entry holds the header of one extension of one file as the raw
+    80-character cards, compressed. An entry is used only if the size and
+    modification time of the file are unchanged since the header was stored,
+    so files that are modified are read again automatically.
+
+    Parameters
+    ----------
+    path : str
+        Name of the SQLite file holding the cache; created if it does not
+        exist.
+
+    Attributes
+    ----------
+    path
+    hits : int
+        Number of headers served from the cache.
+    misses : int
+        Number of headers that had to be read from their file.
+    """
+
+    #: Name of the cache file used by :meth:`for_directory`.
+    DEFAULT_NAME = '.msumastro_headers.sqlite'
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS headers (
+            file TEXT NOT NULL,
+            ext INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            header BLOB NOT NULL,
+            PRIMARY KEY (file, ext)
+        );
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.executescript(self._SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_directory(cls, directory):
+        """
+        Cache kept in a hidden file in `directory`.
+        """
+        return cls(os.path.join(directory, cls.DEFAULT_NAME))
+
+    @property
+    def path(self):
+        """
+        str, Name of the cache file.
+        """
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Save any changes and close the cache.
+        """
+        self._connection.commit()
+        self._connection.close()
+
+    @staticmethod
+    def _key(file_name):
+        return os.path.abspath(file_name)
+
+    def raw_header(self, file_name, ext=0, stat=None):
+        """
+        Cached header cards, or ``None`` if the cache is missing or stale.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the FITS file.
+        ext : int, optional
+            Extension whose header is wanted.
+        stat : os.stat_result, optional
+            Result of ``os.stat`` for the file, if already known.
+
+        Returns
+        -------
+        bytes or None
+            The header cards, 80 bytes each, ending with ``END``.
+        """
+        stat = stat or os.stat(file_name)
+        row = self._connection.execute(
+            'SELECT size, mtime, header FROM headers '
+            'WHERE file = ? AND ext = ?',
+            (self._key(file_name), ext)).fetchone()
+        if (row is None or row[0] != stat.st_size or
+                row[1] != stat.st_mtime):
+            return None
+        return zlib.decompress(row[2])
+
+    def store(self, file_name, raw, ext=0, stat=None):
+        """
+        Add or replace the header of a file in the cache.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the FITS file.
+        raw : bytes
+            Header cards, 80 bytes each.
+        ext : int, optional
+            Extension the header came from.
+        stat : os.stat_result, optional
+            Result of ``os.stat`` for the file when the header was read.
+        """
+        stat = stat or os.stat(file_name)
+        self._connection.execute(
+            'INSERT OR REPLACE INTO headers (file, ext, size, mtime, header) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (self._key(file_name), ext, stat.st_size, stat.st_mtime,
+             sqlite3.Binary(zlib.compress(raw))))
+
+    def header_bytes(self, file_name, ext=0):
+        """
+        Raw header of a FITS file, from the cache if possible.
+
+        The file is read, and the cache updated, only if the file is not
+        in the cache or has changed since it was cached.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the FITS file.
+        ext : int, optional
+            Extension whose header is wanted.
+
+        Returns
+        -------
+        bytes
+            The header cards, 80 bytes each, ending with ``END``.
+        """
+        stat = os.stat(file_name)
+        raw = self.raw_header(file_name, ext=ext, stat=stat)
+        if raw is not None:
+            self.hits += 1
+            return raw
+        self.misses += 1
+        raw = read_raw_header(file_name, ext=ext)
+        self.store(file_name, raw, ext=ext, stat=stat)
+        return raw
+
+    def header(self, file_name, ext=0):
+        """
+        Header of a FITS file, from the cache if possible.
+
+        See :meth:`header_bytes` for the parameters.
+
+        Returns
+        -------
+        astropy.io.fits.Header
+        """
+        raw = self.header_bytes(file_name, ext=ext)
+        return fits.Header.fromstring(raw.decode('ascii', 'replace'))
+
+    def prune(self, directory, keep):
+        """
+        Remove entries for files in a directory that are not in a list.
+
+        Parameters
+        ----------
+        directory : str
+            Directory whose entries are checked; entries for files in other
+            directories are not touched.
+        keep : list of str
+            Names of the files in `directory` whose entries are kept.
+        """
+        directory = self._key(directory)
+        keep = set(self._key(os.path.join(directory, f)) for f in keep)
+        cached = self._connection.execute(
+            'SELECT DISTINCT file FROM headers').fetchall()
+        stale = [(name,) for name, in cached
+                 if (os.path.dirname(name) == directory and
+                     name not in keep)]
+        if stale:
+            logger.debug('Removing %d files from header cache', len(stale))
+            self._connection.executemany(
+                'DELETE FROM headers WHERE file = ?', stale)
@@ -8,3 +8,4 @@ except ImportError:
     pass
 from .patchers import *
 from .astrometry import *
+from .ledger import *
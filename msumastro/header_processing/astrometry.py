@@ -3,17 +3,70 @@ from __future__ import (print_function, division, absolute_import,
 
 import logging
 import subprocess
-from os import path, remove, rename
+from os import path, remove, rename, stat
 import tempfile
+import time
 from textwrap import dedent
 
+from astropy.io import fits
 from astropy.extern import six
 
-__all__ = ['call_astrometry', 'add_astrometry']
+from .ledger import file_hash as ledger_file_hash
+
+__all__ = ['call_astrometry', 'add_astrometry', 'ledger_options']
 
 logger = logging.getLogger(__name__)
 
 
+# Names accepted by the camera argument of add_astrometry, mapped to the
+# name of the instrument class in feder.
+CAMERAS = {
+    'celestron': 'CelestronNightscape10100',
+    'u9': 'ApogeeAltaU9',
+    'cp16': 'ApogeeAspenCG16'
+}
+
+_instruments_by_fits_name = {}
+
+
+def _instrument_for_image(filename, camera=None):
+    """
+    Find the instrument that took an image.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the FITS file.
+    camera : str, optional
+        One of the keys of `CAMERAS`; if given the header is not read.
+
+    Returns
+    -------
+    `~msumastro.header_processing.feder.Instrument` or None
+        ``None`` if the instrument cannot be determined.
+    """
+    from . import feder
+
+    if camera:
+        return getattr(feder, CAMERAS[camera])()
+
+    if not _instruments_by_fits_name:
+        # Building Feder is not cheap, so do it once per process.
+        _instruments_by_fits_name.update(feder.Feder().instruments)
+
+    try:
+        instrument_name = fits.getheader(filename)['instrume']
+    except (KeyError, IOError):
+        return None
+
+    try:
+        return _instruments_by_fits_name[instrument_name]
+    except KeyError:
+        logger.warning('Unknown instrument %s, using default settings for '
+                       'astrometry', instrument_name)
+        return None
+
+
 def call_astrometry(filename, sextractor=False,
                     custom_sextractor_config=False, feder_settings=True,
                     no_plots=True, minimal_output=True,
@@ -159,7 +212,10 @@ def call_astrometry(filename, sextractor=False,
         log_level = logging.DEBUG
     except subprocess.CalledProcessError as e:
         return_status = e.returncode
-        solve_field_output = 'Output from astrometry.net:\n' + e.output
+        output = e.output
+        if isinstance(output, six.binary_type):
+            output = output.decode('utf-8', 'replace')
+        solve_field_output = 'Output from astrometry.net:\n' + output
         log_level = logging.WARN
         logger.warning('Adding astrometry failed for %s', filename)
         raise e
@@ -167,6 +223,55 @@ def call_astrometry(filename, sextractor=False,
     return return_status
 
 
+def _solve_field_options(instrument, avoid_pyfits=False):
+    """
+    Options for ``solve-field`` that come from the instrument, and all of
+    the additional options passed to it.
+    """
+    instrument_options = []
+    if instrument is not None:
+        instrument_options = instrument.astrometry_options()
+
+    if avoid_pyfits:
+        pyfits_options = '--no-remove-lines --uniformize 0'
+    else:
+        pyfits_options = ''
+
+    return instrument_options, ' '.join(instrument_options + [pyfits_options])
+
+
+def ledger_options(filename, ra_dec=None, custom_sextractor=False,
+                   odds_ratio=None, camera='', avoid_pyfits=False,
+                   instrument=None):
+    """
+    Options recorded in a ledger for an attempt to solve a file.
+
+    These are the options :func:`add_astrometry` records, so they can be
+    passed to
+    :meth:`~msumastro.header_processing.ledger.AstrometryLedger.is_unsolvable`
+    to ask whether a file failed to solve with the same settings.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the FITS file.
+    ra_dec, custom_sextractor, odds_ratio, camera, avoid_pyfits, instrument
+        As for :func:`add_astrometry`.
+
+    Returns
+    -------
+    dict
+    """
+    if instrument is None:
+        instrument = _instrument_for_image(filename, camera=camera)
+    _, additional_opts = _solve_field_options(instrument,
+                                              avoid_pyfits=avoid_pyfits)
+    return {'ra_dec': ra_dec,
+            'solve_field': additional_opts,
+            'custom_sextractor': custom_sextractor,
+            'odds_ratio': odds_ratio}
+
+
 def add_astrometry(filename, overwrite=False, ra_dec=None,
                    note_failure=False, save_wcs=False,
                    verify=None, try_builtin_source_finder=False,
@@ -174,7 +279,10 @@ def add_astrometry(filename, overwrite=False, ra_dec=None,
                    odds_ratio=None,
                    astrometry_config=None,
                    camera='',
-                   avoid_pyfits=False):
+                   avoid_pyfits=False,
+                   instrument=None,
+                   ledger=None,
+                   file_hash=None):
     """Add WCS headers to FITS file using astrometry.net
 
     Parameters
@@ -201,8 +309,24 @@ def add_astrometry(filename, overwrite=False, ra_dec=None,
         See :func:`call_astrometry`
 
     camera : str, one of ['celestron', 'u9', 'cp16'], optional
-        Name of camera; determines the pixel scale used in the solved. Default
-        is to use `'u9'`.
+        Name of camera; determines the pixel scale and downsampling used in
+        the solve. Default is to determine the camera from the ``INSTRUME``
+        keyword in the header of the file.
+
+    instrument : `~msumastro.header_processing.feder.Instrument`, optional
+        Instrument which took the image; overrides `camera` and the
+        ``INSTRUME`` keyword. Its
+        :meth:`~msumastro.header_processing.feder.Instrument.astrometry_options`
+        supply the pixel scale, downsampling and any other hints for the solve.
+        If no instrument can be determined the plate scale of the Apogee Alta
+        U9 is used.
+
+    ledger : `~msumastro.header_processing.ledger.AstrometryLedger`, optional
+        If given, each attempt to solve the file is recorded in the ledger.
+
+    file_hash : str, optional
+        Hash of the contents of the file, used when recording attempts in
+        the `ledger`; computed if not given.
 
     avoid_pyfits : bool
         Add arguments to solve-field to avoid calls to pyfits.BinTableHDU.
@@ -227,31 +351,29 @@ def add_astrometry(filename, overwrite=False, ra_dec=None,
     """
     base, ext = path.splitext(filename)
 
-    # All are in arcsec per pixel, values are approximate
-    camera_pixel_scales = {
-        'celestron': 0.3,
-        'u9': 0.55,
-        'cp16': 0.55
-    }
+    if instrument is None:
+        instrument = _instrument_for_image(filename, camera=camera)
 
-    if camera:
-        use_feder = False
-        scale = camera_pixel_scales[camera]
-        scale_options = ("--scale-low {low} --scale-high {high} "
-                         "--scale-units arcsecperpix".format(low=0.8*scale, high=1.2 * scale))
-    else:
-        use_feder = True
-        scale_options = ''
+    if instrument is not None:
+        logger.debug('Using astrometry settings for %s', instrument.name)
 
-    if avoid_pyfits:
-        pyfits_options = '--no-remove-lines --uniformize 0'
-    else:
-        pyfits_options = ''
+    instrument_options, additional_opts = \
+        _solve_field_options(instrument, avoid_pyfits=avoid_pyfits)
 
-    additional_opts = ' '.join([scale_options,
-                                pyfits_options])
+    # Fall back to the Feder plate scale if the instrument provides none.
+    use_feder = not any('--scale-low' in opt for opt in instrument_options)
+
+    if ledger is not None:
+        # The file as it was before the attempt.
+        file_stat = stat(filename)
+        if file_hash is None:
+            file_hash = ledger_file_hash(filename)
+
+    # Each attempt is (strategy, start time, duration, exit code).
+    attempts = []
 
     logger.info('BEGIN ADDING ASTROMETRY on {0}'.format(filename))
+    started = time.time()
     try:
         logger.debug('About to call call_astrometry')
         solved_field = (call_astrometry(filename,
@@ -264,23 +386,34 @@ def add_astrometry(filename, overwrite=False, ra_dec=None,
                                         feder_settings=use_feder,
                                         additional_args=additional_opts)
                         == 0)
+        exit_code = 0
     except subprocess.CalledProcessError as e:
         logger.debug('Failed with error')
         failed_details = e.output
         solved_field = False
+        exit_code = e.returncode
+    attempts.append(('sextractor', started, time.time() - started,
+                     exit_code))
 
     if (not solved_field) and try_builtin_source_finder:
         log_msg = 'Astrometry failed using sextractor, trying built-in '
         log_msg += 'source finder'
         logger.info(log_msg)
+        started = time.time()
         try:
             solved_field = (call_astrometry(filename, ra_dec=ra_dec,
                                             overwrite=True,
-                                            save_wcs=save_wcs, verify=verify)
+                                            save_wcs=save_wcs, verify=verify,
+                                            feder_settings=use_feder,
+                                            additional_args=additional_opts)
                             == 0)
+            exit_code = 0
         except subprocess.CalledProcessError as e:
             failed_details = e.output
             solved_field = False
+            exit_code = e.returncode
+        attempts.append(('builtin', started, time.time() - started,
+                         exit_code))
 
     if solved_field:
         logger.info('Adding astrometry succeeded')
@@ -317,6 +450,31 @@ def add_astrometry(filename, overwrite=False, ra_dec=None,
             logger.error('Unable to save output of astrometry.net %s', e)
             pass
 
+    if ledger is not None:
+        center = None
+        if solved_field:
+            solution = filename if overwrite else base + '.new'
+            try:
+                header = fits.getheader(solution)
+                center = (header['crval1'], header['crval2'])
+            except (IOError, KeyError):
+                pass
+        options = ledger_options(filename, ra_dec=ra_dec,
+                                 custom_sextractor=custom_sextractor,
+                                 odds_ratio=odds_ratio,
+                                 avoid_pyfits=avoid_pyfits,
+                                 instrument=instrument)
+        for n, (strategy, started, duration, exit_code) in \
+                enumerate(attempts):
+            succeeded = solved_field and (n == len(attempts) - 1)
+            ledger.record(filename, hash=file_hash, options=options,
+                          strategy=strategy, started=started,
+                          duration=duration, exit_code=exit_code,
+                          solved=succeeded,
+                          center=center if succeeded else None,
+                          size=file_stat.st_size,
+                          mtime=file_stat.st_mtime)
+
     logger.info('END ADDING ASTROMETRY for %s', filename)
     return solved_field
 
@@ -81,6 +81,20 @@ class Instrument(object):
         starts at 1, includes endpoint, and uses FITS NAXIS1, NAXIS2 for
         order of indices).
 
+    pixel_scale : float, optional
+        Approximate plate scale, in arcseconds per pixel, of images taken
+        with this instrument at Feder Observatory. Used to limit the range of
+        scales searched when adding astrometry.
+
+    downsample : int, optional
+        Factor by which astrometry.net should downsample images from this
+        instrument before extracting sources. Large images solve much faster,
+        with no loss of accuracy, when downsampled.
+
+    solve_hints : list of str, optional
+        Any additional options to pass to astrometry.net ``solve-field``
+        for images from this instrument.
+
     Examples
     --------
 
@@ -100,7 +114,10 @@ class Instrument(object):
                  rows=0, columns=0,
                  image_unit=None,
                  trim_region=None,
-                 useful_overscan_region=None):
+                 useful_overscan_region=None,
+                 pixel_scale=None,
+                 downsample=None,
+                 solve_hints=None):
         self.name = name
         self.fits_names = fits_names
         self.rows = rows
@@ -108,6 +125,36 @@ class Instrument(object):
         self.image_unit = image_unit
         self.trim_region = trim_region
         self.useful_overscan = useful_overscan_region
+        self.pixel_scale = pixel_scale
+        self.downsample = downsample
+        self.solve_hints = solve_hints or []
+
+    def astrometry_options(self, scale_tolerance=0.2):
+        """
+        Options for astrometry.net ``solve-field`` suited to this instrument
+
+        Parameters
+        ----------
+        scale_tolerance : float, optional
+            Fractional range around `pixel_scale` searched by
+            ``solve-field``.
+
+        Returns
+        -------
+        list of str
+            Options for ``solve-field``; the list is empty if nothing is
+            known about the instrument.
+        """
+        options = []
+        if self.pixel_scale is not None:
+            options.append('--scale-low {low} --scale-high {high} '
+                           '--scale-units arcsecperpix'.format(
+                               low=(1 - scale_tolerance) * self.pixel_scale,
+                               high=(1 + scale_tolerance) * self.pixel_scale))
+        if self.downsample is not None and self.downsample > 1:
+            options.append('--downsample {0}'.format(self.downsample))
+        options.extend(self.solve_hints)
+        return options
 
     def has_overscan(self, image_dimensions):
         """
@@ -167,7 +214,8 @@ class ApogeeAltaU9(Instrument):
                             rows=2048, columns=3085,
                             useful_overscan_region='[3076:3079, :]',
                             trim_region='[1:3073, :]',
-                            image_unit=u.adu)
+                            image_unit=u.adu,
+                            pixel_scale=0.55)
 
 
 class SBIGSpectrometer(Instrument):
@@ -186,7 +234,8 @@ class CelestronNightscape10100(Instrument):
     def __init__(self):
         Instrument.__init__(self, "Celestron Nightscape 10100",
                             fits_names=["Celestron Nightscape 10100"],
-                            image_unit=u.adu)
+                            image_unit=u.adu,
+                            pixel_scale=0.3)
 
 
 class ApogeeAspenCG16(Instrument):
@@ -200,7 +249,9 @@ class ApogeeAspenCG16(Instrument):
             rows=4096, columns=4109,
             useful_overscan_region='[4096:4109]',
             trim_region='[1:4096, :]',
-            image_unit=u.adu
+            image_unit=u.adu,
+            pixel_scale=0.55,
+            downsample=2
         )
 
 
@@ -0,0 +1,306 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from astropy.table import Table, MaskedColumn
+
+__all__ = ['AstrometryLedger', 'file_hash']
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time when hashing a file.
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(filename):
+    """
+    SHA1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest.
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _masked_column(values, name):
+    """
+    Column in which ``None`` values from the database are masked.
+    """
+    present = [v for v in values if v is not None]
+    fill = type(present[0])() if present else 0.0
+    return MaskedColumn(data=[fill if v is None else v for v in values],
+                        mask=[v is None for v in values],
+                        name=name)
+
+
+class AstrometryLedger(object):
+    """
+    Record of every attempt to add astrometry to a file, kept in SQLite.
+
+    Parameters
+    ----------
+    path : str
+        Name of the SQLite database file; it is created if it does not exist.
+        Use ``':memory:'`` for a ledger that is not saved.
+
+    Notes
+    -----
+    Each attempt records the file name, a hash of the file contents before
+    the solve, the options passed to ``solve-field``, the strategy (the
+    source extractor used), the start time and duration in seconds, the exit
+    code of ``solve-field``, whether the field was solved, for solved
+    fields the RA/Dec (in degrees) of the center of the image, and the size
+    and modification time of the file before the solve.
+
+    Because the hash identifies the contents of a file, a frame that failed
+    to solve is recognized even if it has been copied or renamed. The size
+    and modification time let a caller hash only files that may be in the
+    ledger; see :meth:`has_attempts`.
+    """
+
+    COLUMNS = ['file', 'hash', 'options', 'strategy', 'started', 'duration',
+               'exit_code', 'solved', 'ra', 'dec', 'size', 'mtime']
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT NOT NULL,
+            hash TEXT,
+            options TEXT,
+            strategy TEXT,
+            started REAL,
+            duration REAL,
+            exit_code INTEGER,
+            solved INTEGER,
+            ra REAL,
+            dec REAL,
+            size INTEGER,
+            mtime REAL
+        );
+        CREATE INDEX IF NOT EXISTS attempts_hash ON attempts (hash);
+        CREATE INDEX IF NOT EXISTS attempts_file ON attempts (file);
+        CREATE INDEX IF NOT EXISTS attempts_stat ON attempts (size, mtime);
+    """
+
+    def __init__(self, path):
+        self._path = path
+        # A generous timeout lets several processes share one ledger.
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.executescript(self._SCHEMA)
+
+    @property
+    def path(self):
+        """
+        str, Name of the database file.
+        """
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        self._connection.close()
+
+    def record(self, file, hash=None, options=None, strategy=None,
+               duration=None, exit_code=None, solved=False, center=None,
+               started=None, size=None, mtime=None):
+        """
+        Add one attempt to the ledger.
+
+        Parameters
+        ----------
+        file : str
+            Name of the file.
+        hash : str, optional
+            Hash of the file contents before the attempt; see
+            :func:`file_hash`.
+        options : dict or str, optional
+            Options used for the solve; a dict is stored as JSON.
+        strategy : str, optional
+            Name of the solve strategy, e.g. ``'sextractor'``.
+        duration : float, optional
+            Length of the attempt in seconds.
+        exit_code : int, optional
+            Exit code of ``solve-field``.
+        solved : bool, optional
+            Whether the field was solved.
+        center : tuple of float, optional
+            (RA, Dec), in degrees, of the center of the solved image.
+        started : float, optional
+            Start time as seconds since the epoch; default is the current
+            time minus `duration`.
+        size : int, optional
+            Size of the file, in bytes, before the attempt.
+        mtime : float, optional
+            Modification time of the file before the attempt.
+        """
+        if isinstance(options, dict):
+            options = json.dumps(options, sort_keys=True)
+        if started is None:
+            started = time.time() - (duration or 0)
+        ra, dec = center if center is not None else (None, None)
+        with self._connection:
+            self._connection.execute(
+                'INSERT INTO attempts ({0}) VALUES ({1})'.format(
+                    ', '.join(self.COLUMNS),
+                    ', '.join('?' * len(self.COLUMNS))),
+                (file, hash, options, strategy, started, duration,
+                 exit_code, int(bool(solved)), ra, dec, size, mtime))
+
+    def has_attempts(self, size, mtime):
+        """
+        Whether any attempt was on a file of this size and modification
+        time.
+
+        Checking this first avoids hashing files that cannot be in the
+        ledger; a file for which it is ``True`` must still be hashed to be
+        sure it is one of those attempted.
+        """
+        row = self._connection.execute(
+            'SELECT 1 FROM attempts WHERE size = ? AND mtime = ? LIMIT 1',
+            (size, mtime)).fetchone()
+        return row is not None
+
+    def is_solved(self, hash):
+        """
+        Whether any attempt on a file with this hash succeeded.
+        """
+        row = self._connection.execute(
+            'SELECT 1 FROM attempts WHERE hash = ? AND solved = 1 LIMIT 1',
+            (hash,)).fetchone()
+        return row is not None
+
+    def is_unsolvable(self, hash, options=None):
+        """
+        Whether a file is known to fail to solve.
+
+        Parameters
+        ----------
+        hash : str
+            Hash of the file contents.
+        options : dict or str, optional
+            If given, only failures with these options count.
+
+        Returns
+        -------
+        bool
+            ``True`` if every recorded attempt for the hash failed and there
+            is at least one such attempt.
+        """
+        query = ('SELECT COUNT(*), SUM(solved) FROM attempts '
+                 'WHERE hash = ?')
+        parameters = [hash]
+        if options is not None:
+            if isinstance(options, dict):
+                options = json.dumps(options, sort_keys=True)
+            query += ' AND options = ?'
+            parameters.append(options)
+        n_attempts, n_solved = \
+            self._connection.execute(query, parameters).fetchone()
+        return n_attempts > 0 and not n_solved
+
+    def expected_duration(self, hash, default=None):
+        """
+        Expected time, in seconds, to attempt a solve of a file.
+
+        The mean duration of previous attempts on the same file is used if
+        there are any, then the mean over all attempts in the ledger, then
+        `default`.
+        """
+        for query, parameters in [
+                ('SELECT AVG(duration) FROM attempts WHERE hash = ?',
+                 (hash,)),
+                ('SELECT AVG(duration) FROM attempts', ())]:
+            mean, = self._connection.execute(query, parameters).fetchone()
+            if mean is not None:
+                return mean
+        return default
+
+    def attempts(self, file=None, solved=None):
+        """
+        Attempts in the ledger, oldest first.
+
+        Parameters
+        ----------
+        file : str, optional
+            Only include attempts for files whose name contains this string.
+        solved : bool, optional
+            If given, only include attempts that did (``True``) or did not
+            (``False``) solve.
+
+        Returns
+        -------
+        astropy.table.Table
+            One row per attempt with columns given by `COLUMNS`.
+        """
+        conditions = []
+        parameters = []
+        if file is not None:
+            conditions.append('file LIKE ?')
+            parameters.append('%{0}%'.format(file))
+        if solved is not None:
+            conditions.append('solved = ?')
+            parameters.append(int(bool(solved)))
+        query = 'SELECT {0} FROM attempts'.format(', '.join(self.COLUMNS))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id'
+        rows = self._connection.execute(query, parameters).fetchall()
+        if not rows:
+            return Table(names=self.COLUMNS)
+        columns = [_masked_column(values, name)
+                   for values, name in zip(zip(*rows), self.COLUMNS)]
+        return Table(columns)
+
+    def summary(self):
+        """
+        Totals and throughput for the attempts in the ledger.
+
+        Returns
+        -------
+        dict
+            Number of attempts, distinct files, solved and unsolvable files,
+            mean attempt duration in seconds and solved files per hour over
+            the time spanned by the ledger.
+        """
+        connection = self._connection
+        n_attempts, n_files, first, last, mean_duration = connection.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT hash), MIN(started), '
+            'MAX(started + duration), AVG(duration) FROM attempts'
+        ).fetchone()
+        n_solved, = connection.execute(
+            'SELECT COUNT(DISTINCT hash) FROM attempts WHERE solved = 1'
+        ).fetchone()
+        n_unsolvable, = connection.execute(
+            'SELECT COUNT(*) FROM (SELECT hash FROM attempts GROUP BY hash '
+            'HAVING SUM(solved) = 0)'
+        ).fetchone()
+        span = (last - first) if n_attempts else 0
+        return {'attempts': n_attempts,
+                'files': n_files,
+                'solved': n_solved,
+                'unsolvable': n_unsolvable,
+                'mean_duration': mean_duration,
+                'solved_per_hour': (3600 * n_solved / span) if span else None}
@@ -524,7 +524,8 @@ def patch_headers(dir=None,
                   add_apparent_pos=True,
                   add_overscan=True,
                   fix_imagetype=True,
-                  add_unit=True):
+                  add_unit=True,
+                  files=None):
     """
     Add minimal information to Feder FITS headers.
 
@@ -567,12 +568,17 @@ def patch_headers(dir=None,
 
     add_unit : bool, optional
         If ``True``, add image unit to FITS header.
+
+    files : list of str, optional
+        Names of the files in `dir` to patch. Default is all of the FITS
+        files in `dir`.
     """
     dir = dir or '.'
     if new_file_ext is None:
         new_file_ext = 'new'
 
-    images = ImageFileCollection(location=dir, keywords=['imagetyp'])
+    images = ImageFileCollection(location=dir, keywords=['imagetyp'],
+                                 filenames=files)
 
     for header, fname in images.headers(save_with_name=new_file_ext,
                                         save_location=save_location,
@@ -667,7 +673,8 @@ def add_object_info(directory=None,
                     object_list_dir=None,
                     match_radius=20.0, new_file_ext=None,
                     save_location=None,
-                    overwrite=False, detailed_history=True):
+                    overwrite=False, detailed_history=True,
+                    files=None, objects=None):
     """
     Add object information to FITS files that contain pointing information
     given a list of objects.
@@ -701,6 +708,15 @@ def add_object_info(directory=None,
 
     overwrite : bool, optional
         Set to `True` to replace the original files.
+
+    files : list of str, optional
+        Names of the files in `directory` to which object information
+        should be added. Default is all of the FITS files in `directory`.
+
+    objects : tuple, optional
+        Object names and coordinates already read with
+        :func:`read_object_list`, as it returns them. If given, `object_list`
+        and `object_list_dir` are ignored.
     """
     directory = directory or '.'
     if new_file_ext is None:
@@ -708,22 +724,24 @@ def add_object_info(directory=None,
 
     images = ImageFileCollection(directory,
                                  keywords=['imagetyp', 'ra',
-                                           'dec', 'object'])
+                                           'dec', 'object'],
+                                 filenames=files)
     im_table = images.summary
 
     object_dir = directory if object_list_dir is None else object_list_dir
 
-    logger.debug('About to read object list')
-    try:
-        object_names, ra_dec = read_object_list(object_dir,
-                                                input_list=object_list)
-    except IOError:
-        warn_msg = 'No object list in directory {0}, skipping.'
-        logger.warn(warn_msg.format(directory))
-        return
-    except name_resolve.NameResolveError:
-        logger.error('Unable to add objects--name resolve error')
-        return
+    if objects is None:
+        logger.debug('About to read object list')
+        try:
+            objects = read_object_list(object_dir, input_list=object_list)
+        except IOError:
+            warn_msg = 'No object list in directory {0}, skipping.'
+            logger.warn(warn_msg.format(directory))
+            return
+        except name_resolve.NameResolveError:
+            logger.error('Unable to add objects--name resolve error')
+            return
+    object_names, ra_dec = objects
 
     object_names = np.array(object_names)
 
@@ -0,0 +1,76 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ..astrometry import add_astrometry
+
+
+@pytest.fixture
+def light_file(tmpdir):
+    hdu = fits.PrimaryHDU(np.zeros([20, 30], dtype=np.uint16))
+    hdu.header['imagetyp'] = 'LIGHT'
+    hdu.header['instrume'] = 'Apogee Alta'
+    hdu.header['ra'] = '14:03:12.58'
+    hdu.header['dec'] = '+54:20:55.50'
+    name = tmpdir.join('light.fit').strpath
+    hdu.writeto(name)
+    return name
+
+
+def test_add_astrometry_overwrites_file_with_solution(fake_solve_field,
+                                                      light_file):
+    header = fits.getheader(light_file)
+    assert add_astrometry(light_file, ra_dec=(header['ra'], header['dec']),
+                          overwrite=True)
+    solved = fits.getheader(light_file)
+    assert solved['ctype1'] == 'RA---TAN'
+    np.testing.assert_allclose(solved['crval1'], 210.802, atol=1e-3)
+    base, _ = os.path.splitext(light_file)
+    # add_astrometry cleans up after astrometry.net
+    for ext in ['.axy', '.solved', '.new', '.failed']:
+        assert not os.path.exists(base + ext)
+
+
+def test_add_astrometry_keeps_wcs_if_requested(fake_solve_field, light_file):
+    assert add_astrometry(light_file, overwrite=True, save_wcs=True)
+    base, _ = os.path.splitext(light_file)
+    wcs = fits.getheader(base + '.wcs')
+    assert wcs['wcsaxes'] == 2
+
+
+def test_add_astrometry_notes_failure(fake_solve_field, light_file,
+                                      monkeypatch):
+    monkeypatch.setenv(str('FAKE_SOLVE_FIELD_FAILURE_RATE'), str('1'))
+    original = fits.getheader(light_file)
+    assert not add_astrometry(light_file, overwrite=True, note_failure=True)
+    base, _ = os.path.splitext(light_file)
+    with open(base + '.failed', 'rb') as f:
+        assert b'Did not solve' in f.read()
+    assert fits.getheader(light_file) == original
+
+
+@pytest.mark.parametrize('instrume,downsample', [
+    ('Apogee Alta', False),
+    ('Apogee Aspen CG16M', True),
+])
+def test_add_astrometry_uses_instrument_settings(fake_solve_field,
+                                                 light_file, monkeypatch,
+                                                 instrume, downsample):
+    from .. import astrometry
+
+    fits.setval(light_file, 'instrume', value=instrume)
+    calls = []
+
+    def record_call(filename, **kwd):
+        calls.append(kwd)
+        return 0
+
+    monkeypatch.setattr(astrometry, 'call_astrometry', record_call)
+    astrometry.add_astrometry(light_file)
+    assert not calls[0]['feder_settings']
+    assert ('--downsample 2' in calls[0]['additional_args']) == downsample
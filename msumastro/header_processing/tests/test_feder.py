@@ -39,3 +39,15 @@ def test_apogee_aspen_fits_names():
 def test_sbig_celestron_has_no_overscan(instrument):
     feder_obj = Feder()
     assert not feder_obj.instruments[instrument].has_overscan([])
+
+
+def test_aspen_astrometry_options_downsample():
+    options = ' '.join(ApogeeAspenCG16().astrometry_options())
+    assert '--downsample 2' in options
+    assert '--scale-low' in options
+
+
+def test_alta_astrometry_options_do_not_downsample():
+    options = ' '.join(ApogeeAltaU9().astrometry_options(scale_tolerance=0.1))
+    assert '--downsample' not in options
+    assert '--scale-low 0.495' in options
@@ -0,0 +1,77 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import pytest
+
+from ..ledger import AstrometryLedger, file_hash
+
+
+@pytest.fixture
+def ledger(tmpdir, request):
+    led = AstrometryLedger(tmpdir.join('ledger.sqlite').strpath)
+    request.addfinalizer(led.close)
+    return led
+
+
+def test_file_hash_depends_on_contents(tmpdir):
+    one = tmpdir.join('one.fit')
+    one.write('abc')
+    two = tmpdir.join('two.fit')
+    two.write('abc')
+    assert file_hash(one.strpath) == file_hash(two.strpath)
+    two.write('abd')
+    assert file_hash(one.strpath) != file_hash(two.strpath)
+
+
+def test_ledger_unsolvable_and_solved(ledger):
+    ledger.record('a.fit', hash='a', strategy='sextractor', duration=2,
+                  exit_code=1, solved=False)
+    ledger.record('b.fit', hash='b', strategy='sextractor', duration=4,
+                  exit_code=1, solved=False)
+    ledger.record('b.fit', hash='b', strategy='builtin', duration=6,
+                  exit_code=0, solved=True, center=(10.0, 20.0))
+    assert ledger.is_unsolvable('a')
+    assert not ledger.is_unsolvable('b')
+    assert not ledger.is_unsolvable('never seen')
+    assert ledger.is_solved('b')
+    assert not ledger.is_solved('a')
+
+
+def test_ledger_unsolvable_with_options(ledger):
+    ledger.record('a.fit', hash='a', options={'downsample': 2},
+                  duration=1, exit_code=1)
+    assert ledger.is_unsolvable('a', options={'downsample': 2})
+    assert not ledger.is_unsolvable('a', options={'downsample': 4})
+
+
+def test_ledger_has_attempts_by_size_and_time(ledger):
+    ledger.record('a.fit', hash='a', duration=1, size=2880, mtime=10.5)
+    assert ledger.has_attempts(2880, 10.5)
+    assert not ledger.has_attempts(2880, 11.0)
+    assert not ledger.has_attempts(5760, 10.5)
+
+
+def test_ledger_expected_duration(ledger):
+    assert ledger.expected_duration('a', default=3) == 3
+    ledger.record('a.fit', hash='a', duration=2)
+    ledger.record('a.fit', hash='a', duration=4)
+    ledger.record('b.fit', hash='b', duration=9)
+    assert ledger.expected_duration('a') == 3
+    assert ledger.expected_duration('unknown') == 5
+
+
+def test_ledger_attempts_and_summary(ledger):
+    ledger.record('night1/a.fit', hash='a', duration=2, exit_code=1,
+                  started=0)
+    ledger.record('night2/b.fit', hash='b', duration=2, exit_code=0,
+                  solved=True, center=(1.0, 2.0), started=10)
+    assert len(ledger.attempts()) == 2
+    failed = ledger.attempts(solved=False)
+    assert list(failed['file']) == ['night1/a.fit']
+    assert failed['ra'].mask[0]
+    assert len(ledger.attempts(file='night2')) == 1
+    summary = ledger.summary()
+    assert summary['attempts'] == 2
+    assert summary['solved'] == 1
+    assert summary['unsolvable'] == 1
+    assert summary['solved_per_hour'] == pytest.approx(300)
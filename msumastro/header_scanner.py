@@ -0,0 +1,372 @@
+"""
+Fast, minimal reading of FITS headers.
+
+Building a summary of a directory of images needs only a handful of
+keywords from each file, but `astropy.io.fits` parses every card of every
+header and sets up its HDU machinery to do so. The functions here instead
+read the header 2880 bytes at a time, stop at the ``END`` card, keep only
+the cards for the keywords requested and convert a value from its FITS
+representation only when it is asked for.
+
+Only the subset of the FITS standard needed for reading header values is
+implemented: string (including ``CONTINUE`` long strings), logical,
+integer, floating point and complex values, commentary cards and
+``HIERARCH`` keywords. Files compressed with gzip or bzip2 are read as a
+stream, so only the compressed bytes up to the end of the header are
+decompressed.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import bz2
+from collections import OrderedDict
+import gzip
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from astropy.extern import six
+
+__all__ = ['ScannedHeader', 'read_header_bytes', 'scan_header',
+           'parse_value', 'compression']
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+_END_CARD = b'END' + b' ' * 77
+_COMMENTARY = set(['COMMENT', 'HISTORY', ''])
+
+# Leading bytes of each compressed format, and how to open it for streaming.
+_COMPRESSION = [(b'\x1f\x8b', 'gzip', gzip.GzipFile),
+                (b'BZh', 'bzip2', bz2.BZ2File)]
+
+
+def _card_keyword(card):
+    """
+    Keyword of a card and the position at which its value starts.
+
+    Returns
+    -------
+    keyword : str
+        Upper case keyword.
+    value_start : int or None
+        Index of the first character after the value indicator, or
+        ``None`` if the card has no value.
+    """
+    keyword = card[:8].rstrip().upper()
+    if keyword == 'HIERARCH':
+        equals = card.find('=')
+        if equals < 0:
+            return keyword, None
+        return ' '.join(card[9:equals].split()).upper(), equals + 1
+    if card[8:10] == '= ':
+        return keyword, 10
+    return keyword, None
+
+
+def _parse_string(field):
+    """
+    Value of a quoted FITS string and the remainder of the field.
+    """
+    chars = []
+    i = field.index("'") + 1
+    while i < len(field):
+        if field[i] == "'":
+            if field[i + 1:i + 2] == "'":
+                chars.append("'")
+                i += 2
+                continue
+            break
+        chars.append(field[i])
+        i += 1
+    return ''.join(chars).rstrip(), field[i + 1:]
+
+
+def _continues(field):
+    """
+    Whether a value field is a string continued on a ``CONTINUE`` card.
+    """
+    if "&'" not in field:
+        return False
+    stripped = field.lstrip()
+    return (stripped.startswith("'") and
+            _parse_string(stripped)[0].endswith('&'))
+
+
+def parse_value(field):
+    """
+    Convert the value field of a card to a python value.
+
+    Parameters
+    ----------
+    field : str
+        The part of the card after the value indicator ``= ``.
+
+    Returns
+    -------
+    str, bool, int, float, complex or None
+        ``None`` is returned for an undefined value.
+    """
+    stripped = field.lstrip()
+    if stripped.startswith("'"):
+        return _parse_string(stripped)[0]
+
+    value = stripped.split('/', 1)[0].strip()
+    if not value:
+        return None
+    if value == 'T':
+        return True
+    if value == 'F':
+        return False
+    if value.startswith('('):
+        real, imaginary = value.strip('()').split(',')
+        return complex(parse_value(real), parse_value(imaginary))
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value.replace('D', 'E').replace('d', 'e'))
+    except ValueError:
+        # Not valid FITS, so return it as it is rather than failing.
+        return value
+
+
+class ScannedHeader(Mapping):
+    """
+    Read-only, case-insensitive mapping of keywords to header values.
+
+    Values are converted from their FITS representation the first time they
+    are accessed. Commentary keywords (``COMMENT``, ``HISTORY``) map to a
+    list of strings. Repeated keywords keep their first value, which is also
+    what summaries of image collections use.
+
+    Parameters
+    ----------
+    cards : list of str
+        80-character header cards.
+    keywords : iterable, optional
+        Keywords to keep; all keywords are kept if omitted. Items can be
+        strings or objects with a ``names`` attribute, like
+        `~msumastro.header_processing.fitskeyword.FITSKeyword`, in which
+        case all of the names (i.e. the keyword and its synonyms) are kept.
+    """
+    def __init__(self, cards, keywords=None):
+        wanted = _keyword_set(keywords)
+        self._raw = OrderedDict()
+        self._values = {}
+        continuing = None
+        for card in cards:
+            keyword, value_start = _card_keyword(card)
+            if keyword == 'CONTINUE' and continuing is not None:
+                self._raw[continuing].append(card[8:])
+                if not _continues(card[8:]):
+                    continuing = None
+                continue
+            continuing = None
+            if wanted is not None and keyword not in wanted:
+                continue
+            if keyword in _COMMENTARY or value_start is None:
+                if keyword in _COMMENTARY:
+                    self._raw.setdefault(keyword, []).append(card[8:])
+                continue
+            if keyword in self._raw:
+                continue
+            self._raw[keyword] = [card[value_start:]]
+            if _continues(card[value_start:]):
+                continuing = keyword
+
+    @classmethod
+    def from_bytes(cls, raw, keywords=None):
+        """
+        Header from the raw bytes of a FITS header.
+        """
+        if not isinstance(raw, six.text_type):
+            raw = raw.decode('ascii', 'replace')
+        cards = []
+        for start in range(0, len(raw), CARD_SIZE):
+            card = raw[start:start + CARD_SIZE]
+            if card.startswith('END') and not card[3:].strip():
+                break
+            cards.append(card)
+        return cls(cards, keywords=keywords)
+
+    def _value(self, keyword):
+        fields = self._raw[keyword]
+        if keyword in _COMMENTARY:
+            return [field.rstrip() for field in fields]
+        value = parse_value(fields[0])
+        for continued in fields[1:]:
+            # Each part but the last of a long string ends with "&".
+            value = value[:-1] + parse_value(continued)
+        return value
+
+    def __getitem__(self, keyword):
+        keyword = keyword.upper()
+        try:
+            return self._values[keyword]
+        except KeyError:
+            value = self._values[keyword] = self._value(keyword)
+            return value
+
+    def __contains__(self, keyword):
+        return keyword.upper() in self._raw
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def items(self):
+        """
+        (keyword, value) pairs in header order.
+
+        Each line of a commentary keyword is a separate pair, as in
+        `astropy.io.fits.Header`.
+        """
+        for keyword in self._raw:
+            value = self[keyword]
+            if keyword in _COMMENTARY:
+                for line in value:
+                    yield keyword, line
+            else:
+                yield keyword, value
+
+    iteritems = items
+
+
+def _keyword_set(keywords):
+    if keywords is None:
+        return None
+    if isinstance(keywords, six.string_types):
+        keywords = [keywords]
+    wanted = set()
+    for keyword in keywords:
+        names = getattr(keyword, 'names', [keyword])
+        if '*' in names:
+            return None
+        wanted.update(name.upper() for name in names)
+    return wanted
+
+
+def _read_one_header(f):
+    """
+    Raw bytes of the header starting at the current position of `f`.
+    """
+    blocks = []
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if len(block) < BLOCK_SIZE:
+            raise ValueError('File ended before END card of header')
+        if not blocks and not (block.startswith(b'SIMPLE') or
+                               block.startswith(b'XTENSION')):
+            raise ValueError('Not a FITS header')
+        blocks.append(block)
+        # END must start at a card boundary
+        position = block.find(_END_CARD)
+        while position >= 0:
+            if position % CARD_SIZE == 0:
+                return b''.join(blocks)
+            position = block.find(_END_CARD, position + 1)
+
+
+def _data_size(header):
+    """
+    Size, in bytes and including padding, of the data following a header.
+    """
+    naxis = header.get('NAXIS', 0)
+    if not naxis:
+        return 0
+    n_elements = 1
+    for axis in range(1, naxis + 1):
+        n_elements *= header['NAXIS{0}'.format(axis)]
+    size = (abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1) *
+            (header.get('PCOUNT', 0) + n_elements))
+    return BLOCK_SIZE * ((size + BLOCK_SIZE - 1) // BLOCK_SIZE)
+
+
+def compression(file_name):
+    """
+    Compression of a file, determined from its first bytes.
+
+    Returns
+    -------
+    str or None
+        ``'gzip'``, ``'bzip2'`` or ``None`` if the file is not compressed.
+    """
+    with open(file_name, 'rb') as f:
+        start = f.read(3)
+    for magic, name, _ in _COMPRESSION:
+        if start.startswith(magic):
+            return name
+    return None
+
+
+def _open(file_name):
+    """
+    Open a file for reading, decompressing it on the fly if needed.
+    """
+    kind = compression(file_name)
+    for _, name, opener in _COMPRESSION:
+        if kind == name:
+            return opener(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+def read_header_bytes(file_name, ext=0):
+    """
+    Raw header of one HDU of a FITS file, reading no more than needed.
+
+    Files compressed with gzip or bzip2 are decompressed as a stream, which
+    stops once the header has been read.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the FITS file.
+    ext : int, optional
+        Index of the HDU whose header is wanted.
+
+    Returns
+    -------
+    bytes
+        The header, a multiple of 2880 bytes long, ending with the block that
+        contains the ``END`` card.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a FITS file or ends early.
+    """
+    size_keywords = ['NAXIS', 'BITPIX', 'PCOUNT', 'GCOUNT'] + \
+        ['NAXIS{0}'.format(i) for i in range(1, 1000)]
+    with _open(file_name) as f:
+        for _ in range(ext):
+            header = ScannedHeader.from_bytes(_read_one_header(f),
+                                              keywords=size_keywords)
+            # For compressed files this decompresses and discards the data.
+            f.seek(_data_size(header), 1)
+        return _read_one_header(f)
+
+
+def scan_header(file_name, keywords=None, ext=0):
+    """
+    Scan the header of a FITS file for some keywords.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the FITS file.
+    keywords : iterable, optional
+        Keywords to extract; see `ScannedHeader`. Default is all keywords.
+    ext : int, optional
+        Index of the HDU whose header is scanned.
+
+    Returns
+    -------
+    ScannedHeader
+    """
+    return ScannedHeader.from_bytes(read_header_bytes(file_name, ext=ext),
+                                    keywords=keywords)
@@ -1,19 +1,308 @@
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import listdir, path
 import logging
+import sqlite3
 import warnings
 
+from astropy.io import fits
+from astropy.extern import six
+from astropy.table import Column
 from ccdproc import ImageFileCollection as RealIFC
 
+from .fits_walk import FITS_EXTENSIONS, MANIFEST_SUFFIX
+from .header_cache import HeaderCache
+from .header_scanner import ScannedHeader, scan_header, read_header_bytes
+
 logger = logging.getLogger(__name__)
 
-__all__ = ['ImageFileCollection']
+# Endings of the names of compressed files whose headers are read without
+# astropy; judging by name saves opening every uncompressed file twice.
+_COMPRESSED_SUFFIXES = ('.gz', '.bz2')
+
+__all__ = ['ImageFileCollection', 'directory_summary']
 
 
 class ImageFileCollection(RealIFC):
+    """
+    ccdproc's ImageFileCollection, with an optional persistent header cache
+    and a choice of header reader.
+
+    All arguments are passed to `ccdproc.ImageFileCollection` except for
+
+    Parameters
+    ----------
+    header_cache : bool or str, optional
+        If ``True``, keep the headers used to build the summary in a cache
+        file in `location` (see
+        :meth:`~msumastro.header_cache.HeaderCache.for_directory`); if a
+        string, use it as the name of the cache file. Files whose size and
+        modification time have not changed since they were cached are not
+        opened when the summary is built. Default is to not use a cache.
+    engine : {'astropy', 'scanner'}, optional
+        How headers are read to build the summary. ``'astropy'`` parses the
+        whole header with `astropy.io.fits`; ``'scanner'`` uses
+        :func:`~msumastro.header_scanner.scan_header`, which reads only the
+        header blocks and converts only the values of the keywords in the
+        summary, and is much faster. Files the scanner cannot read are read
+        with astropy. With either engine, headers of files compressed with
+        gzip or bzip2 are read without decompressing the rest of the file.
+        Default is ``'astropy'``.
+    filenames : list of str, optional
+        Names of the files in `location` to include in the collection;
+        others are ignored. Default is every FITS file in `location`.
+    raw_headers : dict, optional
+        Primary headers already read, e.g. by other processes, keyed by the
+        absolute path of each file. Each value is the header cards, as from
+        :func:`~msumastro.header_cache.read_raw_header`, and the result of
+        ``os.stat`` for the file when they were read. These files are not
+        opened, and their headers are added to the header cache if there is
+        one.
+    header_rows : dict, optional
+        Values from the primary headers of files already read and parsed,
+        e.g. by other processes, keyed by the absolute path of each file, as
+        in `header_rows` of another collection. These files are not opened,
+        nor added to the header cache.
+
+    Attributes
+    ----------
+    header_rows : dict
+        Values from the header of each file in the summary, keyed by the
+        absolute path of the file; keywords are lower case, as in the
+        summary.
+
+    Manifests saved as FITS tables by ``run_triage.py`` are not images, and
+    are never part of the collection.
+    """
+    ENGINES = ('astropy', 'scanner')
+
     def __init__(self, *arg, **kwd):
+        self._header_cache_setting = kwd.pop('header_cache', None)
+        self._header_cache = None
+        self._engine = kwd.pop('engine', None) or 'astropy'
+        if self._engine not in self.ENGINES:
+            raise ValueError('Unknown header engine '
+                             '{0}'.format(self._engine))
+        self._scan_keywords = None
+        self._filenames = kwd.pop('filenames', None)
+        self._raw_headers = kwd.pop('raw_headers', None) or {}
+        self._given_rows = kwd.pop('header_rows', None) or {}
+        self.header_rows = OrderedDict()
         warnings.warn("ImageFileCollection will be removed from msumastro "
                       "in the next release. Import it from ccdproc instead.",
                       DeprecationWarning)
         super(ImageFileCollection, self).__init__(*arg, **kwd)
+
+    def _fits_files_in_directory(self, extensions=None, compressed=True):
+        files = super(ImageFileCollection, self)._fits_files_in_directory(
+            extensions=extensions, compressed=compressed)
+        if (compressed and self.location and
+                not getattr(self, '_find_fits_by_reading', False)):
+            # ccdproc lists gzipped files but not bzip2-compressed ones,
+            # whose headers can be read just as well.
+            bz2_suffixes = tuple('.' + extension + '.bz2' for extension in
+                                 extensions or FITS_EXTENSIONS)
+            listed = set(files)
+            files = sorted(files + [f for f in listdir(self.location)
+                                    if f.endswith(bz2_suffixes) and
+                                    f not in listed])
+        files = [f for f in files if not f.endswith(MANIFEST_SUFFIX)]
+        if self._filenames is None:
+            return files
+        wanted = set(self._filenames)
+        return [f for f in files if f in wanted]
+
+    def _open_header_cache(self):
+        setting = self._header_cache_setting
+        if not setting:
+            return None
+        try:
+            if isinstance(setting, six.string_types):
+                return HeaderCache(setting)
+            if self.location:
+                return HeaderCache.for_directory(self.location)
+        except sqlite3.Error as e:
+            # e.g. the directory is read-only; carry on without a cache.
+            logger.warning('Unable to use header cache: %s', e)
+        return None
+
+    @contextmanager
+    def _reading_headers(self, header_keywords):
+        """
+        Set up the header cache and scanner keywords while headers are read.
+        """
+        self._header_cache = self._open_header_cache()
+        self._scan_keywords = header_keywords
+        try:
+            yield
+        finally:
+            if self._header_cache is not None:
+                logger.debug('Header cache %s: %d hits, %d misses',
+                             self._header_cache.path,
+                             self._header_cache.hits,
+                             self._header_cache.misses)
+                # Only a collection of the whole directory knows which
+                # cached files are gone.
+                if self.location and self._filenames is None:
+                    self._header_cache.prune(self.location, self.files)
+                self._header_cache.close()
+                self._header_cache = None
+
+    def _fits_summary(self, header_keywords):
+        self.header_rows = OrderedDict()
+        with self._reading_headers(header_keywords):
+            return super(ImageFileCollection,
+                         self)._fits_summary(header_keywords)
+
+    def _read_header(self, file_name):
+        """
+        Header of a file, from the header cache if one is in use, read with
+        the engine chosen for this collection.
+        """
+        # Older versions of ccdproc always read the primary header.
+        ext = getattr(self, 'ext', 0)
+        read = None
+        if ext == 0:
+            read = self._raw_headers.get(path.abspath(file_name))
+        if read is not None:
+            raw, stat = read
+            if self._header_cache is not None:
+                self._header_cache.store(file_name, raw, ext=ext, stat=stat)
+            if self._engine == 'scanner':
+                return ScannedHeader.from_bytes(raw,
+                                                keywords=self._scan_keywords)
+            return fits.Header.fromstring(raw.decode('ascii', 'replace'))
+        if self._engine == 'scanner':
+            try:
+                if self._header_cache is not None:
+                    raw = self._header_cache.header_bytes(file_name, ext)
+                    return ScannedHeader.from_bytes(
+                        raw, keywords=self._scan_keywords)
+                return scan_header(file_name, keywords=self._scan_keywords,
+                                   ext=ext)
+            except (ValueError, IOError, EOFError) as e:
+                # Not FITS, or a damaged compressed file
+                logger.debug('Scanner could not read %s (%s); using '
+                             'astropy', file_name, e)
+        if self._header_cache is not None:
+            return self._header_cache.header(file_name, ext)
+        if file_name.endswith(_COMPRESSED_SUFFIXES):
+            # astropy would decompress far more than the header.
+            try:
+                raw = read_header_bytes(file_name, ext=ext)
+                return fits.Header.fromstring(raw.decode('ascii', 'replace'))
+            except (ValueError, IOError, EOFError):
+                pass
+        return fits.getheader(file_name, ext)
+
+    def _dict_from_fits_header(self, file_name, input_summary=None,
+                               missing_marker=None):
+        """
+        Construct an ordered dictionary whose keys are the header keywords
+        and values are a list of the values from this file and the input
+        dictionary.
+
+        This follows the ccdproc implementation but gets the values of the
+        header through :func:`_header_row`, or from `header_rows` given when
+        the collection was made.
+        """
+        if input_summary is None:
+            summary = OrderedDict()
+            n_previous = 0
+        else:
+            summary = input_summary
+            n_previous = len(summary['file'])
+
+        full_path = path.abspath(file_name)
+        row = self._given_rows.get(full_path)
+        if row is None:
+            row = _header_row(self._read_header(file_name))
+        self.header_rows[full_path] = row
+
+        # Read the header before this so that file name is only added if
+        # file is valid FITS
+        try:
+            summary['file'].append(path.basename(file_name))
+        except KeyError:
+            summary['file'] = [path.basename(file_name)]
+
+        missing_in_this_file = [k for k in summary if (k not in row and
+                                                       k != 'file')]
+
+        for k, v in six.iteritems(row):
+            try:
+                summary[k].append(v)
+            except KeyError:
+                summary[k] = [missing_marker] * n_previous
+                summary[k].append(v)
+
+        for missing in missing_in_this_file:
+            summary[missing].append(missing_marker)
+
+        return summary
+
+
+def _header_row(header):
+    """
+    Values of the keywords in a header as they go into a summary.
+
+    Keywords are lower case and only the first value of a repeated keyword
+    is kept, except that all of the ``COMMENT`` and ``HISTORY`` cards are
+    each joined into one value, as in ccdproc.
+    """
+    row = OrderedDict()
+    multi_entry_keys = {'comment': [],
+                        'history': []}
+    for k, v in six.iteritems(header):
+        if k == '':
+            continue
+
+        k = k.lower()
+
+        if k in multi_entry_keys:
+            multi_entry_keys[k].append(str(v))
+        elif k not in row:
+            # Any other repeated keyword is probably a mistake; keep the
+            # first value.
+            row[k] = v
+
+    for k, v in six.iteritems(multi_entry_keys):
+        if v:
+            row[k] = ','.join(v)
+    return row
+
+
+def directory_summary(directory, keywords, header_cache=False,
+                      engine='astropy'):
+    """
+    Summary of the FITS files in a directory, with the path of each file.
+
+    Parameters
+    ----------
+    directory : str
+        Directory whose files are summarized.
+    keywords : list of str
+        Keywords in the summary.
+    header_cache, engine
+        See :class:`ImageFileCollection`.
+
+    Returns
+    -------
+    `~astropy.table.Table` or None
+        The summary of an :class:`ImageFileCollection` of `directory` with
+        the ``file`` column changed to the path of each file, so that tables
+        of several directories can be stacked; ``None`` if the directory has
+        no FITS files.
+    """
+    images = ImageFileCollection(directory, keywords=keywords,
+                                 header_cache=header_cache, engine=engine)
+    if not images.files:
+        return None
+    table = images.summary
+    table.replace_column('file', Column(
+        data=[path.join(directory, f) for f in table['file']],
+        name='file'))
+    return table
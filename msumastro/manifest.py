@@ -0,0 +1,237 @@
+"""
+Writing and reading the manifest of a directory made by triage.
+
+The manifest has one row per FITS file and one column per header keyword.
+It has always been written as comma-separated text, which is slow to read
+back when there are many rows or columns. The binary formats here preserve
+column types and can be read one column at a time:
+
++ ``fits``: a FITS binary table; read with memory mapping, so only the
+  columns asked for are read from disk. Its name ends in ``.manifest.fits``
+  so that it is not mistaken for an image.
++ ``ecsv``: text, but with the type of each column recorded in a header so
+  that reading it does not involve guessing.
++ ``hdf5``: requires ``h5py``.
++ ``parquet``: requires ``pandas`` and ``pyarrow``.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+from astropy.table import Table, MaskedColumn, vstack
+
+from .fits_walk import MANIFEST_SUFFIX
+
+__all__ = ['MANIFEST_FORMATS', 'available_formats', 'manifest_name',
+           'stack_tables', 'write_manifest', 'read_manifest']
+
+#: Manifest formats and the extension of files in each format.
+MANIFEST_FORMATS = OrderedDict([('ascii', '.txt'),
+                                ('ecsv', '.ecsv'),
+                                ('fits', MANIFEST_SUFFIX),
+                                ('hdf5', '.hdf5'),
+                                ('parquet', '.parquet')])
+
+# Packages, beyond astropy, needed to write or read each format.
+_REQUIRES = {'hdf5': ['h5py'],
+             'parquet': ['pandas', 'pyarrow']}
+
+# Name of the table inside an HDF5 manifest.
+_HDF5_PATH = 'manifest'
+
+
+def available_formats():
+    """
+    Manifest formats that can be used with the packages installed.
+
+    Returns
+    -------
+    list of str
+    """
+    formats = []
+    for format in MANIFEST_FORMATS:
+        try:
+            for package in _REQUIRES.get(format, []):
+                __import__(package)
+        except ImportError:
+            continue
+        formats.append(format)
+    return formats
+
+
+def manifest_name(file_name, format):
+    """
+    Name of the manifest file in a format.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the manifest in ``ascii`` format, e.g. ``Manifest.txt``.
+    format : str
+        One of the keys of `MANIFEST_FORMATS`.
+
+    Returns
+    -------
+    str
+        `file_name` for the ``ascii`` format, otherwise `file_name` with its
+        extension replaced by the one for `format`.
+    """
+    if format == 'ascii':
+        return file_name
+    return path.splitext(file_name)[0] + MANIFEST_FORMATS[format]
+
+
+def _format_from_name(file_name):
+    lower_name = file_name.lower()
+    for format, format_extension in MANIFEST_FORMATS.items():
+        if lower_name.endswith(format_extension):
+            return format
+    extension = path.splitext(lower_name)[1]
+    if extension in ['.fit', '.fits', '.fts']:
+        return 'fits'
+    if extension in ['.h5']:
+        return 'hdf5'
+    return 'ascii'
+
+
+def _string_column(column):
+    """
+    Column converted to strings, with ``''`` where it is masked.
+    """
+    mask = np.ma.getmaskarray(column)
+    data = ['' if m else str(v) for v, m in zip(column, mask)]
+    return MaskedColumn(data=data, mask=mask, name=column.name)
+
+
+def _binary_ready(table):
+    """
+    Copy of a table with any object columns converted to strings.
+
+    Used for every format except ``ascii``.
+
+    Headers can give a column values of more than one type, in which case it
+    ends up with ``object`` dtype, which binary formats cannot store.
+    """
+    table = Table(table, masked=True, copy=False)
+    for name in table.colnames:
+        if table[name].dtype.kind == 'O':
+            table.replace_column(name, _string_column(table[name]))
+    return table
+
+
+def stack_tables(tables):
+    """
+    Stack summary tables from several directories into one.
+
+    Parameters
+    ----------
+    tables : list of `~astropy.table.Table`
+        Tables to stack, e.g. the manifests of several directories.
+
+    Returns
+    -------
+    `~astropy.table.Table`
+        Columns are matched by name; where a table does not have a column
+        its rows are masked. A column that holds strings in some tables and
+        other values in others is converted to strings throughout.
+    """
+    kinds = {}
+    for table in tables:
+        for name in table.colnames:
+            kinds.setdefault(name, set()).add(table[name].dtype.kind)
+    as_strings = [name for name, kind in kinds.items()
+                  if 'O' in kind or (kind & set('SU') and kind - set('SU'))]
+    if as_strings:
+        converted = []
+        for table in tables:
+            table = Table(table, masked=True, copy=False)
+            for name in as_strings:
+                if name in table.colnames:
+                    table.replace_column(name, _string_column(table[name]))
+            converted.append(table)
+        tables = converted
+    return vstack(tables, join_type='outer', metadata_conflicts='silent')
+
+
+def write_manifest(table, file_name, format='ascii'):
+    """
+    Write a manifest table.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+        The manifest.
+    file_name : str
+        Name of the file to write; it is overwritten if it exists.
+    format : str, optional
+        One of the keys of `MANIFEST_FORMATS`.
+    """
+    if format == 'ascii':
+        table.write(file_name, format='ascii', delimiter=',')
+    elif format == 'ecsv':
+        _binary_ready(table).write(file_name, format='ascii.ecsv',
+                                   overwrite=True)
+    elif format == 'fits':
+        _binary_ready(table).write(file_name, format='fits', overwrite=True)
+    elif format == 'hdf5':
+        _binary_ready(table).write(file_name, format='hdf5',
+                                   path=_HDF5_PATH, serialize_meta=True,
+                                   overwrite=True)
+    elif format == 'parquet':
+        _binary_ready(table).to_pandas().to_parquet(file_name)
+    else:
+        raise ValueError('Unknown manifest format {0}'.format(format))
+
+
+def read_manifest(file_name, columns=None, format=None):
+    """
+    Read a manifest table, or some of its columns.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the manifest.
+    columns : list of str, optional
+        Names of the columns to read; default is all columns. For the
+        ``fits`` and ``parquet`` formats only these columns are read from
+        the file.
+    format : str, optional
+        One of the keys of `MANIFEST_FORMATS`; if omitted it is determined
+        from the extension of `file_name`.
+
+    Returns
+    -------
+    astropy.table.Table
+    """
+    format = format or _format_from_name(file_name)
+    include = {}
+    if columns is not None:
+        columns = list(columns)
+        include['include_names'] = columns
+
+    if format == 'ascii':
+        table = Table.read(file_name, format='ascii', delimiter=',',
+                           **include)
+    elif format == 'ecsv':
+        table = Table.read(file_name, format='ascii.ecsv', **include)
+    elif format == 'fits':
+        # Memory mapped, so only the columns copied below are read.
+        table = Table.read(file_name, format='fits', memmap=True)
+    elif format == 'hdf5':
+        table = Table.read(file_name, format='hdf5', path=_HDF5_PATH)
+    elif format == 'parquet':
+        import pandas
+        table = Table.from_pandas(pandas.read_parquet(file_name,
+                                                      columns=columns))
+    else:
+        raise ValueError('Unknown manifest format {0}'.format(format))
+
+    if columns is not None:
+        table = table[columns]
+    elif format == 'fits':
+        # Do not leave the table mapped to a file that may be rewritten.
+        table = Table(table, copy=True)
+    return table
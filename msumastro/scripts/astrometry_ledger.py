@@ -0,0 +1,93 @@
+"""
+DESCRIPTION
+-----------
+    Report on the astrometry ledger kept by ``run_astrometry.py --ledger``.
+
+    By default a summary is printed: the number of attempts, the number of
+    distinct files, how many of those solved or are known not to solve, the
+    mean time per attempt and the number of files solved per hour.
+
+    Individual attempts can be listed with ``--attempts``, optionally limited
+    to those that failed (``--failed``), those that solved (``--solved``) or
+    files whose name contains a string (``--file``).
+
+EXAMPLES
+--------
+
+    Summarize a ledger::
+
+        astrometry_ledger.py ledger.sqlite
+
+    List every failed attempt on files from one night::
+
+        astrometry_ledger.py --attempts --failed --file 2015-03-22 ledger.sqlite
+
+    To do the same from within python, do this::
+
+        from msumastro.scripts import astrometry_ledger
+        astrometry_ledger.main(['--attempts', '--failed',
+                                '--file', '2015-03-22', 'ledger.sqlite'])
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from argparse import ArgumentParser
+from os import path
+
+from ..header_processing.ledger import AstrometryLedger
+from . import script_helpers
+
+
+def construct_parser():
+    parser = ArgumentParser()
+    script_helpers.setup_parser_help(parser, __doc__)
+    parser.add_argument('ledger', help='Ledger file to report on')
+    parser.add_argument('-a', '--attempts', action='store_true',
+                        help='List individual attempts instead of a summary')
+    solved_group = parser.add_mutually_exclusive_group()
+    solved_group.add_argument('--failed', action='store_true',
+                              help='Only list attempts that did not solve')
+    solved_group.add_argument('--solved', action='store_true',
+                              help='Only list attempts that solved')
+    parser.add_argument('--file', default=None,
+                        help='Only list attempts for files whose name '
+                             'contains this string')
+    return parser
+
+
+def main(arglist=None):
+    """See script_helpers._main_function_docstring for actual documentation
+    """
+    parser = construct_parser()
+    args = parser.parse_args(arglist)
+
+    if not path.exists(args.ledger):
+        parser.error('No ledger named {0}'.format(args.ledger))
+
+    with AstrometryLedger(args.ledger) as ledger:
+        if args.attempts:
+            solved = None
+            if args.failed:
+                solved = False
+            elif args.solved:
+                solved = True
+            attempts = ledger.attempts(file=args.file, solved=solved)
+            attempts.remove_column('options')
+            attempts.pprint(max_lines=-1, max_width=-1)
+            return attempts
+
+        summary = ledger.summary()
+        labels = [('attempts', 'Attempts'),
+                  ('files', 'Files'),
+                  ('solved', 'Solved files'),
+                  ('unsolvable', 'Files that do not solve'),
+                  ('mean_duration', 'Mean seconds per attempt'),
+                  ('solved_per_hour', 'Files solved per hour')]
+        for key, label in labels:
+            value = summary[key]
+            if isinstance(value, float):
+                value = '{0:.2f}'.format(value)
+            print('{0:<26}{1}'.format(label + ':', value))
+        return summary
+
+main.__doc__ = script_helpers._main_function_docstring(__name__)
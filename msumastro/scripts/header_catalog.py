@@ -0,0 +1,155 @@
+"""
+DESCRIPTION
+-----------
+    Build, update and search an archive-wide catalog of FITS headers.
+
+    The catalog is an SQLite file; see
+    :class:`~msumastro.catalog.HeaderCatalog`. With ``--update`` every
+    directory below those given is cataloged; only files that are new or
+    have changed since the last update are read, and files that have been
+    removed are dropped from the catalog.
+
+    Otherwise the catalog is searched. Each search option narrows the
+    result; options that take two values select a range, and ``-`` can be
+    used for an open end. In text values ``*`` matches any characters. Any
+    other header keyword can be searched with ``--key KEYWORD=VALUE``. The
+    matching files are printed as a table, or just their paths with
+    ``--paths``.
+
+    ``run_triage.py --catalog`` also updates a catalog with each directory
+    it triages.
+
+EXAMPLES
+--------
+
+    Catalog an archive, or bring the catalog up to date::
+
+        header_catalog.py --update /data catalog.sqlite
+
+    All R-band flats taken with the Aspen in March 2015::
+
+        header_catalog.py --imagetyp flat --filter R --instrume '*aspen*' \\
+            --date-obs 2015-03-01 2015-04-01 catalog.sqlite
+
+    Every light frame of SZ Lyn at airmass below 1.5::
+
+        header_catalog.py --imagetyp light --object "SZ Lyn" \\
+            --airmass - 1.5 catalog.sqlite
+
+    To do the same from within python, do this::
+
+        from msumastro.catalog import HeaderCatalog
+        with HeaderCatalog('catalog.sqlite') as catalog:
+            lights = catalog.query(imagetyp='light', object='SZ Lyn',
+                                   airmass=(None, 1.5))
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from argparse import ArgumentParser
+import logging
+
+from ..catalog import HeaderCatalog
+from ..customlogger import console_handler
+from . import script_helpers
+
+logger = logging.getLogger()
+screen_handler = console_handler()
+logger.addHandler(screen_handler)
+
+
+def _value(text):
+    """
+    Number if `text` looks like one, otherwise `text`; ``-`` is ``None``.
+    """
+    if text == '-':
+        return None
+    for convert in [int, float]:
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def criteria_from_args(args):
+    """
+    Keyword arguments for :meth:`~msumastro.catalog.HeaderCatalog.query`.
+    """
+    criteria = {}
+    for name in ['imagetyp', 'object', 'filter', 'instrume']:
+        value = getattr(args, name)
+        if value:
+            criteria[name] = value if len(value) > 1 else value[0]
+    for name in ['exptime', 'date_obs', 'airmass', 'ra', 'dec']:
+        value = getattr(args, name)
+        if value:
+            criteria[name] = tuple(_value(v) for v in value)
+    for key_value in args.key:
+        key, value = key_value.split('=', 1)
+        criteria[key.strip().lower().replace('-', '_')] = _value(value)
+    return criteria
+
+
+def construct_parser():
+    parser = ArgumentParser()
+    script_helpers.setup_parser_help(parser, __doc__)
+    script_helpers.add_verbose(parser)
+    script_helpers.add_debug(parser)
+    script_helpers.add_console_output_args(parser)
+    parser.add_argument('catalog', help='Catalog file')
+    parser.add_argument('-u', '--update', nargs='+', metavar='DIR',
+                        help='Catalog the FITS files in these directories '
+                             'and every directory below them')
+    parser.add_argument('--no-recursive', action='store_true',
+                        help='With --update, catalog only the directories '
+                             'given, not those below them')
+
+    for name in ['imagetyp', 'object', 'filter', 'instrume']:
+        parser.add_argument('--' + name, action='append',
+                            help='Value of {0}, ignoring case, in which * '
+                                 'matches any characters; use more than once '
+                                 'to allow several'.format(name.upper()))
+    for name, help in [('exptime', 'Range of exposure times, in seconds'),
+                       ('date-obs', 'Range of dates, e.g. 2015-03-01 '
+                                    '2015-04-01'),
+                       ('airmass', 'Range of airmass'),
+                       ('ra', 'Range of RA, in degrees'),
+                       ('dec', 'Range of Dec, in degrees')]:
+        parser.add_argument('--' + name, nargs=2, metavar=('LOW', 'HIGH'),
+                            help=help)
+    parser.add_argument('-k', '--key', action='append', default=[],
+                        metavar='KEYWORD=VALUE',
+                        help='Value of any other keyword; use more than once '
+                             'for several keywords')
+    parser.add_argument('--paths', action='store_true',
+                        help='Print only the paths of matching files')
+    return parser
+
+
+def main(arglist=None):
+    """See script_helpers._main_function_docstring for actual documentation
+    """
+    parser = construct_parser()
+    args = parser.parse_args(arglist)
+    script_helpers.setup_logging(logger, args, screen_handler)
+
+    with HeaderCatalog(args.catalog) as catalog:
+        if args.update:
+            n_read = 0
+            for directory in args.update:
+                n_read += catalog.update(directory,
+                                         recursive=not args.no_recursive)
+            print('Read {0} headers; catalog has {1} '
+                  'files'.format(n_read, len(catalog)))
+            return n_read
+
+        matches = catalog.query(**criteria_from_args(args))
+        if args.paths:
+            for path in matches['path']:
+                print(path)
+        else:
+            matches.pprint(max_lines=-1, max_width=-1)
+        return matches
+
+main.__doc__ = script_helpers._main_function_docstring(__name__)
@@ -0,0 +1,173 @@
+"""
+DESCRIPTION
+-----------
+    Make views of the FITS files in some directories: trees like those
+    ``sort_files.py`` makes, but without copying or moving any file.
+
+    Each ``--view`` is a comma-separated list of keywords that make the
+    levels of the tree, outermost first, optionally preceded by a name for
+    the view and ``=``; the default name is the keywords joined by ``-``.
+    Besides header keywords, ``date`` (the date part of ``DATE-OBS``) can be
+    used. Each view is saved in a directory of that name in the destination
+    as a tree of symbolic links to the files (the default) or as an index
+    file, ``index.json`` or ``index.html``; see ``--format``.
+
+    Headers are kept in a cache in each directory, so making the views again
+    reads only files that are new or have changed, and only the links or
+    index files that need to change are changed.
+
+EXAMPLES
+--------
+
+    Three views of a night, by object, by date and image type, and by
+    instrument::
+
+        make_views.py -d /data/views/2015-03-10 \\
+            --view object,filter,exptime --view date,imagetyp \\
+            --view instrument=instrume /data/2015-03-10
+
+    An HTML index of a whole semester by object and filter::
+
+        make_views.py --recursive --format html -d /data/views \\
+            --view object,filter /data/2015-0*
+
+    To do the same from within python, do this::
+
+        from msumastro.scripts import make_views
+        make_views.main(['-d', '/data/views', '--view', 'object,filter',
+                         '/data/2015-03-10'])
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import OrderedDict
+import logging
+import os
+
+from ..customlogger import console_handler, add_file_handlers
+from ..file_transfer import makedirs
+from ..fits_walk import source_directories
+from ..image_collection import directory_summary
+from ..manifest import stack_tables
+from ..views import DERIVED_KEYS, VIEW_FORMATS, write_view
+from . import script_helpers
+
+logger = logging.getLogger()
+screen_handler = console_handler()
+logger.addHandler(screen_handler)
+
+
+def parse_view(spec):
+    """
+    Name and keys of a view given as ``[NAME=]KEY,KEY,...``.
+    """
+    name, _, keys = spec.rpartition('=')
+    keys = [key.strip().lower() for key in keys.split(',') if key.strip()]
+    if not keys:
+        raise ValueError('View {0} has no keys'.format(spec))
+    return name.strip() or '-'.join(keys), keys
+
+
+def make_views(directories, destination, views, format='symlink',
+               recursive=False, engine='astropy'):
+    """
+    Make views of the FITS files in some directories.
+
+    Parameters
+    ----------
+    directories : list of str
+        Directories whose files are in the views.
+    destination : str
+        Directory in which each view is saved, in a directory named after
+        the view.
+    views : dict
+        Name of each view and the list of keys that make its levels; see
+        :func:`~msumastro.views.view_tree`.
+    format : str, optional
+        How views are saved; one of `~msumastro.views.VIEW_FORMATS`.
+    recursive : bool, optional
+        If ``True``, also include the files in every directory below
+        `directories`.
+    engine : {'astropy', 'scanner'}, optional
+        How headers not already cached are read.
+
+    Returns
+    -------
+    int
+        Number of files in the views.
+    """
+    keywords = set()
+    for keys in views.values():
+        for key in keys:
+            keywords.add(DERIVED_KEYS[key][0] if key in DERIVED_KEYS
+                         else key)
+    keywords = sorted(keywords)
+
+    tables = []
+    directories = [os.path.normpath(d) for d in directories]
+    for directory in source_directories(directories, exclude=[destination],
+                                        recursive=recursive):
+        table = directory_summary(directory, keywords, header_cache=True,
+                                  engine=engine)
+        if table is not None:
+            tables.append(table)
+    if not tables:
+        logger.warning('No FITS files found')
+        return 0
+    table = tables[0] if len(tables) == 1 else stack_tables(tables)
+
+    for name, keys in views.items():
+        root = os.path.join(destination, name)
+        logger.info('Making view %s of %s', root, ', '.join(keys))
+        write_view(table, keys, root, format=format, title=name)
+    return len(table)
+
+
+def construct_parser():
+    parser = script_helpers.construct_default_parser(__doc__)
+    script_helpers.add_header_engine(parser)
+    parser.add_argument('--view', action='append', required=True,
+                        metavar='[NAME=]KEY,KEY,...',
+                        help='Keywords that make the levels of a view; use '
+                             'more than once for several views')
+    parser.add_argument('--format', choices=VIEW_FORMATS, default='symlink',
+                        help='symlink makes a tree of symbolic links, json '
+                             'and html write an index file. Default is '
+                             'symlink.')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Also include files in every directory below '
+                             'those given')
+    return parser
+
+
+def main(arglist=None):
+    """See script_helpers._main_function_docstring for actual documentation
+    """
+    parser = construct_parser()
+    args = parser.parse_args(arglist)
+    script_helpers.setup_logging(logger, args, screen_handler)
+
+    add_file_handlers(logger, os.getcwd(), 'make_views')
+
+    if args.destination_dir is None:
+        parser.error('--destination-dir is needed for the views')
+
+    views = OrderedDict()
+    for spec in args.view:
+        try:
+            name, keys = parse_view(spec)
+        except ValueError as e:
+            parser.error(str(e))
+        views[name] = keys
+
+    do_not_log_in_destination = \
+        script_helpers.handle_destination_dir_logging_check(args)
+    makedirs(args.destination_dir)
+    if not do_not_log_in_destination:
+        add_file_handlers(logger, args.destination_dir, 'make_views')
+
+    return make_views(args.dir, args.destination_dir, views,
+                      format=args.format, recursive=args.recursive,
+                      engine=args.header_engine)
+
+main.__doc__ = script_helpers._main_function_docstring(__name__)
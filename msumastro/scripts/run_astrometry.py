@@ -41,9 +41,9 @@ EXAMPLES
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
-import shutil
-from os import path, getcwd
+from os import path, getcwd, stat
 import logging
+from multiprocessing import Pool
 
 import numpy as np
 
@@ -54,10 +54,14 @@ from astropy.coordinates import SkyCoord
 from ccdproc import CCDData
 
 from ..customlogger import console_handler, add_file_handlers
+from ..file_transfer import copy_verified
 from ..header_processing import astrometry as ast
+from ..header_processing.ledger import (AstrometryLedger,
+                                        file_hash as ledger_file_hash)
 from .. import ImageFileCollection
 from .script_helpers import (construct_default_parser, setup_logging,
                              handle_destination_dir_logging_check,
+                             add_header_cache,
                              _main_function_docstring)
 
 logger = logging.getLogger()
@@ -65,6 +69,178 @@ screen_handler = console_handler()
 logger.addHandler(screen_handler)
 
 
+def _ra_dec(header, ignore_ra_dec=False):
+    """
+    RA/Dec from a header to guide the solve, or ``None`` if there are none.
+    """
+    if ignore_ra_dec:
+        return None
+    try:
+        return (header['ra'], header['dec'])
+    except KeyError:
+        return None
+
+
+def _astrometry_for_file(current_dir, light_file, working_dir,
+                         destination=None,
+                         blind=False,
+                         custom_sextractor=False,
+                         odds_ratio=None,
+                         astrometry_config=None,
+                         camera=None,
+                         avoid_pyfits=False,
+                         ignore_ra_dec=False,
+                         ledger=None,
+                         file_hash=None):
+    """
+    Add astrometry to a single light file.
+
+    See :func:`astrometry_for_directory` for a description of the options.
+
+    Returns
+    -------
+    bool
+        ``True`` if astrometry was added to the file.
+    """
+    if ((destination is not None) and (destination != current_dir)):
+        src = path.join(current_dir, light_file)
+        copy_verified(src, path.join(destination, light_file))
+
+    original_fname = path.join(working_dir, light_file)
+    img = CCDData.read(original_fname, unit='adu')
+    ra_dec = _ra_dec(img.header, ignore_ra_dec=ignore_ra_dec)
+
+    if (ra_dec is None) and (not blind):
+        root, ext = path.splitext(original_fname)
+        f = open(root + '.blind', 'wb')
+        f.close()
+        return False
+
+    record = AstrometryLedger(ledger) if ledger is not None else None
+    try:
+        astrometry = ast.add_astrometry(original_fname,
+                                        ra_dec=ra_dec,
+                                        note_failure=True,
+                                        overwrite=True,
+                                        custom_sextractor=custom_sextractor,
+                                        odds_ratio=odds_ratio,
+                                        astrometry_config=astrometry_config,
+                                        camera=camera,
+                                        avoid_pyfits=avoid_pyfits,
+                                        ledger=record,
+                                        file_hash=file_hash)
+    finally:
+        if record is not None:
+            record.close()
+
+    with fits.open(original_fname,
+                   do_not_scale_image_data=True) as f:
+        try:
+            del f[0].header['imageh'], f[0].header['imagew']
+            f.writeto(original_fname, overwrite=True)
+        except KeyError:
+            pass
+
+    if astrometry and ra_dec is None:
+        root, ext = path.splitext(original_fname)
+        img_new = CCDData.read(original_fname, unit='adu')
+
+        # The ndmin below ensures center_pix has the right shape
+        # for WCS conversion.
+        center_pix = np.trunc(np.array(img_new.shape, ndmin=2) / 2)
+        ra_dec = \
+            img_new.wcs.all_pix2world(center_pix,
+                                      1)
+        ra_dec = ra_dec[0]
+        # RA/Dec are in degrees. Convert them to sexagesimal for
+        # output. Yuck, but makes it easier for existing code to
+        # handle.
+        # Note that FK5 is J2000.
+        coords = SkyCoord(*ra_dec, unit=(u.degree, u.degree),
+                          frame='fk5')
+
+        img_new.header['RA'] = coords.ra.to_string(unit=u.hour,
+                                                   sep=':')
+        img_new.header['DEC'] = coords.dec.to_string(sep=':')
+        img_new.write(original_fname, overwrite=True)
+
+    return astrometry
+
+
+def _astrometry_worker(args):
+    """
+    Unpack arguments for :func:`_astrometry_for_file` in a worker process.
+    """
+    positional, keywords = args
+    return _astrometry_for_file(*positional, **keywords)
+
+
+def _ledger_options(source, options):
+    """
+    Options a ledger would record for solving a file with the keyword
+    arguments of :func:`_astrometry_for_file`.
+    """
+    ra_dec = _ra_dec(fits.getheader(source),
+                     ignore_ra_dec=options['ignore_ra_dec'])
+    return ast.ledger_options(source, ra_dec=ra_dec,
+                              custom_sextractor=options['custom_sextractor'],
+                              odds_ratio=options['odds_ratio'],
+                              camera=options['camera'],
+                              avoid_pyfits=options['avoid_pyfits'])
+
+
+def _schedule(work, ledger, retry_failed=False):
+    """
+    Drop known-unsolvable files from a work list and order the rest.
+
+    Parameters
+    ----------
+    work : list
+        Arguments for :func:`_astrometry_worker`, one entry per file.
+    ledger : str
+        Name of the ledger file.
+    retry_failed : bool, optional
+        If ``True``, keep files on which every previous attempt failed.
+
+    Returns
+    -------
+    list
+        The work to do, most expensive first so that long solves do not
+        hold up the end of a parallel run. Each entry has the hash of the
+        file, or ``None`` if it was not needed, added to its keyword
+        arguments.
+
+    Notes
+    -----
+    Only files with the size and modification time of a file in the ledger
+    are hashed, so that new files are not read in full before solving
+    starts. A file is skipped only if it failed with the options it would
+    be solved with now.
+    """
+    scheduled = []
+    with AstrometryLedger(ledger) as record:
+        for (current_dir, light_file, working_dir), options in work:
+            source = path.join(current_dir, light_file)
+            source_stat = stat(source)
+            file_hash = None
+            if record.has_attempts(source_stat.st_size,
+                                   source_stat.st_mtime):
+                file_hash = ledger_file_hash(source)
+                if (not retry_failed and
+                        record.is_unsolvable(
+                            file_hash,
+                            options=_ledger_options(source, options))):
+                    logger.info('Skipping %s; the ledger shows it does not '
+                                'solve', source)
+                    continue
+            cost = record.expected_duration(file_hash, default=0)
+            options = dict(options, ledger=ledger, file_hash=file_hash)
+            scheduled.append((cost, ((current_dir, light_file, working_dir),
+                                     options)))
+    scheduled.sort(key=lambda item: item[0], reverse=True)
+    return [item for cost, item in scheduled]
+
+
 def astrometry_for_directory(directories,
                              destination=None,
                              no_log_destination=False,
@@ -74,7 +250,11 @@ def astrometry_for_directory(directories,
                              astrometry_config=None,
                              camera=None,
                              avoid_pyfits=False,
-                             ignore_ra_dec=False):
+                             ignore_ra_dec=False,
+                             jobs=1,
+                             ledger=None,
+                             retry_failed=False,
+                             header_cache=False):
     """
     Add astrometry to files in list of directories
 
@@ -87,12 +267,30 @@ def astrometry_for_directory(directories,
     blind : bool, optional
         Set to True to force blind astrometry. False by default because
         blind astrometry is slow.
+
+    jobs : int, optional
+        Number of files to solve at the same time. Each solve runs in its
+        own process; the default is to solve one file at a time.
+
+    ledger : str, optional
+        Name of an SQLite file in which every attempt is recorded; see
+        :class:`~msumastro.header_processing.ledger.AstrometryLedger`. Files
+        that the ledger shows cannot be solved with the same options are
+        skipped, and the rest are attempted most expensive first.
+
+    retry_failed : bool, optional
+        Attempt files even if the `ledger` shows they did not solve before.
+
+    header_cache : bool, optional
+        If ``True``, use a header cache in each directory; see
+        :class:`~msumastro.image_collection.ImageFileCollection`.
     """
 
     for currentDir in directories:
         images = ImageFileCollection(currentDir,
                                      keywords=['imagetyp', 'object',
-                                               'wcsaxes', 'ra', 'dec'])
+                                               'wcsaxes', 'ra', 'dec'],
+                                     header_cache=header_cache)
         summary = images.summary
         if len(summary) == 0:
             continue
@@ -104,71 +302,31 @@ def astrometry_for_directory(directories,
         if (not no_log_destination) and (destination is not None):
             add_file_handlers(logger, working_dir, 'run_astrometry')
 
-        logger.debug('About to loop over %d files', len(lights['file']))
-        for light_file in lights['file']:
-            if ((destination is not None) and (destination != currentDir)):
-                src = path.join(currentDir, light_file)
-                shutil.copy(src, destination)
-
-            original_fname = path.join(working_dir, light_file)
-            img = CCDData.read(original_fname, unit='adu')
+        options = dict(destination=destination,
+                       blind=blind,
+                       custom_sextractor=custom_sextractor,
+                       odds_ratio=odds_ratio,
+                       astrometry_config=astrometry_config,
+                       camera=camera,
+                       avoid_pyfits=avoid_pyfits,
+                       ignore_ra_dec=ignore_ra_dec)
+        work = [((currentDir, light_file, working_dir), options)
+                for light_file in lights['file']]
+
+        if ledger is not None:
+            work = _schedule(work, ledger, retry_failed=retry_failed)
+
+        logger.debug('About to loop over %d files', len(work))
+        if jobs > 1 and len(work) > 1:
+            pool = Pool(min(jobs, len(work)))
             try:
-                ra = img.header['ra']
-                dec = img.header['dec']
-                ra_dec = (ra, dec)
-            except KeyError:
-                ra_dec = None
-
-            if ignore_ra_dec:
-                ra_dec = None
-
-            if (ra_dec is None) and (not blind):
-                root, ext = path.splitext(original_fname)
-                f = open(root + '.blind', 'wb')
-                f.close()
-                continue
-
-            astrometry = ast.add_astrometry(original_fname,
-                                            ra_dec=ra_dec,
-                                            note_failure=True,
-                                            overwrite=True,
-                                            custom_sextractor=custom_sextractor,
-                                            odds_ratio=odds_ratio,
-                                            astrometry_config=astrometry_config,
-                                            camera=camera,
-                                            avoid_pyfits=avoid_pyfits)
-
-            with fits.open(original_fname,
-                           do_not_scale_image_data=True) as f:
-                try:
-                    del f[0].header['imageh'], f[0].header['imagew']
-                    f.writeto(original_fname, overwrite=True)
-                except KeyError:
-                    pass
-
-            if astrometry and ra_dec is None:
-                root, ext = path.splitext(original_fname)
-                img_new = CCDData.read(original_fname, unit='adu')
-
-                # The ndmin below ensures center_pix has the right shape
-                # for WCS conversion.
-                center_pix = np.trunc(np.array(img_new.shape, ndmin=2) / 2)
-                print(center_pix[np.newaxis, :].shape)
-                ra_dec = \
-                    img_new.wcs.all_pix2world(center_pix,
-                                              1)
-                ra_dec = ra_dec[0]
-                # RA/Dec are in degrees. Convert them to sexagesimal for
-                # output. Yuck, but makes it easier for existing code to
-                # handle.
-                # Note that FK5 is J2000.
-                coords = SkyCoord(*ra_dec, unit=(u.degree, u.degree),
-                                  frame='fk5')
-
-                img_new.header['RA'] = coords.ra.to_string(unit=u.hour,
-                                                           sep=':')
-                img_new.header['DEC'] = coords.dec.to_string(sep=':')
-                img_new.write(original_fname, overwrite=True)
+                pool.map(_astrometry_worker, work, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for args in work:
+                _astrometry_worker(args)
 
 
 def construct_parser():
@@ -187,14 +345,26 @@ def construct_parser():
                         help='File to use for configuring astrometry engine, '
                              'including, e.g., the location of index files.')
     parser.add_argument('--camera', action='store',
-                        help='Name of camera; used to set pixel scale in '
-                             'solve. If omitted, uses settings for Apogee '
-                             'Alta U9.')
+                        choices=sorted(ast.CAMERAS),
+                        help='Name of camera; used to set pixel scale and '
+                             'downsampling in solve. If omitted, the camera '
+                             'is determined from the INSTRUME keyword.')
     parser.add_argument('--avoid-pyfits', action='store_true',
                         help='Add options to avoid calls to pyfits.')
     parser.add_argument('--ignore-fits-ra-dec', action='store_true',
                         help='Ignore any RA/Dec information in the '
                              'FITS header.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to solve at the same time; '
+                             'default is 1.')
+    add_header_cache(parser)
+    parser.add_argument('--ledger', action='store',
+                        help='SQLite file in which to record every attempt '
+                             'to solve a file. Files the ledger shows do not '
+                             'solve with the same options are skipped.')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Attempt files even if the ledger shows they '
+                             'did not solve before.')
 
     return parser
 
@@ -221,7 +391,11 @@ def main(arglist=None):
                              astrometry_config=args.astrometry_config,
                              camera=args.camera,
                              avoid_pyfits=args.avoid_pyfits,
-                             ignore_ra_dec=args.ignore_fits_ra_dec)
+                             ignore_ra_dec=args.ignore_fits_ra_dec,
+                             jobs=args.jobs,
+                             ledger=args.ledger,
+                             retry_failed=args.retry_failed,
+                             header_cache=args.header_cache)
 
 
 main.__doc__ = _main_function_docstring(__name__)
@@ -85,7 +85,8 @@ from os import path
 import warnings
 import logging
 
-from ..header_processing import patch_headers, add_object_info, list_name_is_url
+from ..header_processing import (patch_headers, add_object_info,
+                                 list_name_is_url, read_object_list)
 from ..customlogger import console_handler, add_file_handlers
 from .script_helpers import (setup_logging, construct_default_parser,
                              handle_destination_dir_logging_check,
@@ -100,11 +101,35 @@ DEFAULT_OBJECT_URL = ('https://raw.github.com/mwcraig/feder-object-list'
                       '/master/feder_object_list.csv')
 
 
+def read_objects(object_list):
+    """
+    Read a list of objects once, to patch several sets of files with it.
+
+    Parameters
+    ----------
+
+    object_list : str
+        Path to or URL of the list.
+
+    Returns
+    -------
+
+    tuple
+        The object names and coordinates, as returned by
+        :func:`~msumastro.header_processing.patchers.read_object_list`.
+    """
+    if list_name_is_url(object_list):
+        return read_object_list(input_list=object_list)
+    obj_dir, obj_name = path.split(path.abspath(object_list))
+    return read_object_list(obj_dir, input_list=obj_name)
+
+
 def patch_directories(directories, verbose=False, object_list=None,
                       destination=None,
                       no_log_destination=False,
                       overscan_only=False,
-                      script_name='run_patch'):
+                      script_name='run_patch',
+                      files=None, objects=None):
     """
     Patch all of the files in each of a list of directories.
 
@@ -127,6 +152,14 @@ def patch_directories(directories, verbose=False, object_list=None,
         Path to directory in which patched images will be stored. Default
         value is None, which means that **files will be overwritten** in
         the directory being processed.
+
+    files : list of str, optional
+        Names of the files to patch in each directory. Default is all of the
+        FITS files in the directory.
+
+    objects : tuple, optional
+        Object names and coordinates already read, e.g. with
+        :func:`read_objects`; if given, `object_list` is not read.
     """
     no_explicit_object_list = (object_list is None)
     if not no_explicit_object_list:
@@ -160,11 +193,12 @@ def patch_directories(directories, verbose=False, object_list=None,
                               add_apparent_pos=False,
                               add_overscan=True,
                               fix_imagetype=False,
-                              add_unit=False)
+                              add_unit=False,
+                              files=files)
 
             else:
                 patch_headers(currentDir, new_file_ext='', overwrite=True,
-                              save_location=destination)
+                              save_location=destination, files=files)
 
                 default_object_list_present = path.exists(path.join(currentDir,
                                                           DEFAULT_OBJ_LIST))
@@ -173,7 +207,8 @@ def patch_directories(directories, verbose=False, object_list=None,
                     obj_name = DEFAULT_OBJ_LIST
                 add_object_info(working_dir, new_file_ext='', overwrite=True,
                                 save_location=destination,
-                                object_list_dir=obj_dir, object_list=obj_name)
+                                object_list_dir=obj_dir, object_list=obj_name,
+                                files=files, objects=objects)
 
 
 def construct_parser():
@@ -69,6 +69,7 @@ def construct_parser():
 
     script_helpers.add_console_output_args(parser)
     script_helpers.add_debug(parser)
+    script_helpers.add_header_cache(parser)
     parser.add_argument('--quiet-log',
                         help=('Log only warnings (or worse) to '
                               'FILES AND CONSOLE while running scripts'),
@@ -103,6 +104,9 @@ def main(arglist=None):
     silent_console = '--silent-console' if args.silent_console else ''
     common_args.extend([verbose, quiet_console, silent_console])
 
+    # run_patch rewrites every file, so a header cache is no use to it.
+    header_cache = '--header-cache' if args.header_cache else ''
+
     no_blind = args.no_blind
     ignore_fits_ra_dec = args.ignore_fits_ra_dec
 
@@ -139,7 +143,8 @@ def main(arglist=None):
         # Not going to...
 
         # Oh fine, I will test.
-        fits_collection = ImageFileCollection(root)
+        fits_collection = ImageFileCollection(root,
+                                              header_cache=args.header_cache)
         if not fits_collection.files:
             continue
 
@@ -164,7 +169,7 @@ def main(arglist=None):
         else:
             source_for_rest = root
 
-        additional_args = ['--avoid-pyfits']
+        additional_args = ['--avoid-pyfits', header_cache]
 
         if not no_blind:
             additional_args.append('--blind')
@@ -181,7 +186,8 @@ def main(arglist=None):
 
         run_triage = construct_command('run_triage.py', source_for_rest,
                                        destination, common_args,
-                                       additional_args=['--all'])
+                                       additional_args=['--all',
+                                                        header_cache])
 
         if not triage:
             run_triage = ''
@@ -14,9 +14,21 @@ DESCRIPTION
 
     For more control over the parameters see :func:`triage_fits_files`
 
-    .. Note::
-        This script is **NOT RECURSIVE**; it will not process files in
-        subdirectories of the the directories supplied on the command line.
+    Directories can be triaged at the same time with ``--jobs``; large
+    directories are also split into groups of files that are read at the
+    same time. The tables and lists written are the same as when the
+    directories are triaged one at a time.
+
+    By default this script is **NOT RECURSIVE**; it will not process files
+    in subdirectories of the the directories supplied on the command line.
+    With ``--recursive`` every directory below those on the command line
+    that contains FITS files is triaged, all in one process; hidden
+    directories are skipped. Each directory gets its own table and lists of
+    files needing attention, and a table of every file in the archive,
+    ``ArchiveManifest.txt`` by default, is written to the destination
+    directory or, if there is none, the first directory on the command
+    line. If a destination is given the lists and tables for each directory
+    are written in a tree under it matching the tree being triaged.
 
 
 EXAMPLES
@@ -30,6 +42,20 @@ EXAMPLES
 
         python run_triage.py --list-default
 
+    Save the table as a FITS binary table, ``Manifest.manifest.fits``, as
+    well as text::
+
+        python run_triage.py --manifest-format ascii --manifest-format fits \\
+            /my/folder/of/images
+
+    Triage a semester of nightly directories using 8 processes::
+
+        python run_triage.py --jobs 8 /data/2015-0*
+
+    Triage a whole archive, reusing headers cached by earlier runs::
+
+        python run_triage.py --recursive --header-cache --jobs 8 /data
+
     To work on the same folder from within python, do this::
 
         from msumastro.scripts import run_triage
@@ -42,10 +68,13 @@ EXAMPLES
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
+from collections import OrderedDict
 import os
 from argparse import ArgumentParser
+from multiprocessing import Pool
 from sys import exit
 import logging
+import sqlite3
 
 from astropy.table import Table, Column
 import numpy as np
@@ -53,12 +82,21 @@ import numpy as np
 from ..customlogger import console_handler, add_file_handlers
 from ..header_processing.feder import Feder
 from .. import ImageFileCollection
+from ..header_cache import HeaderCache, read_raw_header
+from ..catalog import HeaderCatalog
+from ..fits_walk import fits_files, walk_fits_directories
+from ..manifest import (MANIFEST_FORMATS, available_formats, manifest_name,
+                        stack_tables, write_manifest)
 from . import script_helpers
 
 logger = logging.getLogger()
 screen_handler = console_handler()
 logger.addHandler(screen_handler)
 
+# Directories with more FITS files than this are split into groups of this
+# many files when triaging in parallel.
+FILES_PER_TASK = 250
+
 
 class DefaultFileNames(object):
     def __init__(self):
@@ -67,6 +105,7 @@ class DefaultFileNames(object):
         self.filter_file_name = 'NEEDS_FILTER.txt'
         self.output_table = 'Manifest.txt'
         self.astrometry_file_name = 'NEEDS_ASTROMETRY.txt'
+        self.archive_table = 'ArchiveManifest.txt'
 
     def as_dict(self):
         return self.__dict__
@@ -84,18 +123,27 @@ def contains_maximdl_imagetype(image_collection):
     """
     Check an image file collection for MaxImDL-style image types
     """
-    import re
-    file_info = image_collection.summary
+    return _has_maximdl_imagetype(image_collection.summary)
+
 
+def _has_maximdl_imagetype(file_info):
+    """
+    Check a summary table for MaxImDL-style image types
+    """
     if file_info['imagetyp'].mask.any():
         logger.warn('One or more image is missing IMAGETYP in header')
 
-    image_types = ' '.join([typ for typ in file_info['imagetyp'].compressed()])
+    image_types = _string_values(file_info['imagetyp'])
+    return bool(((np.char.find(image_types, 'frame') >= 0) |
+                 (np.char.find(image_types, 'Frame') >= 0)).any())
 
-    if re.search('[fF]rame', image_types) is not None:
-        return True
-    else:
-        return False
+
+def _string_values(column):
+    """
+    Values of a column as an array of strings, with '' where masked
+    """
+    values = np.asarray(column).astype(str)
+    return np.where(np.ma.getmaskarray(column), '', values)
 
 
 def get_column_name_case_insensitive(name, column_names):
@@ -117,74 +165,96 @@ def get_column_name_case_insensitive(name, column_names):
     str or None
         name of first matching column or ``None``, if no match is found.
     """
-    for cname in column_names:
-        if name.lower() == cname.lower():
-            return cname
-    else:
-        return ''
+    return _column_index(column_names).get(name.lower(), '')
 
 
-def triage_fits_files(dir=None, file_info_to_keep=None):
+def _keywords_to_read(file_info_to_keep, feder):
     """
-    Check FITS files in a directory for deficient headers
-
-    `dir` is the name of the directory to search for files.
-
-    `file_info_to_keep` is a list of the FITS keywords to get values
-    for for each FITS file in `dir`.
+    Keywords needed to triage, including all of the names for RA.
     """
-    dir = dir or '.'
     all_file_info = file_info_to_keep or ['imagetyp', 'object',
                                           'filter', 'wcsaxes']
-    feder = Feder()
     RA = feder.RA
     if ((not (set(RA.names) <= set(all_file_info))) and
        (all_file_info != '*')):
         all_file_info.extend(RA.names)
+    return all_file_info
 
-    images = ImageFileCollection(dir, keywords=all_file_info)
-    file_info = images.summary
 
-    # check for bad image type and halt until that is fixed.
-    if contains_maximdl_imagetype(images):
-        raise ValueError(
-            'Correct MaxImDL-style image types before proceeding.')
+def _column_index(column_names):
+    """
+    Map each lower case column name to the first column with that name
+    """
+    index = {}
+    for name in column_names:
+        index.setdefault(name.lower(), name)
+    return index
 
-    file_needs_filter = \
-        list(images.files_filtered(imagetyp='light',
-                                   filter=None))
-    file_needs_filter += \
-        list(images.files_filtered(imagetyp='flat',
-                                   filter=None))
-
-    file_needs_object_name = \
-        list(images.files_filtered(imagetyp='light',
-                                   object=None))
-
-    lights = file_info[file_info['imagetyp'] == 'LIGHT']
-    file_needs_pointing = []
-    file_needs_astrometry = []
-    if lights:
-        has_no_ra = np.array([True] * len(lights))
-        has_no_ha = np.array([True] * len(lights))
-        for ra_name in RA.names:
-            col_name = \
-                get_column_name_case_insensitive(ra_name, lights.colnames)
-            try:
-                has_no_ra &= (lights[col_name].mask)
-            except KeyError:
-                pass
-        for ha_name in feder.HA.names:
-            col_name = \
-                get_column_name_case_insensitive(ha_name, lights.colnames)
+
+def _classify(file_info, feder):
+    """
+    Work out which files in a summary table have deficient headers
+
+    Every check is done on whole columns at once.
+
+    Parameters
+    ----------
+    file_info : astropy.table.Table
+        Summary table, with a row for each file.
+    feder : msumastro.header_processing.feder.Feder
+        Used to look up the names of the RA and HA keywords.
+
+    Returns
+    -------
+    dict
+        Boolean arrays, one entry per row of `file_info`, with keys
+        ``needs_filter``, ``needs_object_name``, ``needs_pointing``,
+        ``needs_astrometry`` and ``needs_imagetyp``.
+    """
+    n_rows = len(file_info)
+    columns = _column_index(file_info.colnames)
+
+    def missing(*names):
+        """True where none of the named keywords has a value."""
+        result = np.ones(n_rows, dtype=bool)
+        for name in names:
             try:
-                has_no_ha &= lights[col_name].mask
+                column = file_info[columns[name.lower()]]
             except KeyError:
-                pass
+                continue
+            result &= np.ma.getmaskarray(column)
+        return result
+
+    image_types = np.char.lower(_string_values(
+        file_info[columns['imagetyp']]))
+    light = image_types == 'light'
+    flat = image_types == 'flat'
+
+    return {
+        'needs_filter': (light | flat) & missing('filter'),
+        'needs_object_name': light & missing('object'),
+        'needs_pointing': light & (missing(*feder.RA.names) |
+                                   missing(*feder.HA.names)),
+        'needs_astrometry': light & missing('wcsaxes'),
+        'needs_imagetyp': missing('imagetyp'),
+    }
+
+
+def _triage_summary(file_info, dir, feder):
+    """
+    Find the files in a summary table that have deficient headers
 
-        file_needs_astrometry = list(lights['file'][lights['wcsaxes'].mask])
-        needs_minimal_pointing = has_no_ha | has_no_ra
-        file_needs_pointing = list(lights['file'][needs_minimal_pointing])
+    See :func:`triage_fits_files` for a description of the result.
+    """
+    # check for bad image type and halt until that is fixed.
+    if _has_maximdl_imagetype(file_info):
+        raise ValueError(
+            'Correct MaxImDL-style image types before proceeding.')
+
+    masks = _classify(file_info, feder)
+    files = np.asarray(file_info['file'])
+    file_lists = dict((key, list(files[mask]))
+                      for key, mask in masks.items())
 
     full_path = os.path.abspath(dir)
     path_column = Column(data=[full_path] * len(file_info), name='Source path')
@@ -194,14 +264,225 @@ def triage_fits_files(dir=None, file_info_to_keep=None):
     file_info.add_columns([path_column, containing_dir_col])
 
     dir_info = {'files': file_info,
-                'needs_filter': file_needs_filter,
-                'needs_pointing': file_needs_pointing,
-                'needs_object_name': file_needs_object_name,
-                'needs_astrometry': file_needs_astrometry}
+                'masks': masks}
+    dir_info.update(file_lists)
 
     return dir_info
 
 
+def triage_fits_files(dir=None, file_info_to_keep=None, header_cache=False,
+                      engine='astropy', feder=None, raw_headers=None,
+                      header_rows=None, filenames=None):
+    """
+    Check FITS files in a directory for deficient headers
+
+    `dir` is the name of the directory to search for files.
+
+    `file_info_to_keep` is a list of the FITS keywords to get values
+    for for each FITS file in `dir`.
+
+    `header_cache`, if ``True``, keeps a cache of headers in `dir` so that
+    unchanged files are not read on the next triage.
+
+    `engine` is the way headers are read, either ``'astropy'`` or
+    ``'scanner'``; see :class:`~msumastro.ImageFileCollection`.
+
+    `feder` is the :class:`~msumastro.header_processing.feder.Feder` used
+    to look up keyword names; one is created if it is omitted. Pass one in
+    when triaging many directories to avoid building it each time.
+
+    `raw_headers` are headers of files in `dir` that have already been read,
+    and `header_rows` the values from headers that have already been parsed;
+    see :class:`~msumastro.ImageFileCollection`.
+
+    `filenames`, if given, are the names of the only files in `dir` to
+    triage.
+
+    Returns a dictionary. Its ``files`` entry is the summary table, with a
+    row for each file. The entries ``needs_filter``, ``needs_object_name``,
+    ``needs_pointing``, ``needs_astrometry`` and ``needs_imagetyp`` are
+    lists of the names of files lacking that information. The ``masks``
+    entry is a dictionary with the same keys whose values are boolean
+    arrays, one element per row of the table.
+    """
+    dir = dir or '.'
+    feder = feder or Feder()
+    all_file_info = _keywords_to_read(file_info_to_keep, feder)
+
+    images = ImageFileCollection(dir, keywords=all_file_info,
+                                 header_cache=header_cache,
+                                 engine=engine, raw_headers=raw_headers,
+                                 header_rows=header_rows,
+                                 filenames=filenames)
+    return _triage_summary(images.summary, dir, feder)
+
+
+def _triage_one_at_a_time(directories, keywords, header_cache, engine,
+                          feder):
+    """
+    Triage directories in turn, yielding each directory and its result.
+    """
+    for directory in directories:
+        logger.info('Examining directory %s', directory)
+        yield directory, triage_fits_files(directory,
+                                           file_info_to_keep=list(keywords),
+                                           header_cache=header_cache,
+                                           engine=engine, feder=feder)
+
+
+# The Feder used by each process of a pool; see _init_worker.
+_worker_feder = None
+
+
+def _init_worker():
+    """
+    Build the Feder used by a worker process once, when it starts.
+    """
+    global _worker_feder
+    _worker_feder = Feder()
+
+
+def _triage_worker(args):
+    """
+    Triage a whole directory in a worker process.
+    """
+    directory, keywords, header_cache, engine = args
+    return triage_fits_files(directory, file_info_to_keep=keywords,
+                             header_cache=header_cache, engine=engine,
+                             feder=_worker_feder)
+
+
+def _rows_worker(args):
+    """
+    Read and parse the primary headers of a group of files in a worker
+    process.
+
+    Returns the values from each header, keyed by absolute path, for
+    :class:`~msumastro.ImageFileCollection`; files that cannot be read are
+    left out, to be reported when the summary is made.
+    """
+    directory, keywords, engine, file_names = args
+    images = ImageFileCollection(directory, keywords=keywords, engine=engine,
+                                 filenames=file_names)
+    return images.header_rows
+
+
+def _header_worker(args):
+    """
+    Read the primary headers of a group of files in a worker process.
+
+    Returns the raw headers, keyed by absolute path, for
+    :class:`~msumastro.ImageFileCollection`; files that cannot be read are
+    left out, to be reported when the summary is made.
+    """
+    directory, file_names = args
+    headers = {}
+    for name in file_names:
+        file_name = os.path.abspath(os.path.join(directory, name))
+        try:
+            stat = os.stat(file_name)
+            headers[file_name] = (read_raw_header(file_name), stat)
+        except (IOError, OSError, ValueError):
+            continue
+    return headers
+
+
+def _uncached(directory, files):
+    """
+    Files in a directory whose headers are not in its header cache.
+    """
+    path = os.path.join(directory, HeaderCache.DEFAULT_NAME)
+    if not os.path.exists(path):
+        return files
+    try:
+        with HeaderCache(path) as cache:
+            return [f for f in files
+                    if cache.raw_header(os.path.join(directory, f)) is None]
+    except sqlite3.Error as e:
+        logger.warning('Unable to use header cache %s: %s', path, e)
+        return files
+
+
+def _triage_in_pool(directories, keywords, header_cache, engine, jobs,
+                    feder):
+    """
+    Triage directories using a pool of processes.
+
+    Small directories are each triaged by one process. The headers of large
+    directories are read and parsed in groups of `FILES_PER_TASK` files by
+    several processes, and this process only gathers the values into the
+    summary and classifies the files. With a header cache, the workers
+    instead send back the headers not already cached unparsed, and this
+    process parses them and adds them to the cache, so that only one
+    process writes to the cache of a directory.
+
+    Yields
+    ------
+    directory : str
+    dir_info : dict
+        Result of triage, as from :func:`triage_fits_files`, in the same
+        order as `directories` regardless of which finishes first.
+    """
+    pool = Pool(jobs, initializer=_init_worker)
+    try:
+        pending = []
+        for directory in directories:
+            logger.info('Examining directory %s', directory)
+            files = fits_files(directory)
+            if len(files) > FILES_PER_TASK:
+                if header_cache:
+                    files = _uncached(directory, files)
+                groups = [files[i:i + FILES_PER_TASK]
+                          for i in range(0, len(files), FILES_PER_TASK)]
+                if header_cache:
+                    tasks = [pool.apply_async(_header_worker,
+                                              ((directory, group),))
+                             for group in groups]
+                else:
+                    tasks = [pool.apply_async(_rows_worker,
+                                              ((directory, list(keywords),
+                                                engine, group),))
+                             for group in groups]
+            else:
+                tasks = pool.apply_async(_triage_worker,
+                                         ((directory, keywords,
+                                           header_cache, engine),))
+            pending.append((directory, tasks))
+
+        for directory, tasks in pending:
+            if isinstance(tasks, list):
+                read = {}
+                for task in tasks:
+                    read.update(task.get())
+                if header_cache:
+                    parsed = dict(raw_headers=read)
+                else:
+                    parsed = dict(header_rows=read)
+                yield directory, triage_fits_files(
+                    directory, file_info_to_keep=list(keywords),
+                    header_cache=header_cache, engine=engine, feder=feder,
+                    **parsed)
+            else:
+                yield directory, tasks.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _update_catalog(header_catalog, directory):
+    """
+    Update a header catalog from the header cache of a directory.
+    """
+    try:
+        cache = HeaderCache.for_directory(directory)
+    except sqlite3.Error as e:
+        logger.warning('Unable to use header cache of %s: %s', directory, e)
+        header_catalog.update_directory(directory)
+        return
+    with cache:
+        header_catalog.update_directory(directory, header_cache=cache)
+
+
 def triage_directories(directories,
                        keywords=None,
                        all_keywords=False,
@@ -211,36 +492,96 @@ def triage_directories(directories,
                        astrometry_file_name=None,
                        output_table=None,
                        destination=None,
-                       no_log_destination=False):
-
-    for currentDir in directories:
-        if destination is not None:
-            target_dir = destination
-        else:
-            target_dir = currentDir
-        if (not no_log_destination) and (destination is not None):
-            add_file_handlers(logger, destination, 'run_triage')
-        logger.info('Examining directory %s', currentDir)
-        if keywords:
-            # force a copy...
-            use_keys = list(keywords)
+                       no_log_destination=False,
+                       header_cache=False,
+                       engine='astropy',
+                       jobs=1,
+                       manifest_formats=None,
+                       recursive=False,
+                       archive_table=None,
+                       catalog=None):
+
+    if keywords:
+        # force a copy...
+        use_keys = list(keywords)
+    else:
+        use_keys = []
+
+    if all_keywords:
+        try:
+            use_keys += ['*']
+        except TypeError:
+            use_keys = '*'
+
+    manifest_formats = manifest_formats or ['ascii']
+
+    # Directory in which the output for each directory triaged goes.
+    targets = OrderedDict()
+    for root in directories:
+        if recursive:
+            exclude = [destination] if destination is not None else []
+            found = [d for d, _ in walk_fits_directories(root,
+                                                         exclude=exclude)]
         else:
-            use_keys = []
+            found = [root]
+        for directory in found:
+            if destination is None:
+                targets[directory] = directory
+            elif recursive:
+                targets[directory] = os.path.normpath(
+                    os.path.join(destination,
+                                 os.path.relpath(directory, root)))
+            else:
+                targets[directory] = destination
+    archive_dir = destination or (directories[0] if directories else None)
+    directories = list(targets)
 
-        if all_keywords:
-            try:
-                use_keys += ['*']
-            except TypeError:
-                use_keys = '*'
-
-        result = triage_fits_files(currentDir, file_info_to_keep=use_keys)
-        outfiles = [pointing_file_name, filter_file_name,
-                    object_file_name, output_table, astrometry_file_name]
-        for fil in [outfile for outfile in outfiles if outfile is not None]:
-            try:
-                os.remove(os.path.join(currentDir, fil))
-            except OSError:
-                pass
+    feder = Feder()
+    use_keys = _keywords_to_read(use_keys, feder)
+    if catalog is not None:
+        # The catalog is filled from the header cache, so that each header
+        # is read only once.
+        header_cache = True
+
+    if (not no_log_destination) and (destination is not None):
+        add_file_handlers(logger, destination, 'run_triage')
+
+    # Remove output of earlier runs before reading any headers; a FITS
+    # manifest would otherwise be triaged as an image. Manifests in every
+    # format are removed so none is left disagreeing with the new one.
+    outfiles = [pointing_file_name, filter_file_name,
+                object_file_name, astrometry_file_name]
+    if output_table is not None:
+        outfiles += [manifest_name(output_table, format)
+                     for format in MANIFEST_FORMATS]
+    old_output = [os.path.join(currentDir, fil)
+                  for currentDir in directories
+                  for fil in outfiles if fil is not None]
+    if archive_table is not None and archive_dir is not None:
+        old_output += [os.path.join(archive_dir,
+                                    manifest_name(archive_table, format))
+                       for format in MANIFEST_FORMATS]
+    for fil in old_output:
+        try:
+            os.remove(fil)
+        except OSError:
+            pass
+    if recursive:
+        # Drop directories whose only FITS files were old output.
+        directories = [d for d in directories if fits_files(d)]
+
+    if jobs > 1 and directories:
+        results = _triage_in_pool(directories, use_keys, header_cache,
+                                  engine, jobs, feder)
+    else:
+        results = _triage_one_at_a_time(directories, use_keys, header_cache,
+                                        engine, feder)
+
+    archive = []
+    for currentDir, result in results:
+        target_dir = targets[currentDir]
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
 
         need_pointing = result['needs_pointing']
         need_filter = result['needs_filter']
@@ -259,8 +600,29 @@ def triage_directories(directories,
 
         tbl = result['files']
         if ((len(tbl) > 0) and (output_table is not None)):
-            tbl.write(os.path.join(target_dir, output_table),
-                      format='ascii', delimiter=',')
+            for format in manifest_formats:
+                write_manifest(tbl, os.path.join(target_dir,
+                                                 manifest_name(output_table,
+                                                               format)),
+                               format=format)
+        if archive_table is not None and len(tbl) > 0:
+            archive.append(tbl)
+
+    if catalog is not None:
+        logger.info('Updating header catalog %s', catalog)
+        with HeaderCatalog(catalog) as header_catalog:
+            for currentDir in directories:
+                _update_catalog(header_catalog, currentDir)
+
+    if archive:
+        logger.info('Writing manifest of %d directories to %s',
+                    len(archive), archive_dir)
+        archive = stack_tables(archive)
+        for format in manifest_formats:
+            write_manifest(archive,
+                           os.path.join(archive_dir,
+                                        manifest_name(archive_table, format)),
+                           format=format)
 
 
 def construct_parser():
@@ -275,6 +637,14 @@ def construct_parser():
     script_helpers.add_destination_directory(parser)
     script_helpers.add_no_log_destination(parser)
     script_helpers.add_console_output_args(parser)
+    script_helpers.add_header_cache(parser)
+    script_helpers.add_header_engine(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to use to read headers; '
+                             'default is 1.')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Triage every directory containing FITS files '
+                             'below the directories given.')
 
     key_help = 'FITS keyword to add to table in addition to the defaults; '
     key_help += 'for multiple keywords use this option multiple times.'
@@ -303,6 +673,26 @@ def construct_parser():
                         default=default_names.output_table,
                         help=output_file_help)
 
+    parser.add_argument('--catalog', default=None,
+                        help='SQLite header catalog to update with the '
+                             'files in each directory triaged; see '
+                             'header_catalog.py. Implies --header-cache, '
+                             'from which the catalog is filled.')
+
+    archive_help = ('Name of file in which a table of every file triaged '
+                    'is saved when triaging recursively; default is ')
+    archive_help += default_names.archive_table
+    parser.add_argument('--archive-table-name',
+                        default=default_names.archive_table,
+                        help=archive_help)
+
+    format_help = ('Format in which the table is saved; for several '
+                   'formats use this option multiple times. Formats other '
+                   'than ascii replace the extension of the table name, '
+                   'e.g. Manifest.manifest.fits. Default is ascii.')
+    parser.add_argument('--manifest-format', action='append',
+                        choices=list(MANIFEST_FORMATS), help=format_help)
+
     needs_object_help = 'Name of file to which list of files that need '
     needs_object_help += 'object name is saved; default is '
     needs_object_help += default_names.object_file_name
@@ -362,6 +752,11 @@ def main(arglist=None):
     if not args.dir:
         parser.error('No directory specified')
 
+    unavailable = set(args.manifest_format or []) - set(available_formats())
+    if unavailable:
+        parser.error('Manifest format(s) {0} need packages that are not '
+                     'installed'.format(', '.join(sorted(unavailable))))
+
     logger.debug('use_keys are %s', use_keys)
     do_not_log_in_destination = \
         script_helpers.handle_destination_dir_logging_check(args)
@@ -373,6 +768,14 @@ def main(arglist=None):
                        astrometry_file_name=args.astrometry_needed_list,
                        output_table=args.table_name,
                        destination=args.destination_dir,
-                       no_log_destination=do_not_log_in_destination)
+                       no_log_destination=do_not_log_in_destination,
+                       header_cache=args.header_cache,
+                       engine=args.header_engine,
+                       jobs=args.jobs,
+                       manifest_formats=args.manifest_format,
+                       recursive=args.recursive,
+                       archive_table=(args.archive_table_name
+                                      if args.recursive else None),
+                       catalog=args.catalog)
 
 main.__doc__ = script_helpers._main_function_docstring(__name__)
@@ -0,0 +1,224 @@
+"""
+DESCRIPTION
+-----------
+    Watch directories for new FITS files and patch and triage each one as
+    it is written, instead of running ``run_patch.py`` and
+    ``run_triage.py`` after the night is over.
+
+    A file is processed once its size and modification time have not
+    changed for ``--settle-time`` seconds, so files still being written are
+    left alone. Each batch of new files gets the same header patching as
+    ``run_patch.py`` and then only those files are triaged; their rows and
+    names are merged into the table and lists left by earlier batches, so
+    the files already processed are not read again. The object list is read
+    once, when the script starts. Files that were in the directories before
+    watching started are not processed unless ``--include-existing`` is
+    used.
+
+    If the package ``inotify_simple`` is installed new files are noticed
+    as soon as they are closed; otherwise the directories are listed every
+    ``--poll-interval`` seconds.
+
+    The script runs until it is interrupted, e.g. with Control-C.
+
+.. WARNING::
+    Like ``run_patch.py``, this script OVERWRITES the image files in the
+    directories being watched unless you use the --destination-dir option.
+
+EXAMPLES
+--------
+
+    Patch and triage tonight's images as they are taken::
+
+        run_watch.py /data/2015-03-10
+
+    Leave the originals alone and put the patched images elsewhere::
+
+        run_watch.py --destination-dir /reduced/2015-03-10 /data/2015-03-10
+
+    To do the same from within python, do this::
+
+        from msumastro.scripts import run_watch
+        run_watch.main(['/data/2015-03-10'])
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import logging
+import os
+
+from astropy.coordinates import name_resolve
+from astropy.table import Table
+import numpy as np
+
+from ..catalog import HeaderCatalog
+from ..customlogger import console_handler, add_file_handlers
+from ..manifest import read_manifest, stack_tables, write_manifest
+from ..watch import watch_directories
+from . import run_patch, run_triage, script_helpers
+
+logger = logging.getLogger()
+screen_handler = console_handler()
+logger.addHandler(screen_handler)
+
+
+def process_new_files(directory, files, destination=None, object_list=None,
+                      patch=True, engine='astropy', catalog=None,
+                      objects=None):
+    """
+    Patch some new files in a directory and update the triage of it.
+
+    Only `files` are patched and triaged; their rows replace any for them in
+    the table and lists of the directory, which are otherwise left as they
+    are.
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the files.
+    files : list of str
+        Names of the new or changed files.
+    destination : str, optional
+        Directory in which patched files are saved and triage output is
+        written. Default is to overwrite the files in `directory`.
+    object_list : str, optional
+        Path to or URL of the list of objects; see
+        :func:`~msumastro.scripts.run_patch.patch_directories`.
+    patch : bool, optional
+        If ``False``, only triage.
+    engine : {'astropy', 'scanner'}, optional
+        How headers are read for triage.
+    catalog : str, optional
+        Header catalog to update; see
+        :func:`~msumastro.scripts.run_triage.triage_directories`.
+    objects : tuple, optional
+        Object list already read with
+        :func:`~msumastro.scripts.run_patch.read_objects`; if given,
+        `object_list` is not read.
+    """
+    if patch:
+        run_patch.patch_directories([directory], object_list=object_list,
+                                    destination=destination,
+                                    no_log_destination=True,
+                                    files=files, objects=objects)
+    work_dir = destination or directory
+    names = run_triage.DefaultFileNames()
+    result = run_triage.triage_fits_files(
+        work_dir, file_info_to_keep=list(run_triage.DEFAULT_KEYS) + ['*'],
+        header_cache=True, engine=engine, filenames=files)
+    replaced = set(files)
+
+    lists = [(names.object_file_name, 'needs_object_name'),
+             (names.pointing_file_name, 'needs_pointing'),
+             (names.filter_file_name, 'needs_filter'),
+             (names.astrometry_file_name, 'needs_astrometry')]
+    for list_name, key in lists:
+        list_path = os.path.join(work_dir, list_name)
+        needed = [f for f in _read_list(list_path) if f not in replaced]
+        needed = sorted(needed + [str(f) for f in result[key]])
+        if os.path.exists(list_path):
+            os.remove(list_path)
+        if needed:
+            run_triage.write_list(work_dir, list_name, needed)
+
+    table = result['files']
+    table_path = os.path.join(work_dir, names.output_table)
+    if os.path.exists(table_path):
+        old = read_manifest(table_path, format='ascii')
+        keep = np.array([str(f) not in replaced for f in old['file']],
+                        dtype=bool)
+        table = stack_tables([old[keep], table])
+        table.sort('file')
+        os.remove(table_path)
+    if len(table) > 0:
+        write_manifest(table, table_path)
+
+    if catalog is not None:
+        with HeaderCatalog(catalog) as header_catalog:
+            run_triage._update_catalog(header_catalog, work_dir)
+
+
+def _read_list(list_path):
+    """
+    Names of the files in a list written by triage; none if there is no
+    list.
+    """
+    if not os.path.exists(list_path):
+        return []
+    return [str(f) for f in Table.read(list_path, format='ascii')['File']]
+
+
+def construct_parser():
+    parser = script_helpers.construct_default_parser(__doc__)
+    script_helpers.add_header_engine(parser)
+    parser.add_argument('-o', '--object-list', default=None,
+                        help='Path to or URL of file containing list of '
+                             'objects that might be in these files; see '
+                             'run_patch.py. Default is the same as for '
+                             'run_patch.py.')
+    parser.add_argument('--no-patch', action='store_true',
+                        help='Only triage new files, do not patch them')
+    parser.add_argument('--include-existing', action='store_true',
+                        help='Also process the files already in the '
+                             'directories when watching starts')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help='Seconds between listings of the directories; '
+                             'default is 5')
+    parser.add_argument('--settle-time', type=float, default=2.0,
+                        help='Seconds a file must be unchanged before it is '
+                             'processed; default is 2')
+    parser.add_argument('--max-pending', type=int, default=4,
+                        help='Number of batches of new files that can wait '
+                             'to be processed before the directories stop '
+                             'being listed; default is 4')
+    parser.add_argument('--catalog', default=None,
+                        help='Also update this header catalog; see '
+                             'header_catalog.py')
+    return parser
+
+
+def main(arglist=None, stop=None):
+    """See script_helpers._main_function_docstring for actual documentation
+    """
+    parser = construct_parser()
+    args = parser.parse_args(arglist)
+    script_helpers.setup_logging(logger, args, screen_handler)
+
+    add_file_handlers(logger, os.getcwd(), 'run_watch')
+
+    if args.destination_dir is not None and len(args.dir) > 1:
+        parser.error('Only one directory can be watched with '
+                     '--destination-dir')
+
+    object_list = args.object_list or run_patch.DEFAULT_OBJECT_URL
+    objects = None
+    if not args.no_patch:
+        # Read once here rather than for every batch; the default list is
+        # fetched from the network.
+        try:
+            objects = run_patch.read_objects(object_list)
+        except (IOError, name_resolve.NameResolveError) as e:
+            parser.error('Unable to read object list '
+                         '{0}: {1}'.format(object_list, e))
+
+    def process(directory, files):
+        process_new_files(directory, files,
+                          destination=args.destination_dir,
+                          object_list=object_list,
+                          patch=not args.no_patch,
+                          engine=args.header_engine,
+                          catalog=args.catalog,
+                          objects=objects)
+
+    logger.info('Watching %s', ', '.join(args.dir))
+    try:
+        return watch_directories(args.dir, process,
+                                 poll_interval=args.poll_interval,
+                                 settle_time=args.settle_time,
+                                 max_pending=args.max_pending,
+                                 include_existing=args.include_existing,
+                                 stop=stop)
+    except KeyboardInterrupt:
+        logger.info('Stopped watching')
+
+main.__doc__ = script_helpers._main_function_docstring(__name__)
@@ -99,6 +99,28 @@ def add_no_log_destination(parser):
                         help=arg_help, action='store_true')
 
 
+def add_header_cache(parser):
+    """
+    Add option to keep FITS headers in a cache in each directory processed
+    """
+    arg_help = ('Keep a cache of FITS headers in each directory so that '
+                'files that have not changed are not read again when the '
+                'directory is next processed')
+    parser.add_argument('--header-cache', help=arg_help,
+                        action='store_true')
+
+
+def add_header_engine(parser):
+    """
+    Add option to choose how FITS headers are read
+    """
+    arg_help = ('How FITS headers are read: "astropy" parses full headers, '
+                '"scanner" reads only the keywords needed and is faster. '
+                'Default is astropy.')
+    parser.add_argument('--header-engine', choices=['astropy', 'scanner'],
+                        default='astropy', help=arg_help)
+
+
 def add_console_output_args(parser):
     parser.add_argument('--quiet-console',
                         help=('Log only errors (or worse) to console '
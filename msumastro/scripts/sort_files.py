@@ -1,8 +1,8 @@
 """
 DESCRIPTION
 -----------
-    For the directory provided on the command line sort the FITS files in this
-    way::
+    For the directories provided on the command line sort the FITS files in
+    this way::
 
         destination
             |
@@ -46,9 +46,13 @@ DESCRIPTION
     The directory ``destination/calibration/flat/R`` will contain all of the
     FITS files that are R-band flats.
 
-    .. Note::
-        This script is **NOT RECURSIVE**; it will not process files in
-        subdirectories of the the directories supplied on the command line.
+    When more than one directory is given, or with ``--recursive`` every
+    directory below those given, the files from all of them are sorted into
+    a single tree in the ``--destination-dir``, so that, for example, the R
+    flats from a whole week end up together. Files from different
+    directories that would have the same name in the tree are renamed by
+    putting the path of their directory in front of their name, e.g.
+    ``2015-03-10_flat-001R.fit``.
 
     .. Warning::
         Unless you explicitly supply a destination using the --destination-dir
@@ -57,9 +61,50 @@ DESCRIPTION
         since files are moved or copied but never deleted, you have been
         warned.
 
+    By default files are copied. With ``--link-mode`` they can instead be
+    moved, hard linked, symbolically linked or reflinked (cloned, on file
+    systems that support it); hard links and reflinks take no extra disk
+    space and are made almost instantly. A hard link or reflink that cannot
+    be made, e.g. because the destination is on a different file system, is
+    replaced by a copy.
+
+    Where each file goes is worked out before any is placed and saved in a
+    journal in the destination. If sorting is interrupted, running the same
+    command again finishes the sort, skipping files already placed.
+
+    Files are placed one at a time unless ``--jobs`` is used, which places
+    that many at once; on network storage, where each copy spends most of
+    its time waiting, this is several times faster.
+
+    With ``--verify`` each copy is checked against the size of the original,
+    which is hashed while it is copied, and the hashes are listed in
+    ``transfers.sha1`` in the destination, which ``sha1sum -c`` can check. With
+    ``--fits-checksum`` the FITS ``DATASUM`` and ``CHECKSUM`` cards are also
+    added to each copied or moved file.
+
 EXAMPLES
 --------
 
+    Sort a night into a tree of hard links next to the original files::
+
+        sort_files.py --link-mode hardlink -d /data/sorted/2015-03-10 \\
+            /data/2015-03-10
+
+    Sort a whole semester into one tree of hard links::
+
+        sort_files.py --recursive --link-mode hardlink \\
+            -d /data/sorted/2015-spring /data/2015-0*
+
+    Sort a night, putting exposures that differ by less than a tenth of a
+    second, e.g. 29.999 and 30.0 seconds, in the same directory::
+
+        sort_files.py --exptime-tolerance 0.1 -d /data/sorted/2015-03-10 \\
+            /data/2015-03-10
+
+    Copy to network storage eight files at a time, checking each copy::
+
+        sort_files.py --jobs 8 --verify -d /mnt/archive/2015-03-10 \\
+            /data/2015-03-10
 
 """
 
@@ -68,23 +113,139 @@ from __future__ import (print_function, division, absolute_import,
 
 import os
 import logging
+from multiprocessing.pool import ThreadPool
 import shutil
 
+from astropy.extern import six
 from astropy.extern.six.moves import zip as izip
+from astropy.io import fits
 
 from ..customlogger import console_handler, add_file_handlers
-from .. import ImageFileCollection
 from .. import TableTree
+from ..file_transfer import (LINK_MODES, PlacementJournal, TransferManifest,
+                             is_placed, makedirs, transfer_file)
+from ..fits_walk import source_directories
+from ..image_collection import directory_summary
+from ..manifest import stack_tables
 from . import script_helpers
 
 UNSORTED_DIR = 'unsorted'
 
+# Keywords whose values decide where a file goes.
+SORT_KEYWORDS = ['imagetyp', 'exptime', 'filter', 'object']
+
+# Extensions of compressed files, which cannot be updated in place.
+_COMPRESSED = ('.gz', '.bz2', '.zip')
+
 logger = logging.getLogger()
 screen_handler = console_handler()
 logger.addHandler(screen_handler)
 
 
-def copy_files(files, dest, copy_or_move):
+def _add_fits_checksums(path):
+    """
+    Add the DATASUM and CHECKSUM cards to every HDU of a FITS file.
+    """
+    if path.lower().endswith(_COMPRESSED):
+        logger.debug('Not adding checksums to compressed file %s', path)
+        return
+    with fits.open(path, mode='update') as hdus:
+        for hdu in hdus:
+            hdu.add_checksum()
+
+
+def _place(task):
+    """
+    Place one file, returning the error instead of raising it.
+
+    A file already in place, e.g. by a run that was interrupted, is left
+    alone. Any other file of the same name in the destination, such as an
+    image of an earlier night, is never replaced; placing that file fails.
+    """
+    index, source, dest, name, link_mode, manifest, fits_checksum = task
+    try:
+        if is_placed(source, dest, link_mode=link_mode, name=name,
+                     fits_checksum=fits_checksum):
+            return index, source, link_mode, None
+        used = transfer_file(source, dest, link_mode=link_mode, name=name,
+                             manifest=manifest,
+                             prepare=(_add_fits_checksums if fits_checksum
+                                      else None))
+        return index, source, used, None
+    except (IOError, OSError, ValueError, shutil.Error) as e:
+        return index, source, None, e
+
+
+def place_files(placements, link_mode='copy', jobs=1, record=None,
+                manifest=None, fits_checksum=False):
+    """
+    Place files in directories, several at a time if `jobs` is more than 1.
+
+    On network storage the time to copy a file is mostly latency, so
+    placing several files at once is much faster than one after another.
+    Placing is idempotent: files already in place are skipped.
+
+    Parameters
+    ----------
+    placements : list of (str, str) or (str, str, str)
+        Path of each file, the directory, which must exist, in which to
+        place it and, optionally, the name to give it there.
+    link_mode : str, optional
+        How the files are placed; one of
+        `~msumastro.file_transfer.LINK_MODES`. See
+        :func:`~msumastro.file_transfer.transfer_file`.
+    jobs : int, optional
+        Number of files to place at the same time.
+    record : callable, optional
+        Called in the calling thread as ``record(index, error)`` as each
+        file is done, where ``index`` is its position in `placements` and
+        ``error`` is ``None`` if it was placed.
+    manifest : `~msumastro.file_transfer.TransferManifest`, optional
+        If given, copies are verified and their hashes recorded in it; see
+        :func:`~msumastro.file_transfer.transfer_file`.
+    fits_checksum : bool, optional
+        If ``True``, add the FITS ``DATASUM`` and ``CHECKSUM`` cards to each
+        file that is copied or moved; links are left alone, since changing
+        them would change the original.
+
+    Returns
+    -------
+    list of (str, Exception)
+        Path of each file that could not be placed and the error; each is
+        also logged. The other files are placed regardless.
+    """
+    tasks = [(index, p[0], p[1], p[2] if len(p) > 2 else None, link_mode,
+              manifest, fits_checksum)
+             for index, p in enumerate(placements)]
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = ThreadPool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(_place, tasks)
+    else:
+        results = (_place(task) for task in tasks)
+
+    failures = []
+    n_copied = 0
+    try:
+        for index, source, used, error in results:
+            if error is not None:
+                logger.error('Unable to %s %s: %s', link_mode, source, error)
+                failures.append((source, error))
+            elif used != link_mode:
+                n_copied += 1
+            if record is not None:
+                record(index, error)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if n_copied:
+        logger.info('Copied %d files because they could not be %sed',
+                    n_copied, link_mode)
+    return failures
+
+
+def copy_files(files, dest, link_mode='copy', jobs=1):
     """
     Copy a list of files to a directory
 
@@ -94,59 +255,71 @@ def copy_files(files, dest, copy_or_move):
         List of paths of files to be copied
     dest : str
         Name of dirctory to which files should be copied
+    link_mode : str, optional
+        How the files are placed in `dest`; one of
+        `~msumastro.file_transfer.LINK_MODES`. See
+        :func:`~msumastro.file_transfer.transfer_file`.
+    jobs : int, optional
+        Number of files to copy at the same time.
+
+    Returns
+    -------
+    list of (str, Exception)
+        Files that could not be copied; see :func:`place_files`.
     """
-    for f in files:
-        copy_or_move(f, dest)
+    return place_files([(f, dest) for f in files], link_mode=link_mode,
+                       jobs=jobs)
 
 
-def sort_directory(directory, verbose=False,
-                   destination=None,
-                   no_log_destination=False,
-                   script_name=None,
-                   move=False):
+def plan_sort(directories, working_dir, recursive=False, header_cache=False,
+              exptime_tolerance=None):
     """
-    Sort files in a directory into a tree
+    Work out where each file in some directories goes in the sorted tree.
+
+    The files of all of the directories are sorted into a single tree, so
+    that, for example, all R-band flats end up together.
 
     Parameters
     ----------
-    directory : str
-        Directory whose files are to be sorted
-    verbose : bool
-        If True, increase logging verbosity
-    destination : str, optional
-        Directory into which the sorted files/directories should be placed. If
-        omitted, sorting is done in the source ``directory``.
-    no_log_destination : bool, optional
-        Suppress logging in the destination directory. Logging cannot be
-        suppressed if you are running in the destination directory.
-    script_name : str, optional, default is 'sort_files'
-        Name of the script calling this function; used to set the name of the
-        log file in the destination.
+    directories : str or list of str
+        Directory or directories whose files are to be sorted.
+    working_dir : str
+        Directory in which the tree is made.
+    recursive : bool, optional
+        If ``True``, also sort the files in every directory below
+        `directories`, except `working_dir`.
+    header_cache : bool, optional
+        If ``True``, keep a cache of FITS headers in each directory.
+    exptime_tolerance : float, optional
+        If given, exposure times that differ by no more than this many
+        seconds are sorted into the same directory, named after the most
+        common of them; see the ``bins`` argument of
+        :class:`~msumastro.TableTree`.
+
+    Returns
+    -------
+    list of (str, str) or (str, str, str)
+        Path of each file and the directory in which it goes. Files from
+        different directories that would have the same path in the tree get
+        a third item, the name they are given instead: their own name
+        prefixed with the path of their directory relative to the one given,
+        e.g. ``2015-03-10_flat-001R.fit``.
     """
-    script_name = script_name or 'sort_files'
-    if destination is not None:
-        working_dir = destination
-        if not os.path.exists(destination):
-            os.makedirs(destination)
-    else:
-        working_dir = directory
-
-    if (not no_log_destination) and (destination is not None):
-        add_file_handlers(logger, working_dir, script_name)
+    if isinstance(directories, six.string_types):
+        directories = [directories]
+    directories = [os.path.normpath(d) for d in directories]
+    prefixes = source_directories(directories, exclude=[working_dir],
+                                  recursive=recursive)
+    tables = []
+    for directory in prefixes:
+        table = directory_summary(directory, SORT_KEYWORDS,
+                                  header_cache=header_cache)
+        if table is not None:
+            tables.append(table)
+    if not tables:
+        return []
+    full_table = tables[0] if len(tables) == 1 else stack_tables(tables)
 
-    if move:
-        copy_or_move = shutil.move
-    else:
-        copy_or_move = shutil.copy2
-
-    logger.info("Working on directory: %s", directory)
-    logger.info("Destination directory is: %s", destination)
-
-    default_keys = ['imagetyp', 'exptime', 'filter', 'object']
-    images = ImageFileCollection(directory, keywords=default_keys)
-    if not images.files:
-        return
-    full_table = images.summary
     bias = 'BIAS'
     dark = 'DARK'
     flat = 'FLAT'
@@ -156,8 +329,14 @@ def sort_directory(directory, verbose=False,
                    flat: ['filter', 'exptime'],
                    light: ['object', 'filter', 'exptime']}
     table_by_type = full_table.group_by('imagetyp')
-    prepend_path = lambda path, file_list: \
-                        [os.path.join(path, f) for f in file_list]
+    placements = []
+    bins = None
+    if exptime_tolerance is not None:
+        bins = {'exptime': exptime_tolerance}
+
+    def place_in(dest, files):
+        placements.extend((f, dest) for f in files)
+
     for im_type, table in izip(table_by_type.groups.keys,
                                table_by_type.groups):
         image_type = im_type['imagetyp']
@@ -165,36 +344,256 @@ def sort_directory(directory, verbose=False,
         dest_dir = os.path.join(working_dir, image_type)
         if not tree_keys:
             # bias
-            source_files = prepend_path(directory, table['file'])
-            this_dest = os.makedirs(dest_dir)
-            copy_files(source_files, dest_dir, copy_or_move)
+            place_in(dest_dir, table['file'])
             continue
         mask = [False] * len(table)
         for key in tree_keys:
             mask |= table[key].mask
         if any(mask):
-            source_files = prepend_path(directory, table['file'][mask])
-            this_dest = os.path.join(dest_dir, UNSORTED_DIR)
-            os.makedirs(this_dest)
-            copy_files(source_files, this_dest, copy_or_move)
+            place_in(os.path.join(dest_dir, UNSORTED_DIR),
+                     table['file'][mask])
         clean_table = table[~mask]
         try:
-            tree = TableTree(clean_table, tree_keys, 'file')
+            tree = TableTree(clean_table, tree_keys, 'file', bins=bins)
         except IndexError:
             continue
-        for parents, children, files in tree.walk():
-            if files:
-                str_parents = [str(p) for p in parents]
-                this_dest = os.path.join(dest_dir, *str_parents)
-                os.makedirs(this_dest)
-                source_files = prepend_path(directory, files)
-                copy_files(source_files, this_dest, copy_or_move)
+        for parents, _, files in tree.walk(leaves_only=True,
+                                           tuple_parents=True):
+            str_parents = [str(p) for p in parents]
+            place_in(os.path.join(dest_dir, *str_parents), files)
+
+    # Rename files that would otherwise land on top of each other.
+    targets = {}
+    for index, (source, dest) in enumerate(placements):
+        target = (dest, os.path.basename(source))
+        targets.setdefault(target, []).append(index)
+    for (dest, name), indexes in six.iteritems(targets):
+        if len(indexes) == 1:
+            continue
+        for index in indexes:
+            source = placements[index][0]
+            prefix = prefixes[os.path.dirname(source)]
+            placements[index] = (source, dest, prefix + '_' + name)
+    return placements
+
+
+def sort_directories(directories, verbose=False,
+                     destination=None,
+                     no_log_destination=False,
+                     script_name=None,
+                     move=False,
+                     header_cache=False,
+                     link_mode=None,
+                     jobs=1,
+                     recursive=False,
+                     verify=False,
+                     fits_checksum=False,
+                     exptime_tolerance=None):
+    """
+    Sort the files in one or more directories into a single tree
+
+    The placement of every file is planned first, with :func:`plan_sort`,
+    and saved in a :class:`~msumastro.file_transfer.PlacementJournal` in the
+    directory in which the tree is made; files are then placed, and marked
+    in the journal as they are. If sorting is interrupted, calling this
+    again with the same arguments finishes the plan in the journal instead
+    of making a new one; a journal left by sorting other directories, or
+    into another destination or with another link mode, is not resumed and
+    a `ValueError` is raised. The journal is removed once every file has
+    been placed.
+
+    Parameters
+    ----------
+    directories : list of str
+        Directories whose files are to be sorted
+    destination : str, optional
+        Directory into which the sorted files/directories should be placed.
+        It can be omitted only when sorting one directory, which is then
+        sorted in place.
+    recursive : bool, optional
+        If ``True``, also sort the files in every directory below
+        `directories`.
+
+    See :func:`sort_directory` for the other parameters and the return
+    value.
+    """
+    script_name = script_name or 'sort_files'
+    if destination is not None:
+        working_dir = destination
+        makedirs(destination)
+    elif len(directories) == 1 and not recursive:
+        working_dir = directories[0]
+    else:
+        raise ValueError('A destination is needed to sort more than one '
+                         'directory')
+
+    if (not no_log_destination) and (destination is not None):
+        add_file_handlers(logger, working_dir, script_name)
+
+    if link_mode is None:
+        link_mode = 'move' if move else 'copy'
+    elif move and link_mode != 'move':
+        raise ValueError('move cannot be combined with link mode '
+                         '{0}'.format(link_mode))
+
+    logger.info("Working on directories: %s", ', '.join(directories))
+    logger.info("Destination directory is: %s", destination)
+
+    plan = dict(source=os.pathsep.join(os.path.abspath(d)
+                                       for d in directories),
+                destination=os.path.abspath(working_dir),
+                link_mode=link_mode)
+    with PlacementJournal.for_directory(working_dir) as journal:
+        if journal.has_plan:
+            for key, value in sorted(plan.items()):
+                if journal.info(key) != value:
+                    raise ValueError('Unfinished sort in {0} has {1} {2}, '
+                                     'not {3}; finish it or remove '
+                                     '{4}'.format(working_dir, key,
+                                                  journal.info(key), value,
+                                                  journal.path))
+            logger.info('Resuming sort planned in %s', journal.path)
+        else:
+            placements = plan_sort(directories, working_dir,
+                                   recursive=recursive,
+                                   header_cache=header_cache,
+                                   exptime_tolerance=exptime_tolerance)
+            journal.write_plan(placements, **plan)
+        pending = journal.pending()
+        logger.info('%d of %d files to place', len(pending), len(journal))
+
+        for dest in sorted(set(row[2] for row in pending)):
+            makedirs(dest)
+
+        def record(index, error):
+            placement_id = pending[index][0]
+            if error is None:
+                journal.mark_done(placement_id)
+            else:
+                journal.mark_failed(placement_id, error)
+
+        manifest = (TransferManifest.for_directory(working_dir)
+                    if verify else None)
+        try:
+            failures = place_files([row[1:] for row in pending],
+                                   link_mode=link_mode, jobs=jobs,
+                                   record=record, manifest=manifest,
+                                   fits_checksum=fits_checksum)
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    if failures:
+        logger.warning('%d files were not placed; run the sort again to '
+                       'retry them', len(failures))
+    else:
+        os.remove(journal.path)
+    return failures
+
+
+def sort_directory(directory, verbose=False,
+                   destination=None,
+                   no_log_destination=False,
+                   script_name=None,
+                   move=False,
+                   header_cache=False,
+                   link_mode=None,
+                   jobs=1,
+                   verify=False,
+                   fits_checksum=False,
+                   exptime_tolerance=None):
+    """
+    Sort files in a directory into a tree
+
+    See :func:`sort_directories` for how sorting is planned, carried out and
+    resumed if it is interrupted.
+
+    Parameters
+    ----------
+    directory : str
+        Directory whose files are to be sorted
+    verbose : bool
+        If True, increase logging verbosity
+    destination : str, optional
+        Directory into which the sorted files/directories should be placed. If
+        omitted, sorting is done in the source ``directory``.
+    no_log_destination : bool, optional
+        Suppress logging in the destination directory. Logging cannot be
+        suppressed if you are running in the destination directory.
+    script_name : str, optional, default is 'sort_files'
+        Name of the script calling this function; used to set the name of the
+        log file in the destination.
+    move : bool, optional
+        If ``True``, move the files instead of copying them; the same as
+        ``link_mode='move'``.
+    header_cache : bool, optional
+        If ``True``, keep a cache of FITS headers in `directory`.
+    link_mode : str, optional
+        How files are placed in the tree; one of
+        `~msumastro.file_transfer.LINK_MODES`. Default is ``'copy'``, or
+        ``'move'`` if `move` is ``True``.
+    jobs : int, optional
+        Number of files to place at the same time.
+    verify : bool, optional
+        If ``True``, check the size of each copy, hash the original while
+        copying it, and list the hashes in a
+        :class:`~msumastro.file_transfer.TransferManifest` in the directory
+        in which the tree is made. A copy that does not match is removed
+        and counted as not placed.
+    fits_checksum : bool, optional
+        If ``True``, add the FITS ``DATASUM`` and ``CHECKSUM`` cards to each
+        file that is copied or moved into the tree.
+    exptime_tolerance : float, optional
+        If given, exposure times that differ by no more than this many
+        seconds are sorted into the same directory; see :func:`plan_sort`.
+
+    Returns
+    -------
+    list of (str, Exception)
+        Files that could not be placed in the tree; see
+        :func:`place_files`. They remain in the journal, so calling this
+        again tries them again.
+    """
+    return sort_directories([directory], verbose=verbose,
+                            destination=destination,
+                            no_log_destination=no_log_destination,
+                            script_name=script_name, move=move,
+                            header_cache=header_cache, link_mode=link_mode,
+                            jobs=jobs, verify=verify,
+                            fits_checksum=fits_checksum,
+                            exptime_tolerance=exptime_tolerance)
 
 
 def construct_parser():
     parser = script_helpers.construct_default_parser(__doc__)
-    parser.add_argument('--move', '-m', action='store_true',
-                        help='Move files instead of copying them.')
+    placement = parser.add_mutually_exclusive_group()
+    placement.add_argument('--move', '-m', action='store_true',
+                           help='Move files instead of copying them; the '
+                                'same as --link-mode move.')
+    placement.add_argument('--link-mode', choices=LINK_MODES, default=None,
+                           help='How files are placed in the sorted tree. '
+                                'hardlink and reflink fall back to copying '
+                                'if the link cannot be made. Default is '
+                                'copy.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to copy, move or link at the '
+                             'same time; more than one is much faster on '
+                             'network storage. Default is 1.')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Also sort the files in every directory below '
+                             'those given. Needs --destination-dir.')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check the size of each copy and list hashes '
+                             'of the originals in transfers.sha1 in the '
+                             'destination.')
+    parser.add_argument('--fits-checksum', action='store_true',
+                        help='Add the FITS DATASUM and CHECKSUM cards to '
+                             'each file copied or moved.')
+    parser.add_argument('--exptime-tolerance', type=float, default=None,
+                        metavar='SECONDS',
+                        help='Sort exposure times that differ by no more '
+                             'than this into the same directory.')
+    script_helpers.add_header_cache(parser)
     return parser
 
 
@@ -213,13 +612,25 @@ def main(arglist=None):
     if not args.dir:    # pragma: no cover
         parser.error('No directory specified')
 
+    if ((len(args.dir) > 1 or args.recursive) and
+            args.destination_dir is None):
+        parser.error('--destination-dir is needed to sort more than one '
+                     'directory')
+
     do_not_log_in_destination = \
         script_helpers.handle_destination_dir_logging_check(args)
 
-    sort_directory(args.dir[0],
-                   verbose=args.verbose,
-                   destination=args.destination_dir,
-                   no_log_destination=do_not_log_in_destination,
-                   move=args.move)
+    sort_directories(args.dir,
+                     verbose=args.verbose,
+                     destination=args.destination_dir,
+                     no_log_destination=do_not_log_in_destination,
+                     move=args.move,
+                     header_cache=args.header_cache,
+                     link_mode=args.link_mode,
+                     jobs=args.jobs,
+                     recursive=args.recursive,
+                     verify=args.verify,
+                     fits_checksum=args.fits_checksum,
+                     exptime_tolerance=args.exptime_tolerance)
 
 main.__doc__ = script_helpers._main_function_docstring(__name__)
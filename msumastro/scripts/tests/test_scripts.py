@@ -1,7 +1,9 @@
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
+import bz2
 import os
+import threading
 from contextlib import contextmanager
 
 import astropy.io.fits as fits
@@ -16,11 +18,17 @@ from ...header_processing.patchers import IRAF_image_type
 from .. import run_patch as run_patch
 
 from .. import run_triage
+from .. import header_catalog
+from .. import run_watch
+from .. import make_views
 
 from .. import run_astrometry
 from .. import run_standard_header_process
 from .. import sort_files
+from ... import catalog as catalog_module
+from ...file_transfer import hash_file
 from ...image_collection import ImageFileCollection
+from ...manifest import read_manifest
 from ..script_helpers import handle_destination_dir_logging_check
 from .. import quick_add_keys_to_file
 from ...tests.data import get_data_dir
@@ -154,6 +162,18 @@ class TestScript(object):
         print(h)
         assert 'object' not in h
 
+    def test_run_patch_skips_fits_manifest(self, tmpdir):
+        run_triage.main(['--manifest-format', 'fits', self.test_dir.strpath])
+        manifest = self.test_dir.join('Manifest.manifest.fits')
+        contents = manifest.read_binary()
+        destination = tmpdir.mkdir('patched')
+        run_patch.patch_directories([self.test_dir.strpath],
+                                    destination=destination.strpath,
+                                    overscan_only=True)
+        assert destination.listdir(fil=str('*.fit'))
+        assert not destination.join(manifest.basename).check()
+        assert manifest.read_binary() == contents
+
     def test_run_triage_no_output_generated(self, default_keywords):
         list_before = self.test_dir.listdir(sort=True)
         run_triage.triage_directories([self.test_dir.strpath],
@@ -316,6 +336,56 @@ class TestScript(object):
             print(blind_path.strpath)
             assert (blind_path.check())
 
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_run_astrometry_blind_with_fake_solver(self, fake_solve_field,
+                                                    jobs):
+        destination = self.test_dir.make_numbered_dir()
+        arglist = ['--blind', '--jobs', str(jobs),
+                   '--destination-dir', destination.strpath,
+                   self.test_dir.strpath]
+        run_astrometry.main(arglist)
+        ic = ImageFileCollection(destination.strpath,
+                                 keywords=['imagetyp', 'wcsaxes', 'ra'])
+        lights = ic.summary[ic.summary['imagetyp'] == 'LIGHT']
+        assert len(lights) > 0
+        assert not lights['wcsaxes'].mask.any()
+        assert not lights['ra'].mask.any()
+
+    def test_run_astrometry_ledger_skips_unsolvable(self, fake_solve_field,
+                                                    monkeypatch):
+        from ...header_processing.ledger import AstrometryLedger
+
+        hashed = []
+
+        def file_hash(name):
+            hashed.append(name)
+            return hash_file(name, 'sha1')
+
+        monkeypatch.setattr(run_astrometry, 'ledger_file_hash', file_hash)
+        monkeypatch.setenv(str('FAKE_SOLVE_FIELD_FAILURE_RATE'), str('1'))
+        ledger = self.test_dir.join('ledger.sqlite').strpath
+        destination = self.test_dir.make_numbered_dir()
+        arglist = ['--blind', '--ledger', ledger,
+                   '--destination-dir', destination.strpath,
+                   self.test_dir.strpath]
+        run_astrometry.main(arglist)
+        with AstrometryLedger(ledger) as record:
+            n_attempts = len(record.attempts())
+            n_files = len(set(record.attempts()['file']))
+            assert n_attempts > 0
+            assert not any(record.attempts()['solved'])
+        # Files not in the ledger are not hashed before solving starts.
+        assert hashed == []
+        # Second run should not try again
+        run_astrometry.main(arglist)
+        with AstrometryLedger(ledger) as record:
+            assert len(record.attempts()) == n_attempts
+        assert len(hashed) == n_files
+        # ...but a run with different options should.
+        run_astrometry.main(['--avoid-pyfits'] + arglist)
+        with AstrometryLedger(ledger) as record:
+            assert len(record.attempts()) == 2 * n_attempts
+
     @pytest.mark.parametrize('file_column',
                              ['file',
                               'FiLe',
@@ -588,6 +658,176 @@ class TestSortFiles(object):
                 path = os.path.join(dest_path, *parents)
                 assert len(os.listdir(path)) == num_files
 
+    @pytest.mark.parametrize('link_mode', ['hardlink', 'symlink'])
+    def test_sort_with_links(self, set_test_files, link_mode):
+        dest = self.test_dir.mkdtemp()
+        sort_files.main(['--link-mode', link_mode, '-d', dest.strpath,
+                         self.test_dir.strpath])
+        n_placed = 0
+        for placed in dest.visit(fil=str('*.fit')):
+            original = self.test_dir.join(placed.basename)
+            assert os.path.samefile(original.strpath, placed.strpath)
+            assert placed.islink() == (link_mode == 'symlink')
+            n_placed += 1
+        assert n_placed == len(self.test_dir.listdir(fil=str('*.fit')))
+
+    def test_sort_in_parallel_matches_serial(self, set_test_files):
+        trees = []
+        for jobs in [1, 4]:
+            dest = self.test_dir.mkdtemp()
+            sort_files.main(['--jobs', str(jobs), '-d', dest.strpath,
+                             self.test_dir.strpath])
+            trees.append(sorted(p.relto(dest)
+                                for p in dest.visit(fil=str('*.fit'))))
+        assert trees[0] and trees[0] == trees[1]
+
+    @pytest.mark.parametrize('link_mode', ['copy', 'move'])
+    def test_sort_resumes_after_interruption(self, set_test_files,
+                                             monkeypatch, link_mode):
+        n_files = len(self.test_dir.listdir(fil=str('*.fit')))
+        dest = self.test_dir.mkdtemp()
+        args = ['--link-mode', link_mode, '-d', dest.strpath,
+                self.test_dir.strpath]
+        transfer = sort_files.transfer_file
+        placed = []
+
+        def crash_part_way(*arg, **kwd):
+            if len(placed) == n_files // 2:
+                raise RuntimeError('power cut')
+            placed.append(transfer(*arg, **kwd))
+            return placed[-1]
+
+        monkeypatch.setattr(sort_files, 'transfer_file', crash_part_way)
+        with pytest.raises(RuntimeError):
+            sort_files.main(args)
+        journal = dest.join(sort_files.PlacementJournal.DEFAULT_NAME)
+        assert journal.check()
+
+        monkeypatch.setattr(sort_files, 'transfer_file', transfer)
+        sort_files.main(args)
+        assert not journal.check()
+        assert len(list(dest.visit(fil=str('*.fit')))) == n_files
+        # Running again once finished changes nothing.
+        assert sort_files.sort_directory(self.test_dir.strpath,
+                                         destination=dest.strpath,
+                                         link_mode=link_mode) == []
+
+    def test_sort_does_not_resume_other_sort(self, set_test_files,
+                                             monkeypatch):
+        dest = self.test_dir.mkdtemp()
+        other = self.test_dir.mkdtemp()
+        for fits_file in self.test_dir.listdir(fil=str('*.fit')):
+            fits_file.copy(other)
+
+        def crash(*arg, **kwd):
+            raise RuntimeError('power cut')
+
+        monkeypatch.setattr(sort_files, 'transfer_file', crash)
+        with pytest.raises(RuntimeError):
+            sort_files.sort_directory(self.test_dir.strpath,
+                                      destination=dest.strpath)
+        monkeypatch.undo()
+        journal = dest.join(sort_files.PlacementJournal.DEFAULT_NAME)
+        with pytest.raises(ValueError):
+            sort_files.sort_directory(other.strpath,
+                                      destination=dest.strpath)
+        assert journal.check()
+        assert not list(dest.visit(fil=str('*.fit')))
+        assert sort_files.sort_directory(self.test_dir.strpath,
+                                         destination=dest.strpath) == []
+        assert not journal.check()
+
+    def test_sort_recursive_merges_directories(self, set_test_files):
+        root = py.path.local(self.test_dir.mkdtemp())
+        fits_names = [f.basename for f in self.test_dir.listdir(
+            fil=str('*.fit'))]
+        for night in ['night1', 'night2']:
+            night_dir = root.mkdir(night)
+            for name in fits_names:
+                self.test_dir.join(name).copy(night_dir)
+        dest = root.join('sorted')
+        sort_files.main(['--recursive', '-d', dest.strpath, root.strpath])
+        placed = [p.basename for p in dest.visit(fil=str('*.fit'))]
+        assert len(placed) == 2 * len(fits_names)
+        assert sorted(placed) == sorted(night + '_' + name
+                                        for night in ['night1', 'night2']
+                                        for name in fits_names)
+
+    def test_sort_verified_with_fits_checksums(self, set_test_files):
+        dest = self.test_dir.mkdtemp()
+        sort_files.main(['--verify', '--fits-checksum', '--jobs', '2',
+                         '-d', dest.strpath, self.test_dir.strpath])
+        manifest = sort_files.TransferManifest.for_directory(dest.strpath)
+        digests = manifest.read()
+        manifest.close()
+        placed = list(dest.visit(fil=str('*.fit')))
+        assert len(digests) == len(placed)
+        for path in placed:
+            assert digests[path.relto(dest)] == hash_file(path.strpath)
+            with fits.open(path.strpath, checksum=True) as hdus:
+                assert 'CHECKSUM' in hdus[0].header
+                assert 'DATASUM' in hdus[0].header
+        # The copies are recognized as placed although the cards changed
+        # them.
+        assert sort_files.sort_directory(self.test_dir.strpath,
+                                         destination=dest.strpath,
+                                         verify=True,
+                                         fits_checksum=True) == []
+
+    @pytest.mark.parametrize('link_mode', ['copy', 'move', 'hardlink'])
+    def test_sort_keeps_files_already_in_destination(self, set_test_files,
+                                                     link_mode):
+        dest = self.test_dir.mkdtemp()
+        sort_files.main(['-d', dest.strpath, self.test_dir.strpath])
+        journal = dest.join(sort_files.PlacementJournal.DEFAULT_NAME)
+        earlier = dest.join('BIAS').listdir(fil=str('*.fit'))[0]
+        earlier.write('earlier night')
+        n_placed = len(list(dest.visit(fil=str('*.fit'))))
+        # A second night with the same file names, sorted into the same tree
+        failures = sort_files.sort_directory(self.test_dir.strpath,
+                                             destination=dest.strpath,
+                                             link_mode=link_mode)
+        assert earlier.basename in [os.path.basename(f) for f, _ in failures]
+        assert earlier.read() == 'earlier night'
+        assert self.test_dir.join(earlier.basename).check()
+        assert len(list(dest.visit(fil=str('*.fit')))) == n_placed
+        assert journal.check()
+
+    def test_sort_skips_fits_manifest(self, set_test_files):
+        run_triage.main(['--manifest-format', 'fits', self.test_dir.strpath])
+        dest = self.test_dir.mkdtemp()
+        failures = sort_files.sort_directory(self.test_dir.strpath,
+                                             destination=dest.strpath)
+        assert failures == []
+        assert not list(dest.visit(fil=str('*.manifest.fits')))
+        assert (len(list(dest.visit(fil=str('*.fit')))) ==
+                len(self.test_dir.listdir(fil=str('*.fit'))))
+
+    def test_sort_with_exptime_tolerance(self, set_test_files):
+        images = ImageFileCollection(self.test_dir.strpath,
+                                     keywords=['imagetyp', 'exptime'])
+        n_dark = 0
+        for header in images.headers(overwrite=True, imagetyp='DARK'):
+            # Make the exposure times of the darks, 20 and 30 seconds,
+            # differ slightly.
+            header['exptime'] += 0.001 * (n_dark % 3)
+            n_dark += 1
+        dest = self.test_dir.mkdtemp()
+        sort_files.main(['--exptime-tolerance', '0.01', '-d', dest.strpath,
+                         self.test_dir.strpath])
+        assert len(dest.join('DARK').listdir()) == 2
+        assert len(list(dest.join('DARK').visit(fil=str('*.fit')))) == n_dark
+
+    def test_sort_several_directories_needs_destination(self,
+                                                        set_test_files):
+        with pytest.raises(SystemExit):
+            sort_files.main([self.test_dir.strpath, self.test_dir.strpath])
+
+    def test_sort_move_and_link_mode_conflict(self, set_test_files):
+        with pytest.raises(SystemExit):
+            sort_files.main(['--move', '--link-mode', 'hardlink',
+                             self.test_dir.strpath])
+
     def test_sort_creates_destination_if_needed(self, set_test_files):
         dest = self.test_dir.mkdtemp()
         dest = dest.join('crazy_dir')
@@ -616,6 +856,20 @@ class TestSortFiles(object):
         assert len(os.listdir(unsorted_path)) == n_light
 
 
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_place_files_reports_each_failure(tmpdir, jobs):
+    source = tmpdir.mkdir('source')
+    dest = tmpdir.mkdir('dest')
+    names = ['a.fit', 'b.fit', 'c.fit', 'd.fit']
+    for name in names[:2]:
+        source.join(name).write('SIMPLE')
+    failures = sort_files.place_files([(source.join(name).strpath,
+                                        dest.strpath) for name in names],
+                                      jobs=jobs)
+    assert sorted(os.path.basename(f) for f, _ in failures) == names[2:]
+    assert sorted(dest.listdir()) == [dest.join(n) for n in names[:2]]
+
+
 def test_triage_via_triage_fits_files(triage_setup):
     file_info = run_triage.triage_fits_files(triage_setup.test_dir)
     print("number of files should be %i" % triage_setup.n_test['files'])
@@ -642,3 +896,267 @@ def test_triage_via_run_triage(triage_setup, triage_dict):
                                  triage_dict[fname])
         dump = Table.read(file_path, format='ascii')
         assert len(dump) == triage_setup.n_test[n_name]
+
+
+@pytest.mark.parametrize('files_per_task,header_cache',
+                         [(1000, False), (2, False), (2, True)])
+def test_triage_parallel_matches_serial(triage_setup, tmpdir, monkeypatch,
+                                        files_per_task, header_cache):
+    # A second directory, so that directories are triaged at the same time.
+    other = tmpdir.join('other')
+    py.path.local(triage_setup.test_dir).copy(other)
+    directories = [triage_setup.test_dir, other.strpath]
+    serial_dest = tmpdir.mkdir('serial')
+    parallel_dest = tmpdir.mkdir('parallel')
+    monkeypatch.setattr(run_triage, 'FILES_PER_TASK', files_per_task)
+    # In parallel first, so that the headers are read by the workers and
+    # added to the cache, if there is one, by this process.
+    parallel = list(run_triage._triage_in_pool(
+        directories, list(run_triage.DEFAULT_KEYS) + ['ra', 'objctra'],
+        header_cache, 'astropy', 2, run_triage.Feder()))
+    serial = dict(run_triage._triage_one_at_a_time(
+        directories, list(run_triage.DEFAULT_KEYS) + ['ra', 'objctra'],
+        header_cache, 'astropy', run_triage.Feder()))
+    assert [d for d, _ in parallel] == directories
+    for directory, result in parallel:
+        expected = serial[directory]
+        for key in ['needs_filter', 'needs_pointing', 'needs_object_name',
+                    'needs_astrometry']:
+            assert sorted(result[key]) == sorted(expected[key])
+        expected_files = expected['files']
+        expected_files.sort('file')
+        result['files'].sort('file')
+        np.testing.assert_array_equal(result['files']['file'],
+                                      expected_files['file'])
+        np.testing.assert_array_equal(result['files']['imagetyp'],
+                                      expected_files['imagetyp'])
+        assert result['files'].colnames == expected_files.colnames
+        assert ([c.dtype for c in result['files'].columns.values()] ==
+                [c.dtype for c in expected_files.columns.values()])
+
+    for dest, jobs in [(serial_dest, '1'), (parallel_dest, '2')]:
+        run_triage.main(['--jobs', jobs, '-d', dest.strpath,
+                         triage_setup.test_dir])
+    for name in os.listdir(serial_dest.strpath):
+        if name.endswith('.txt'):
+            assert (parallel_dest.join(name).read() ==
+                    serial_dest.join(name).read())
+
+
+def test_triage_from_rows_parsed_by_workers(triage_setup, monkeypatch):
+    keywords = list(run_triage.DEFAULT_KEYS) + ['ra', 'objctra']
+    files = run_triage.fits_files(triage_setup.test_dir)
+    rows = run_triage._rows_worker((triage_setup.test_dir, keywords,
+                                    'astropy', files))
+    assert len(rows) == len(files)
+    expected = run_triage.triage_fits_files(triage_setup.test_dir,
+                                            file_info_to_keep=keywords)
+
+    def read_again(*arg, **kwd):
+        raise AssertionError('Header parsed again')
+
+    # Only the workers read headers; this process just gathers the values.
+    monkeypatch.setattr(ImageFileCollection, '_read_header', read_again)
+    result = run_triage.triage_fits_files(triage_setup.test_dir,
+                                          file_info_to_keep=keywords,
+                                          header_rows=rows)
+    assert result['files'].colnames == expected['files'].colnames
+    for key in ['needs_filter', 'needs_pointing', 'needs_object_name',
+                'needs_astrometry']:
+        assert sorted(result[key]) == sorted(expected[key])
+
+
+def test_run_triage_manifest_formats(triage_setup):
+    run_triage.main(['--manifest-format', 'ascii',
+                     '--manifest-format', 'fits',
+                     '--manifest-format', 'ecsv',
+                     triage_setup.test_dir])
+    text = read_manifest(os.path.join(triage_setup.test_dir,
+                                      'Manifest.txt'))
+    for name in ['Manifest.manifest.fits', 'Manifest.ecsv']:
+        binary = read_manifest(os.path.join(triage_setup.test_dir, name),
+                               columns=['file', 'imagetyp'])
+        np.testing.assert_array_equal(binary['file'], text['file'])
+        np.testing.assert_array_equal(binary['imagetyp'], text['imagetyp'])
+
+
+def test_triage_classification_masks(triage_setup):
+    name = 'filter_object_light.fit'
+    fits.delval(os.path.join(triage_setup.test_dir, name), 'imagetyp')
+    file_info = run_triage.triage_fits_files(triage_setup.test_dir)
+    assert file_info['needs_imagetyp'] == [name]
+    files = file_info['files']['file']
+    for key in ['needs_filter', 'needs_pointing', 'needs_object_name',
+                'needs_astrometry', 'needs_imagetyp']:
+        mask = file_info['masks'][key]
+        assert len(mask) == len(files)
+        assert sorted(files[mask]) == sorted(file_info[key])
+
+
+def test_triage_classify_ignores_column_case():
+    table = Table(masked=True)
+    table['file'] = ['a.fit', 'b.fit']
+    table['IMAGETYP'] = ['Light', 'LIGHT']
+    table['Filter'] = ['R', 'R']
+    table['object'] = ['m101', 'm101']
+    table['WCSAXES'] = [2, 2]
+    table['OBJCTRA'] = ['14:03:12', '14:03:12']
+    table['OBJCTRA'].mask = [False, True]
+    table['HA'] = ['1:00:00', '1:00:00']
+    masks = run_triage._classify(table, run_triage.Feder())
+    np.testing.assert_array_equal(masks['needs_pointing'], [False, True])
+    assert not masks['needs_filter'].any()
+    assert not masks['needs_astrometry'].any()
+    assert not masks['needs_imagetyp'].any()
+
+
+def test_run_triage_does_not_triage_its_fits_manifest(triage_setup):
+    args = ['--manifest-format', 'fits', triage_setup.test_dir]
+    run_triage.main(args)
+    run_triage.main(args)
+    table = read_manifest(os.path.join(triage_setup.test_dir,
+                                       'Manifest.manifest.fits'))
+    assert len(table) == triage_setup.n_test['files']
+
+
+@pytest.mark.parametrize('use_destination', [False, True])
+def test_run_triage_recursive(triage_setup, tmpdir, use_destination):
+    root = tmpdir.join('archive')
+    for night in ['night1', 'night2/sub']:
+        py.path.local(triage_setup.test_dir).copy(root.join(night))
+    root.join('empty').ensure(dir=True)
+    args = ['--recursive', root.strpath]
+    output_root = root
+    if use_destination:
+        output_root = tmpdir.join('output')
+        args = ['-d', output_root.strpath] + args
+    run_triage.main(args)
+
+    for night in ['night1', 'night2/sub']:
+        assert output_root.join(night, 'Manifest.txt').check()
+    assert not output_root.join('empty', 'Manifest.txt').check()
+    archive = read_manifest(output_root.join('ArchiveManifest.txt').strpath)
+    assert len(archive) == 2 * triage_setup.n_test['files']
+    assert len(set(archive['Source path'])) == 2
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_triage_directories_bzip2_files(triage_setup, tmpdir, monkeypatch,
+                                        jobs):
+    night = tmpdir.mkdir('bz2_only')
+    names = ['filter_object_light.fit', 'no_filter_no_object_bias.fit']
+    for name in names:
+        with open(os.path.join(triage_setup.test_dir, name), 'rb') as f_in:
+            with bz2.BZ2File(night.join(name + 's.bz2').strpath,
+                             'wb') as f_out:
+                f_out.write(f_in.read())
+    # Large enough, with two jobs, for the headers to be read in groups.
+    monkeypatch.setattr(run_triage, 'FILES_PER_TASK', 1)
+    run_triage.triage_directories([night.strpath], jobs=jobs,
+                                  output_table='Manifest.txt')
+    table = read_manifest(night.join('Manifest.txt').strpath)
+    assert sorted(table['file']) == [name + 's.bz2' for name in names]
+
+
+def test_run_triage_updates_catalog_and_query(triage_setup, tmpdir,
+                                              monkeypatch):
+    def read_again(*arg, **kwd):
+        raise AssertionError('Header read again for the catalog')
+
+    # The catalog is filled from the headers read by triage.
+    monkeypatch.setattr(catalog_module, 'scan_header', read_again)
+    catalog = tmpdir.join('catalog.sqlite').strpath
+    run_triage.main(['--catalog', catalog, triage_setup.test_dir])
+    monkeypatch.undo()
+    biases = header_catalog.main(['--imagetyp', 'bias', catalog])
+    assert len(biases) == triage_setup.n_test['bias']
+    assert header_catalog.main(['--update', triage_setup.test_dir,
+                                catalog]) == 0
+
+
+def test_run_watch_triages_new_files(triage_setup, monkeypatch):
+    stop = threading.Event()
+    batches = []
+    process = run_watch.process_new_files
+
+    def process_and_stop(directory, files, **kwd):
+        process(directory, files, **kwd)
+        batches.append(files)
+        stop.set()
+
+    monkeypatch.setattr(run_watch, 'process_new_files', process_and_stop)
+    n = run_watch.main(['--no-patch', '--include-existing',
+                        '--settle-time', '0', '--poll-interval', '0.01',
+                        triage_setup.test_dir], stop=stop)
+    assert n == triage_setup.n_test['files']
+    assert len(batches) == 1
+    output_table = run_triage.DefaultFileNames().output_table
+    table = Table.read(os.path.join(triage_setup.test_dir, output_table),
+                       format='ascii.csv')
+    assert len(table) == triage_setup.n_test['files']
+
+
+
+def test_run_watch_reads_only_new_files(triage_setup, monkeypatch):
+    names = sorted(f for f in os.listdir(triage_setup.test_dir)
+                   if f.endswith(('.fit', '.fit.gz')))
+    run_watch.process_new_files(triage_setup.test_dir, names[:-1],
+                                patch=False)
+    read = []
+    read_header = ImageFileCollection._read_header
+
+    def record(self, file_name):
+        read.append(os.path.basename(file_name))
+        return read_header(self, file_name)
+
+    monkeypatch.setattr(ImageFileCollection, '_read_header', record)
+    run_watch.process_new_files(triage_setup.test_dir, names[-1:],
+                                patch=False)
+    monkeypatch.undo()
+    assert read == names[-1:]
+    output_table = run_triage.DefaultFileNames().output_table
+    table = read_manifest(os.path.join(triage_setup.test_dir, output_table))
+    assert list(table['file']) == names
+    whole = run_triage.triage_fits_files(triage_setup.test_dir)
+    pointing = Table.read(os.path.join(triage_setup.test_dir,
+                                       'NEEDS_POINTING_INFO.txt'),
+                          format='ascii')
+    assert list(pointing['File']) == sorted(whole['needs_pointing'])
+
+
+def test_run_watch_reads_object_list_once(triage_setup, monkeypatch):
+    stop = threading.Event()
+    read = []
+    patched = []
+
+    def read_objects(object_list):
+        read.append(object_list)
+        return 'objects'
+
+    def patch_directories(directories, **kwd):
+        patched.append(kwd['objects'])
+
+    def process_and_stop(directory, files, **kwd):
+        for name in files:
+            process(directory, [name], **kwd)
+        stop.set()
+
+    process = run_watch.process_new_files
+    monkeypatch.setattr(run_patch, 'read_objects', read_objects)
+    monkeypatch.setattr(run_patch, 'patch_directories', patch_directories)
+    monkeypatch.setattr(run_watch, 'process_new_files', process_and_stop)
+    run_watch.main(['--include-existing', '--settle-time', '0',
+                    '--poll-interval', '0.01', triage_setup.test_dir],
+                   stop=stop)
+    assert read == [run_patch.DEFAULT_OBJECT_URL]
+    assert patched == ['objects'] * triage_setup.n_test['files']
+
+def test_make_views(triage_setup, tmpdir):
+    dest = tmpdir.join('views')
+    n_files = make_views.main(['-d', dest.strpath,
+                               '--view', 'by-type=imagetyp,filter',
+                               triage_setup.test_dir])
+    assert n_files == triage_setup.n_test['files']
+    links = [p for p in dest.join('by-type').visit() if p.islink()]
+    assert len(links) == n_files
+    assert len(dest.join('by-type', 'BIAS', 'No filter').listdir()) == 1
@@ -1,13 +1,38 @@
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
-from collections import Iterable, OrderedDict
+from collections import OrderedDict
+import hashlib
+import struct
+import zipfile
+try:
+    from collections.abc import Iterable, Mapping
+except ImportError:
+    from collections import Iterable, Mapping
 
-from astropy.table import Table
+import numpy as np
+from astropy.table import Table, vstack
 from astropy.extern.six.moves import zip as izip
 from astropy.extern import six
 
-__all__ = ['TableTree', 'RecursiveTree']
+__all__ = ['TableTree', 'RecursiveTree', 'CompactTableTree',
+           'table_fingerprint', 'BIN_KINDS']
+
+try:
+    _isin = np.isin
+except AttributeError:
+    # numpy before 1.13
+    _isin = np.in1d
+
+#: Kinds of bin for a numeric key; see `TableTree`.
+BIN_KINDS = ('tolerance', 'edges', 'decimals')
+
+# Version of the format written by CompactTableTree.save.
+_SAVE_FORMAT = 1
+
+# Readers of the header of each version of the .npy format.
+_NPY_HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0,
+                       (2, 0): np.lib.format.read_array_header_2_0}
 
 
 class RecursiveTree(OrderedDict):
@@ -37,6 +62,350 @@ class RecursiveTree(OrderedDict):
             self = self[keys[-1]]
 
 
+def _bin_spec(spec):
+    """
+    Kind and value of a binning spec; see `TableTree`.
+    """
+    if isinstance(spec, Mapping):
+        if len(spec) != 1 or list(spec)[0] not in BIN_KINDS:
+            raise ValueError('A bin spec must have one of {0}, not '
+                             '{1}'.format(', '.join(BIN_KINDS), spec))
+        kind, value = list(spec.items())[0]
+    elif np.isscalar(spec):
+        kind, value = 'tolerance', spec
+    else:
+        kind, value = 'edges', spec
+    if kind == 'edges':
+        value = np.asarray(value, dtype=float)
+        if value.ndim != 1 or not len(value) or (np.diff(value) <= 0).any():
+            raise ValueError('Bin edges must be increasing')
+    elif kind == 'tolerance' and value < 0:
+        raise ValueError('A tolerance cannot be negative')
+    return kind, value
+
+
+def _binnable(data):
+    """
+    An array of numbers as floats, checking that none is NaN, which would
+    otherwise fall silently into a neighbouring bin.
+    """
+    data = np.asarray(data, dtype=float)
+    if np.isnan(data).any():
+        raise ValueError('NaN values cannot be binned; remove them or '
+                         'replace them with a number')
+    return data
+
+
+def _bin_values(data, spec):
+    """
+    Value of the bin of each of an array of numbers.
+
+    See `TableTree` for the kinds of bin; each is computed for the whole
+    array at once.
+    """
+    kind, value = _bin_spec(spec)
+    data = _binnable(data)
+    if kind == 'decimals':
+        return np.round(data, int(value))
+    if kind == 'edges':
+        lower_edges = np.append(-np.inf, value)
+        return lower_edges[np.digitize(data, value)]
+    # Tolerance: sorted values closer than the tolerance to the next one are
+    # in the same bin.
+    if not len(data):
+        return data
+    values, inverse, counts = np.unique(data, return_inverse=True,
+                                        return_counts=True)
+    bin_ids = np.cumsum(np.append(True, np.diff(values) > value)) - 1
+    # The most common value in each bin, the smallest if there is a tie.
+    by_bin = np.lexsort((-counts, bin_ids))
+    firsts = by_bin[np.append(True, np.diff(bin_ids[by_bin]) != 0)]
+    return values[firsts][bin_ids][inverse.ravel()]
+
+
+def _nearest_key(key, keys, tolerance):
+    """
+    The one of `keys` nearest to `key`, if it is within `tolerance`;
+    otherwise `key`.
+    """
+    nearest = None
+    for existing in keys:
+        distance = abs(existing - key)
+        if distance <= tolerance and (nearest is None or
+                                      distance < abs(nearest - key)):
+            nearest = existing
+    return key if nearest is None else nearest
+
+
+def _key_codes(column, bins=None):
+    """
+    Integer code of each value in a column, in the sorted order of the
+    values, and the value of each code; values are first binned if `bins`
+    is given.
+    """
+    if np.ma.getmaskarray(column).any():
+        raise ValueError('Column {0} has missing values, which cannot be '
+                         'keys of the tree; use fill_missing or remove '
+                         'them'.format(column.name))
+    data = np.asarray(column)
+    if bins is not None:
+        data = _bin_values(data, bins)
+    values, codes = np.unique(data, return_inverse=True)
+    return codes.ravel(), values
+
+
+def _group_rows(table, keys, bins=None):
+    """
+    Sort the rows of a table into groups with the same values of some keys.
+
+    Keys in the dictionary `bins` are binned first; see `TableTree`.
+
+    Returns
+    -------
+    order : numpy.ndarray
+        Rows of `table` in the order of the groups, which are sorted by the
+        values of the keys; rows keep their order within a group.
+    bounds : numpy.ndarray
+        The rows of group ``i`` are ``order[bounds[i]:bounds[i + 1]]``.
+    group_codes : list of numpy.ndarray
+        For each key, the code of its value in each group.
+    key_values : list of numpy.ndarray
+        For each key, the value of each code.
+    """
+    n_rows = len(table)
+    codes = []
+    key_values = []
+    bins = bins or {}
+    for key in keys:
+        key_codes, values = _key_codes(table[key], bins.get(key))
+        codes.append(key_codes)
+        key_values.append(values)
+    # lexsort sorts by the last key first.
+    order = np.lexsort(codes[::-1]) if codes else np.arange(n_rows)
+    new_group = np.zeros(n_rows, dtype=bool)
+    new_group[:1] = True
+    sorted_codes = [c[order] for c in codes]
+    for c in sorted_codes:
+        new_group[1:] |= c[1:] != c[:-1]
+    starts = np.flatnonzero(new_group)
+    group_codes = [c[starts] for c in sorted_codes]
+    bounds = np.append(starts, n_rows)
+    return order, bounds, group_codes, key_values
+
+
+def _check_arguments(table, tree_keys, index_key, bins=None):
+    """
+    Check the arguments used to make a tree from a table.
+
+    Each key must be a table column name, and the values in the column
+    named `index_key` must be unique. Each key with bins must be a tree key
+    and its spec must be valid.
+    """
+    if not isinstance(table, Table):
+        raise TypeError('First argument must be an '
+                        'astropy.table.Table instance')
+
+    if (isinstance(tree_keys, six.string_types) or
+            not isinstance(tree_keys, Iterable)):
+        raise TypeError('Second argument must be list-like but not '
+                        'a single string.')
+
+    if not isinstance(index_key, six.string_types):
+        raise TypeError('Third argument must be a string.')
+
+    for key in tree_keys:
+        # Raises KeyError if there is no such column.
+        table[key]
+
+    for key, spec in six.iteritems(bins or {}):
+        if key not in tree_keys:
+            raise ValueError('Bins given for {0}, which is not a key of the '
+                             'tree'.format(key))
+        _bin_spec(spec)
+
+    index_column = np.asarray(table[index_key])
+    if len(np.unique(index_column)) != len(table):
+        raise ValueError('The table column named {0} cannot be used as '
+                         'and index because its values are '
+                         'not unique'.format(index_key))
+
+
+def _walk(tree, parent=(), topdown=True, leaves_only=False,
+          tuple_parents=False):
+    """
+    Walk a tree of mappings with an explicit stack instead of recursion.
+
+    See :meth:`TableTree.walk` for the arguments and what is yielded.
+    Anything in the tree that is not a mapping is a leaf.
+    """
+    to_parents = tuple if tuple_parents else list
+    # Each entry is the keys leading to a node, the node and whether the
+    # nodes below it have already been put on the stack.
+    stack = [(tuple(parent), tree, False)]
+    while stack:
+        parents, node, expanded = stack.pop()
+        if not isinstance(node, Mapping):
+            yield to_parents(parents), [], node
+            continue
+        if expanded or topdown:
+            if not leaves_only:
+                yield to_parents(parents), node.keys(), []
+            if expanded:
+                continue
+        if not topdown:
+            stack.append((parents, node, True))
+        children = [(parents + (key,), child, False)
+                    for key, child in node.items()]
+        children.reverse()
+        stack.extend(children)
+
+
+def table_fingerprint(table, columns=None):
+    """
+    Hash of the contents of some columns of a table.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+        Table to fingerprint.
+    columns : list of str, optional
+        Columns to include; default is all of them.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest, which changes if a row is added, removed or
+        reordered or a value in one of the columns changes.
+    """
+    digest = hashlib.sha1()
+    digest.update(str(len(table)).encode('ascii'))
+    for name in columns if columns is not None else table.colnames:
+        column = table[name]
+        data = np.ascontiguousarray(np.asarray(column))
+        digest.update(name.encode('utf-8'))
+        digest.update(data.dtype.str.encode('ascii'))
+        if data.dtype.hasobject:
+            digest.update(repr(data.tolist()).encode('utf-8'))
+        else:
+            digest.update(data.tobytes())
+        digest.update(np.ma.getmaskarray(column).tobytes())
+    return digest.hexdigest()
+
+
+def _tree_fingerprint(table, tree_keys, index_key, bins=None):
+    """
+    Fingerprint of a tree: of the columns it uses and how they are binned.
+    """
+    fingerprint = table_fingerprint(table, list(tree_keys) + [index_key])
+    if bins:
+        specs = repr(sorted((key, repr(spec)) for key, spec in bins.items()))
+        fingerprint += '-' + hashlib.sha1(specs.encode('utf-8')).hexdigest()
+    return fingerprint
+
+
+def _npz_name(path):
+    """
+    Name of an npz file, with ``.npz`` added as `numpy.savez` does.
+    """
+    return path if path.endswith('.npz') else path + '.npz'
+
+
+def _load_npz(path):
+    """
+    Arrays in an npz file, memory mapped where they are stored uncompressed.
+
+    `numpy.load` cannot memory map the arrays in an npz file, but each is an
+    ordinary .npy file inside a zip archive, so its data can be found and
+    mapped directly.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        with open(path, 'rb') as f:
+            for info in archive.infolist():
+                name = info.filename
+                if name.endswith('.npy'):
+                    name = name[:-len('.npy')]
+                f.seek(info.header_offset)
+                local_header = f.read(30)
+                name_length, extra_length = struct.unpack(
+                    '<HH', local_header[26:30])
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(f)
+                read_header = _NPY_HEADER_READERS.get(version)
+                mappable = (info.compress_type == zipfile.ZIP_STORED and
+                            read_header is not None)
+                if mappable:
+                    shape, fortran_order, dtype = read_header(f)
+                    mappable = (not dtype.hasobject and
+                                int(np.prod(shape)) > 0)
+                if mappable:
+                    arrays[name] = np.memmap(
+                        path, dtype=dtype, mode='r', offset=f.tell(),
+                        shape=shape, order='F' if fortran_order else 'C')
+                else:
+                    with archive.open(info) as member:
+                        arrays[name] = np.lib.format.read_array(
+                            member, allow_pickle=False)
+    return arrays
+
+
+def _select_index(tree):
+    """
+    Index of the nodes at each level of a tree by their key.
+
+    Returns
+    -------
+    dict
+        For each level, a dictionary mapping each key to a list of the
+        position, in the order of a walk, of the nodes at that level with
+        that key, the keys leading to them and the nodes.
+    """
+    index = {}
+    position = 0
+    stack = [((), tree)]
+    while stack:
+        parents, node = stack.pop()
+        if parents:
+            level = index.setdefault(len(parents) - 1, {})
+            level.setdefault(parents[-1], []).append((position, parents,
+                                                      node))
+            position += 1
+        if isinstance(node, Mapping):
+            children = [(parents + (key,), child)
+                        for key, child in node.items()]
+            children.reverse()
+            stack.extend(children)
+    return index
+
+
+def _select(tree, index, selection):
+    """
+    Branches of a tree matching a selection; see :meth:`TableTree.select`.
+    """
+    wanted = {}
+    for key, value in selection.items():
+        try:
+            level = list(tree.tree_keys).index(key)
+        except ValueError:
+            raise KeyError('{0} is not a key of the tree'.format(key))
+        if isinstance(value, (list, tuple, set, frozenset)):
+            wanted[level] = list(value)
+        else:
+            wanted[level] = [value]
+    if not wanted:
+        return [((), tree)]
+
+    deepest = max(wanted)
+    candidates = []
+    for value in wanted[deepest]:
+        candidates.extend(index.get(deepest, {}).get(value, []))
+    if len(wanted[deepest]) > 1:
+        candidates.sort(key=lambda candidate: candidate[0])
+    return [(parents, node) for _, parents, node in candidates
+            if all(parents[level] in values
+                   for level, values in wanted.items())]
+
+
 class TableTree(RecursiveTree):
     """
     Base class for grouping images hierarchically into a tree based on metadata.
@@ -53,6 +422,27 @@ class TableTree(RecursiveTree):
         group; it must be the name of one of the columns in `table`. Values of
         the index must uniquely identify rows of the table (in database
         parlance, index must be able to serve as a primary key for the table).
+    as_arrays : bool, optional
+        If ``True``, each leaf of the tree is a read-only `numpy.ndarray`
+        that is a view into a single array of index values, which saves
+        making a list for every group of a very large table. By default each
+        leaf is a list.
+    bins : dict, optional
+        How to bin the values of numeric keys, so that values that are nearly
+        the same are grouped together. Each item is a key and one of:
+
+        + a number, or ``{'tolerance': number}``: sorted values that differ
+          by no more than the tolerance from the next one are in one bin,
+          whose key is the most common value in it;
+        + a list of increasing bin edges, or ``{'edges': list}``: values
+          from one edge up to, but not including, the next are in one bin,
+          whose key is its lower edge; values below the first edge have the
+          key ``-inf``;
+        + ``{'decimals': n}``: values are rounded to `n` decimals.
+
+        For example, ``bins={'exptime': 0.01}`` groups 29.999 second and 30
+        second exposures together. Bins are computed with numpy for all of
+        the rows at once. A binned key cannot have NaN values.
 
     Attributes
     ----------
@@ -68,6 +458,17 @@ class TableTree(RecursiveTree):
     """
     def __init__(self, *args, **kwd):
         super(TableTree, self).__init__()
+        self._select_index = None
+        self._table = None
+        self._tree_keys = None
+        self._index_key = None
+        self._as_arrays = False
+        self._bins = {}
+        # Changes made by insert_rows and remove_rows that are not yet in
+        # the table, and the keys leading to each index value.
+        self._inserted = []
+        self._removed = set()
+        self._index_paths = None
         if not args:
             return
 
@@ -79,6 +480,8 @@ class TableTree(RecursiveTree):
         index_key = args[2]
 
         fill_missing = kwd.pop('fill_missing', None)
+        self._as_arrays = kwd.pop('as_arrays', False)
+        self._bins = dict(kwd.pop('bins', None) or {})
 
         if fill_missing is not None:
             for k in tree_keys:
@@ -88,67 +491,51 @@ class TableTree(RecursiveTree):
         else:
             use_table = table
 
-        if not isinstance(use_table, Table):
-            raise TypeError('First argument must be an '
-                            'astropy.table.Table instance')
-
-        if (isinstance(tree_keys, six.string_types) or
-                not isinstance(tree_keys, Iterable)):
-            raise TypeError('Second argument must be list-like but not '
-                            'a single string.')
-
-        if not isinstance(index_key, six.string_types):
-            raise TypeError('Third argument must be a string.')
-
+        _check_arguments(use_table, tree_keys, index_key, bins=self._bins)
         self._table = use_table
         self._tree_keys = tree_keys
-        self._validate_group_keys()
         self._index_key = index_key
-        self._validate_index()
         self._build_tree()
 
-    def _validate_group_keys(self):
-        """
-        Each key must be a table column name.
-        """
-        for key in self._tree_keys:
-            try:
-                self._table[key]
-            except KeyError:
-                raise
-
-    def _validate_index(self):
-        """
-        The rows in the `table` column named `index` must be unique and `index`
-        must be a column in the table. The second case is raised automatically
-        by astropy.table.Table
-        """
-        index_column = self._table[self._index_key]
-        if len(set(index_column)) != len(self._table):
-            raise ValueError('The table column named {0} cannot be used as '
-                             'and index because its values are '
-                             'not unique'.format(self._index_key))
-
     def _build_tree(self):
         """
-        Construct tree from grouping done by astropy table
+        Construct tree from groups found by sorting the table once
 
-        Because the tree is constructed
+        The rows are sorted by all of the keys at once with `numpy.lexsort`,
+        so the only work done per group, rather than per row, in python is
+        adding the group to the tree.
         """
-        grouped = self.table.group_by(self.tree_keys)
-        columns = list(self.tree_keys)
-        columns.append(self.index_key)
-        for group_key, members in izip(grouped.groups.keys,
-                                       grouped.groups):
-            key_list = list(group_key)  # table rows can't be indexed w/slice
-            indexes = list(members[self.index_key])
-            self.add_keys(key_list, value=indexes)
+        order, bounds, group_codes, key_values = _group_rows(
+            self.table, self.tree_keys, bins=self._bins)
+        index = np.asarray(self.table[self.index_key])[order]
+        if self._as_arrays:
+            index.flags.writeable = False
+        for group in range(len(bounds) - 1):
+            key_list = [values[codes[group]] for values, codes in
+                        izip(key_values, group_codes)]
+            members = index[bounds[group]:bounds[group + 1]]
+            if not self._as_arrays:
+                members = members.tolist()
+            self.add_keys(key_list, value=members)
 
     @property
     def table(self):
         """
         astropy.table.Table of metadata used to group rows.
         """
+        if self._inserted or self._removed:
+            # Bring the table up to date with the rows inserted and removed
+            # since it was last used.
+            table = self._table
+            if self._inserted:
+                table = vstack([table] + self._inserted)
+            if self._removed:
+                keep = ~_isin(np.asarray(table[self.index_key]),
+                              list(self._removed))
+                table = table[keep]
+            self._table = table
+            self._inserted = []
+            self._removed = set()
         return self._table
 
     @property
@@ -165,6 +552,237 @@ class TableTree(RecursiveTree):
         """
         return self._index_key
 
+    def _paths(self):
+        """
+        Keys leading to the leaf that holds each index value.
+        """
+        if self._index_paths is None:
+            self._index_paths = dict(
+                (value, parents)
+                for parents, _, leaf in _walk(self, leaves_only=True,
+                                              tuple_parents=True)
+                for value in leaf)
+        return self._index_paths
+
+    def insert_rows(self, rows):
+        """
+        Add rows to the tree without building it again.
+
+        Parameters
+        ----------
+        rows : astropy.table.Table
+            Rows to add; they must have the columns of the tree keys and
+            index, and their index values must not already be in the tree.
+
+        Raises
+        ------
+        KeyError
+            If a column is missing from `rows`.
+        ValueError
+            If an index value is already in the tree or a key is missing
+            from a row, or the tree was not made from a table and so has no
+            keys. The tree is not changed.
+
+        Notes
+        -----
+        Only the branches the rows go in are changed, so the time taken
+        does not depend on the size of the tree, except that the first
+        change indexes the keys leading to every index value. New branches
+        come after the branches that were already there. The rows are added
+        to `table` only when it is next used.
+        """
+        if self.tree_keys is None:
+            raise ValueError('Rows can only be inserted into a tree made '
+                             'from a table')
+        for key in self.tree_keys:
+            if np.ma.getmaskarray(rows[key]).any():
+                raise ValueError('Column {0} has missing values, which '
+                                 'cannot be keys of the tree'.format(key))
+        values = rows[self.index_key].tolist()
+        paths = self._paths()
+        if (len(set(values)) != len(values) or
+                any(value in paths for value in values)):
+            raise ValueError('Index values of the rows are not unique')
+        if self._removed.intersection(values):
+            # Drop the old rows from the table before adding new rows with
+            # the same index values.
+            self.table
+
+        groups = OrderedDict()
+        key_columns = []
+        tolerances = []
+        for key in self.tree_keys:
+            column = np.asarray(rows[key])
+            kind, tolerance = None, None
+            if key in self._bins:
+                kind, tolerance = _bin_spec(self._bins[key])
+                if kind != 'tolerance':
+                    column = _bin_values(column, self._bins[key])
+                else:
+                    column = _binnable(column)
+            key_columns.append(column)
+            # Bins by tolerance depend on the other values, so a new value
+            # joins the nearest bin already in the tree, if it is close
+            # enough.
+            tolerances.append(tolerance if kind == 'tolerance' else None)
+        for keys, value in izip(izip(*key_columns), values):
+            groups.setdefault(keys, []).append(value)
+        for row_keys, members in groups.items():
+            node = self
+            keys = []
+            for key, tolerance in izip(row_keys, tolerances):
+                if tolerance is not None:
+                    key = _nearest_key(key, node.keys(), tolerance)
+                keys.append(key)
+                if len(keys) == len(row_keys):
+                    break
+                if key not in node:
+                    self._select_index = None
+                node = node[key]
+            keys = tuple(keys)
+            leaf = node.get(keys[-1])
+            if self._as_arrays:
+                leaf = (np.array(members) if leaf is None
+                        else np.append(leaf, members))
+                leaf.flags.writeable = False
+                self._select_index = None
+            elif leaf is None:
+                leaf = members
+                self._select_index = None
+            else:
+                leaf.extend(members)
+            node[keys[-1]] = leaf
+            for value in members:
+                paths[value] = keys
+        self._inserted.append(rows)
+
+    def remove_rows(self, values):
+        """
+        Remove rows from the tree without building it again.
+
+        Parameters
+        ----------
+        values : list
+            Index values of the rows to remove. Branches left empty are
+            removed too.
+
+        Raises
+        ------
+        KeyError
+            If a value is not in the tree. The tree is not changed.
+
+        Notes
+        -----
+        As for :meth:`insert_rows`, only the branches the rows are in are
+        changed, and the rows are removed from `table` only when it is next
+        used.
+        """
+        paths = self._paths()
+        for value in values:
+            if value not in paths:
+                raise KeyError('{0} is not in the tree'.format(value))
+        groups = OrderedDict()
+        for value in values:
+            groups.setdefault(paths[value], set()).add(value)
+        for keys, gone in groups.items():
+            nodes = [self]
+            for key in keys[:-1]:
+                nodes.append(nodes[-1][key])
+            leaf = nodes[-1][keys[-1]]
+            kept = [value for value in leaf if value not in gone]
+            if kept and self._as_arrays:
+                kept = np.array(kept, dtype=leaf.dtype)
+                kept.flags.writeable = False
+                nodes[-1][keys[-1]] = kept
+                self._select_index = None
+            elif kept:
+                leaf[:] = kept
+            else:
+                del nodes[-1][keys[-1]]
+                # Remove branches left empty, but never the tree itself.
+                for depth in range(len(keys) - 1, 0, -1):
+                    if nodes[depth]:
+                        break
+                    del nodes[depth - 1][keys[depth - 1]]
+                self._select_index = None
+            for value in gone:
+                del paths[value]
+        if self._table is not None:
+            self._removed.update(values)
+
+    def save(self, path, fingerprint=None):
+        """
+        Save the tree in a compact file.
+
+        The tree is saved as a `CompactTableTree` made from `table`; see
+        :meth:`CompactTableTree.save` for the parameters.
+        """
+        CompactTableTree(self.table, self.tree_keys, self.index_key,
+                         bins=self._bins).save(path, fingerprint=fingerprint)
+
+    @classmethod
+    def load(cls, path, table=None, fingerprint=None, bins=None):
+        """
+        Load a tree saved by :meth:`save`, memory mapped.
+
+        The tree is loaded as a read-only `CompactTableTree`, which can be
+        used like a `TableTree`; see :meth:`CompactTableTree.load` for the
+        parameters and return value.
+        """
+        return CompactTableTree.load(path, table=table,
+                                     fingerprint=fingerprint, bins=bins)
+
+    def select(self, *args, **kwd):
+        """
+        Branches of the tree with particular values of some keys.
+
+        Keys that are not given match any value, so a key can be left out at
+        any level. The tree is not changed; in particular, a value not in the
+        tree is not added to it, as looking it up with ``[]`` would.
+
+        Parameters
+        ----------
+        selection : dict, optional
+            Value of each key to select, for keys that are not valid python
+            names, such as ``date-obs``.
+        keys
+            Value of each key to select, e.g. ``object='M101'``. A list,
+            tuple or set of values selects any of them.
+
+        Returns
+        -------
+        list of (tuple, node)
+            For each branch that matches, in the order of :meth:`walk`, the
+            keys leading to it and the branch. The branches are at the
+            level of the deepest key given; a branch at the last level is a
+            leaf of index values.
+
+        Raises
+        ------
+        KeyError
+            If a key is not one of `tree_keys`.
+
+        Notes
+        -----
+        The first selection indexes every node by its key, one dictionary
+        per level, so that later selections only look at the nodes that
+        have the value of the deepest key given. The index is not updated
+        if the tree is changed afterwards by adding keys directly.
+
+        Examples
+        --------
+        All R-band images of M101, whatever their exposure time::
+
+            tree = TableTree(table, ['object', 'filter', 'exptime'], 'file')
+            for keys, by_exptime in tree.select(object='M101', filter='R'):
+                ...
+        """
+        selection = dict(args[0]) if args else {}
+        selection.update(kwd)
+        if self._select_index is None:
+            self._select_index = _select_index(self)
+        return _select(self, self._select_index, selection)
+
     def walk(self, *args, **kwd):
         """
         Walk the grouped tree
@@ -175,7 +793,18 @@ class TableTree(RecursiveTree):
 
         Parameters
         ----------
-        None
+        subtree : dict, optional
+            Part of the tree to walk; by default the whole tree.
+        parent : list, optional
+            Keys that lead to `subtree`.
+        topdown : bool, optional
+            If ``True``, the default, each node is yielded before the nodes
+            below it; if ``False``, after them, as in `os.walk`.
+        leaves_only : bool, optional
+            If ``True``, yield only the leaves, which hold index values.
+        tuple_parents : bool, optional
+            If ``True``, `parents` is a tuple, which is cheaper to make for
+            every node than a list.
 
         Returns
         -------
@@ -188,23 +817,309 @@ class TableTree(RecursiveTree):
             Index values for the items in the table that correspond to the
             values in `parents`
         """
-
         parent = kwd.pop("parent", [])
+        topdown = kwd.pop('topdown', True)
+        leaves_only = kwd.pop('leaves_only', False)
+        tuple_parents = kwd.pop('tuple_parents', False)
+        if kwd:
+            raise TypeError('Unexpected arguments {0}'.format(
+                ', '.join(kwd)))
         if args:
             use_dict = args[0]
         else:
             use_dict = self
+        return _walk(use_dict, parent, topdown=topdown,
+                     leaves_only=leaves_only, tuple_parents=tuple_parents)
+
+
+class _CompactNode(Mapping):
+    """
+    Read-only view of one node of a `CompactTableTree`.
+
+    A node is the range ``start:stop`` of the nodes one level down, at
+    ``level + 1``, that are its children.
+    """
+    __slots__ = ('_tree', '_level', '_start', '_stop')
+
+    def __init__(self, tree, level, start, stop):
+        self._tree = tree
+        self._level = level
+        self._start = start
+        self._stop = stop
+
+    def _child_keys(self):
+        return self._tree._keys[self._level + 1][self._start:self._stop]
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __iter__(self):
+        return iter(self._child_keys())
+
+    def __getitem__(self, key):
+        keys = self._child_keys()
+        try:
+            # Keys of the children of a node are sorted.
+            position = int(np.searchsorted(keys, key))
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        if position == len(keys) or keys[position] != key:
+            raise KeyError(key)
+        return self._tree._child(self._level + 1, self._start + position)
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, list(self.keys()))
+
+
+class CompactTableTree(_CompactNode):
+    """
+    Tree grouping the rows of a table, stored in a few arrays.
+
+    This is a read-only version of `TableTree` for very large tables. It
+    behaves like a `TableTree`, as a mapping from the values of the first key
+    to subtrees, but instead of a dictionary for every node and a list for
+    every group it stores, for each level of the tree, an array of the key
+    of each node and an array of offsets to its children, and a single array
+    of index values. Each leaf is a read-only view into that array, so the
+    tree takes little more memory than the index column.
+
+    Parameters
+    ----------
+    table : astropy.table.Table instance
+        Table containing the metadata to be used for grouping images.
+    tree_keys : list of str
+        Keys to be used in grouping images. Each key must be the name of a
+        column in `table`.
+    index_key : str
+        Key which is used to indicate which rows of the input table are in
+        each group; its values must uniquely identify rows of the table.
+    bins : dict, optional
+        How to bin numeric keys before grouping; see `TableTree`.
+
+    Attributes
+    ----------
+    table
+    tree_keys
+    index_key
+
+    Raises
+    ------
+    TypeError
+        Raised if the types of any of the arguments is incorrect.
+    KeyError
+        Raised when looking up a key that is not in the tree; unlike a
+        `TableTree`, looking up a key never adds it.
+
+    Notes
+    -----
+    The children of node ``i`` at level ``n`` are the nodes
+    ``offsets[n][i]:offsets[n][i + 1]`` at level ``n + 1``; for a node at the
+    last level, the same range of the index array holds its leaf. This is
+    the layout of a compressed sparse row matrix.
+    """
+    __slots__ = ('_table', '_tree_keys', '_index_key', '_bins', '_keys',
+                 '_offsets', '_index', '_select_index')
+
+    def __init__(self, table, tree_keys, index_key, bins=None):
+        _check_arguments(table, tree_keys, index_key, bins=bins)
+        if not tree_keys:
+            raise ValueError('At least one key is needed to make a tree')
+        self._table = table
+        self._tree_keys = list(tree_keys)
+        self._index_key = index_key
+        self._bins = dict(bins or {})
+        self._select_index = None
+        self._build_tree()
+        super(CompactTableTree, self).__init__(self, -1, 0,
+                                               len(self._keys[0]))
+
+    def _build_tree(self):
+        """
+        Find the nodes of each level from the groups of the table.
+
+        Groups are sorted by their keys, so the nodes at a level are the runs
+        of groups whose keys agree down to that level.
+        """
+        order, bounds, group_codes, key_values = _group_rows(
+            self.table, self.tree_keys, bins=self._bins)
+        self._index = np.asarray(self.table[self.index_key])[order]
+        self._index.flags.writeable = False
+        n_groups = len(bounds) - 1
+        new_node = np.zeros(n_groups, dtype=bool)
+        new_node[:1] = True
+        node_starts = []
+        self._keys = []
+        for codes, values in izip(group_codes, key_values):
+            new_node[1:] |= codes[1:] != codes[:-1]
+            starts = np.flatnonzero(new_node)
+            node_starts.append(starts)
+            self._keys.append(values[codes[starts]])
+        # Children of a node start at the first node one level down that
+        # starts at or after its first group.
+        self._offsets = [np.append(np.searchsorted(lower, upper),
+                                   len(lower))
+                         for upper, lower in izip(node_starts[:-1],
+                                                  node_starts[1:])]
+        self._offsets.append(bounds)
+
+    def _child(self, level, position):
+        start, stop = self._offsets[level][position:position + 2]
+        if level == len(self._keys) - 1:
+            return self._index[start:stop]
+        return _CompactNode(self, level, start, stop)
+
+    @property
+    def table(self):
+        """
+        astropy.table.Table of metadata used to group rows.
+        """
+        return self._table
+
+    @property
+    def tree_keys(self):
+        """
+        list of str, Table columns to be used in grouping the rows.
+        """
+        return self._tree_keys
 
+    @property
+    def index_key(self):
+        """
+        str, Name of column whose values uniquely identify each row.
+        """
+        return self._index_key
+
+    def save(self, path, fingerprint=None):
+        """
+        Save the tree in a file that :meth:`load` can memory map.
+
+        Parameters
+        ----------
+        path : str
+            Name of the file; ``.npz`` is added if it does not end with it.
+        fingerprint : str, optional
+            Identifies the table the tree was made from, so that a saved tree
+            can be recognized as out of date; default is the
+            :func:`table_fingerprint` of the keys and index of the table,
+            combined with the bins of the tree.
+
+        Raises
+        ------
+        ValueError
+            If keys or index values are python objects rather than numbers
+            or strings, which cannot be saved.
+
+        Notes
+        -----
+        The file is an uncompressed npz archive holding, for each level, the
+        arrays of keys and offsets, the index array and the names of the
+        keys and index.
+        """
+        if fingerprint is None:
+            if self.table is None:
+                raise ValueError('A fingerprint is needed to save a tree '
+                                 'that has no table')
+            fingerprint = _tree_fingerprint(self.table, self.tree_keys,
+                                            self.index_key, self._bins)
+        arrays = {'format': np.array(_SAVE_FORMAT),
+                  'tree_keys': np.array(self.tree_keys),
+                  'index_key': np.array(self.index_key),
+                  'fingerprint': np.array(fingerprint),
+                  'index': self._index}
+        for level, (keys, offsets) in enumerate(izip(self._keys,
+                                                     self._offsets)):
+            arrays['keys_{0}'.format(level)] = keys
+            arrays['offsets_{0}'.format(level)] = offsets
+        for name, array in arrays.items():
+            if array.dtype.hasobject:
+                raise ValueError('Cannot save {0}, whose values are python '
+                                 'objects'.format(name))
+        np.savez(_npz_name(path), **arrays)
+
+    @classmethod
+    def load(cls, path, table=None, fingerprint=None, bins=None):
+        """
+        Load a tree saved by :meth:`save`.
+
+        The arrays of the tree are memory mapped, so loading takes about the
+        same time however large the tree is.
+
+        Parameters
+        ----------
+        path : str
+            Name of the file; ``.npz`` is added if it does not end with it.
+        table : astropy.table.Table, optional
+            Table the tree is for. If given, the tree is loaded only if it was
+            made from a table with the same values of its keys and index, and
+            becomes the `table` of the loaded tree.
+        fingerprint : str, optional
+            If given, the tree is loaded only if it was saved with this
+            fingerprint; use instead of `table` when the table is not at
+            hand.
+        bins : dict, optional
+            Bins the tree must have been made with, when `table` is given.
+
+        Returns
+        -------
+        CompactTableTree or None
+            ``None`` if there is no saved tree in `path` or it is out of
+            date.
+        """
         try:
-            tree_nodes = use_dict.keys()
-            indexes = []
-            yield parent, tree_nodes, indexes
-        except AttributeError:
-            tree_nodes = []
-            yield parent, tree_nodes, use_dict
-
-        for node in tree_nodes:
-            new_parent = list(parent)
-            new_parent.append(node)
-            for val in self.walk(use_dict[node], parent=new_parent):
-                yield val
+            arrays = _load_npz(_npz_name(path))
+            if int(arrays['format']) != _SAVE_FORMAT:
+                return None
+        except (IOError, OSError, KeyError, ValueError, struct.error,
+                zipfile.BadZipfile):
+            return None
+        tree_keys = [six.text_type(key) for key in arrays['tree_keys']]
+        index_key = six.text_type(arrays['index_key'][()])
+        if table is not None and fingerprint is None:
+            try:
+                fingerprint = _tree_fingerprint(table, tree_keys, index_key,
+                                                bins)
+            except KeyError:
+                return None
+        if (fingerprint is not None and
+                fingerprint != six.text_type(arrays['fingerprint'][()])):
+            return None
+
+        tree = cls.__new__(cls)
+        tree._table = table
+        tree._tree_keys = tree_keys
+        tree._index_key = index_key
+        tree._bins = dict(bins or {})
+        tree._select_index = None
+        tree._keys = [arrays['keys_{0}'.format(level)]
+                      for level in range(len(tree_keys))]
+        tree._offsets = [arrays['offsets_{0}'.format(level)]
+                         for level in range(len(tree_keys))]
+        tree._index = arrays['index']
+        _CompactNode.__init__(tree, tree, -1, 0, len(tree._keys[0]))
+        return tree
+
+    def select(self, *args, **kwd):
+        """
+        Branches of the tree with particular values of some keys.
+
+        See :meth:`TableTree.select`.
+        """
+        selection = dict(args[0]) if args else {}
+        selection.update(kwd)
+        if self._select_index is None:
+            self._select_index = _select_index(self)
+        return _select(self, self._select_index, selection)
+
+    def walk(self, topdown=True, leaves_only=False, tuple_parents=False):
+        """
+        Walk the grouped tree
+
+        Works like :meth:`TableTree.walk`, except that the index values at
+        each leaf are a read-only `numpy.ndarray`.
+
+        Returns
+        -------
+        parents, children, index : lists
+        """
+        return _walk(self, topdown=topdown, leaves_only=leaves_only,
+                     tuple_parents=tuple_parents)
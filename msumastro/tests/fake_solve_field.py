@@ -0,0 +1,282 @@
+"""
+A stand-in for astrometry.net's ``solve-field`` for tests and benchmarks.
+
+The fake understands the subset of ``solve-field`` options generated by
+:func:`msumastro.header_processing.astrometry.call_astrometry` and writes the
+same output files a successful solve would: ``<base>.new``, ``<base>.solved``,
+``<base>.axy`` and, unless ``--wcs none`` is given, ``<base>.wcs``. The
+"solution" is a tangent-plane WCS centered on the ``--ra``/``--dec`` hint (or
+on RA = Dec = 0 for blind solves) with a plate scale in the middle of the
+``--scale-low``/``--scale-high`` range.
+
+Behavior is controlled by environment variables so that the fake can be
+configured without changing the command line that ``call_astrometry``
+constructs:
+
+``FAKE_SOLVE_FIELD_LATENCY``
+    Seconds to sleep before "solving". Either a single number or
+    ``low,high``, in which case the latency is drawn uniformly from that
+    range. Default is 0.
+``FAKE_SOLVE_FIELD_FAILURE_RATE``
+    Probability, between 0 and 1, that a solve fails. Default is 0.
+``FAKE_SOLVE_FIELD_SEED``
+    Seed for latency and failure draws; the draws for a file depend only on
+    the seed and the file name so runs are reproducible. Default is 0.
+``FAKE_SOLVE_FIELD_OUTPUT``
+    Number of lines of chatter to print to stdout. Default is 10.
+``FAKE_SOLVE_FIELD_LOG``
+    If set, the path of a file to which one line, ``<file> <seconds>
+    <status>``, is appended for each invocation.
+
+Use :func:`install_fake_solve_field` to put an executable named
+``solve-field`` into a directory; add that directory to the front of
+``PATH`` to use it.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+import sys
+import stat
+import time
+import random
+from os import path
+
+__all__ = ['install_fake_solve_field', 'main']
+
+ENV_PREFIX = 'FAKE_SOLVE_FIELD_'
+
+# Plate scale, in arcsec per pixel, used if no scale hints are given.
+DEFAULT_SCALE = 0.55
+
+# Options that take a value on the solve-field command line; everything
+# else starting with "--" is treated as a flag.
+_VALUED_OPTIONS = set(['--obj', '--scale-low', '--scale-high',
+                       '--scale-units', '--corr', '--rdls', '--match',
+                       '--wcs', '--ra', '--dec', '--radius', '--downsample',
+                       '--sextractor-path', '--sextractor-config',
+                       '--x-column', '--y-column', '--sort-column',
+                       '--odds-to-solve', '--config', '--verify',
+                       '--uniformize'])
+
+# Keywords copied into the ``.wcs`` file.
+_WCS_KEYS = ['WCSAXES', 'CTYPE1', 'CTYPE2', 'EQUINOX', 'CRVAL1', 'CRVAL2',
+             'CRPIX1', 'CRPIX2', 'CUNIT1', 'CUNIT2', 'CD1_1', 'CD1_2',
+             'CD2_1', 'CD2_2', 'IMAGEW', 'IMAGEH']
+
+_WRAPPER = """#!{python}
+import sys
+sys.path.insert(0, {module_dir!r})
+import os
+{defaults}
+from fake_solve_field import main
+sys.exit(main())
+"""
+
+
+def install_fake_solve_field(bin_dir, latency=None, failure_rate=None,
+                             seed=None, output_lines=None, log_file=None):
+    """
+    Write an executable named ``solve-field`` into a directory.
+
+    Parameters
+    ----------
+    bin_dir : str
+        Directory in which the executable is created.
+    latency : float or tuple of two floats, optional
+        Time, in seconds, each solve takes, or a ``(low, high)`` range from
+        which the time is drawn.
+    failure_rate : float, optional
+        Fraction of solves that fail.
+    seed : int, optional
+        Seed for the random draws.
+    output_lines : int, optional
+        Lines of output printed by each solve.
+    log_file : str, optional
+        File in which each solve records its duration and status.
+
+    Settings given here become the defaults of the installed executable;
+    they can still be overridden through the environment variables listed
+    in the module documentation.
+
+    Returns
+    -------
+    str
+        Path to the executable.
+    """
+    if isinstance(latency, (list, tuple)):
+        latency = ','.join(str(t) for t in latency)
+    settings = {'LATENCY': latency,
+                'FAILURE_RATE': failure_rate,
+                'SEED': seed,
+                'OUTPUT': output_lines,
+                'LOG': log_file}
+    defaults = []
+    for name, value in sorted(settings.items()):
+        if value is None:
+            continue
+        defaults.append('os.environ.setdefault({0!r}, {1!r})'.format(
+            str(ENV_PREFIX + name), str(value)))
+
+    module_dir = path.dirname(path.abspath(__file__))
+    if module_dir.endswith('__pycache__'):    # pragma: no cover
+        module_dir = path.dirname(module_dir)
+    contents = _WRAPPER.format(python=sys.executable,
+                               module_dir=str(module_dir),
+                               defaults='\n'.join(defaults))
+    executable = path.join(bin_dir, 'solve-field')
+    with open(executable, 'w') as f:
+        f.write(contents)
+    mode = os.stat(executable).st_mode
+    os.chmod(executable, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return executable
+
+
+def _parse_arguments(argv):
+    """
+    Split a solve-field command line into a dict of options and a file name.
+    """
+    options = {}
+    positional = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg in _VALUED_OPTIONS and args:
+            options[arg] = args.pop(0)
+        elif arg.startswith('--'):
+            options[arg] = True
+        else:
+            positional.append(arg)
+    if not positional:
+        raise ValueError('No file to solve was given')
+    return options, positional[-1]
+
+
+def _sexagesimal_to_degrees(value, hours=False):
+    """
+    Convert decimal or colon/space separated sexagesimal to degrees.
+    """
+    value = value.strip()
+    if ':' not in value and ' ' not in value:
+        return float(value)
+    parts = value.replace(':', ' ').split()
+    sign = -1 if parts[0].startswith('-') else 1
+    magnitude = 0
+    for power, part in enumerate(parts):
+        magnitude += abs(float(part)) / 60 ** power
+    degrees = sign * magnitude
+    return degrees * 15 if hours else degrees
+
+
+def _draw(seed, file_name):
+    """
+    Random generator that depends only on the seed and the file name.
+    """
+    return random.Random('{0}:{1}'.format(seed, path.basename(file_name)))
+
+
+def _latency(setting, generator):
+    if not setting:
+        return 0.0
+    bounds = [float(t) for t in setting.split(',')]
+    if len(bounds) == 1:
+        return bounds[0]
+    return generator.uniform(bounds[0], bounds[1])
+
+
+def _solution_header(header, options):
+    """
+    Add a tangent-plane WCS to a header based on the solve hints.
+    """
+    try:
+        ra = _sexagesimal_to_degrees(options['--ra'], hours=True)
+        dec = _sexagesimal_to_degrees(options['--dec'])
+    except KeyError:
+        ra, dec = 0.0, 0.0
+
+    try:
+        scale = (float(options['--scale-low']) +
+                 float(options['--scale-high'])) / 2
+    except KeyError:
+        scale = DEFAULT_SCALE
+
+    header['WCSAXES'] = (2, 'no comment')
+    header['CTYPE1'] = ('RA---TAN', 'TAN (gnomic) projection')
+    header['CTYPE2'] = ('DEC--TAN', 'TAN (gnomic) projection')
+    header['EQUINOX'] = (2000.0, 'Equatorial coordinates definition (yr)')
+    header['CRVAL1'] = (ra, 'RA  of reference point')
+    header['CRVAL2'] = (dec, 'DEC of reference point')
+    header['CRPIX1'] = ((header.get('NAXIS1', 0) + 1) / 2,
+                        'X reference pixel')
+    header['CRPIX2'] = ((header.get('NAXIS2', 0) + 1) / 2,
+                        'Y reference pixel')
+    header['CUNIT1'] = ('deg', 'X pixel scale units')
+    header['CUNIT2'] = ('deg', 'Y pixel scale units')
+    header['CD1_1'] = (-scale / 3600, 'Transformation matrix')
+    header['CD1_2'] = (0.0, 'no comment')
+    header['CD2_1'] = (0.0, 'no comment')
+    header['CD2_2'] = (scale / 3600, 'no comment')
+    header['IMAGEW'] = (header.get('NAXIS1', 0), 'Image width,  in pixels.')
+    header['IMAGEH'] = (header.get('NAXIS2', 0), 'Image height, in pixels.')
+    return header
+
+
+def main(argv=None):
+    """
+    Pretend to solve the field in the file named on the command line.
+
+    Returns the exit status: 0 on success, 1 if the (simulated) solve
+    failed and 2 if the command line could not be understood.
+    """
+    from astropy.io import fits
+
+    argv = sys.argv[1:] if argv is None else argv
+    env = os.environ
+    start = time.time()
+    try:
+        options, file_name = _parse_arguments(argv)
+    except ValueError as e:
+        print('solve-field: {0}'.format(e))
+        return 2
+
+    generator = _draw(env.get(ENV_PREFIX + 'SEED', '0'), file_name)
+    time.sleep(_latency(env.get(ENV_PREFIX + 'LATENCY'), generator))
+    failure_rate = float(env.get(ENV_PREFIX + 'FAILURE_RATE', 0))
+    n_lines = int(env.get(ENV_PREFIX + 'OUTPUT', 10))
+
+    base, _ = path.splitext(file_name)
+    for line in range(n_lines):
+        print('Fake solve-field, field {0}: line {1}'.format(file_name, line))
+
+    if path.exists(base + '.solved') and '--overwrite' not in options:
+        print('Field {0}: solved file exists; skipping.'.format(file_name))
+        status = 0
+    elif generator.random() < failure_rate:
+        print('Did not solve (or no WCS file was written).')
+        status = 1
+    else:
+        # Astrometry.net always leaves behind the source list.
+        open(base + '.axy', 'wb').close()
+        with fits.open(file_name, do_not_scale_image_data=True) as hdul:
+            header = _solution_header(hdul[0].header, options)
+            hdul.writeto(base + '.new', overwrite=True)
+        if options.get('--wcs') != 'none':
+            wcs_header = fits.Header([header.cards[k] for k in _WCS_KEYS])
+            fits.PrimaryHDU(header=wcs_header).writeto(base + '.wcs',
+                                                       overwrite=True)
+        with open(base + '.solved', 'wb') as f:
+            f.write(b'\x01')
+        print('Field {0}: solved with index fake-index.fits.'.format(
+            file_name))
+        status = 0
+
+    log_file = env.get(ENV_PREFIX + 'LOG')
+    if log_file:
+        with open(log_file, 'a') as f:
+            f.write('{0} {1:.6f} {2}\n'.format(file_name,
+                                               time.time() - start, status))
+    return status
+
+
+if __name__ == '__main__':    # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,79 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+
+from .. import catalog as cat
+
+
+def _write(name, **keywords):
+    hdu = fits.PrimaryHDU()
+    for key, value in keywords.items():
+        hdu.header[key] = value
+    hdu.writeto(name)
+
+
+@pytest.fixture
+def archive(tmpdir):
+    tmpdir.mkdir('night1')
+    tmpdir.mkdir('night2')
+    _write(tmpdir.join('night1', 'flat.fit').strpath, imagetyp='FLAT',
+           filter='R', instrume='Aspen CG16M', exptime=1.0,
+           **{'date-obs': '2015-03-10T01:00:00'})
+    _write(tmpdir.join('night1', 'light.fit').strpath, imagetyp='LIGHT',
+           object='SZ Lyn', airmass=1.3, ra='08:09:35.7', dec='44:28:17',
+           exptime=30.0, bincount=2, cd1_1=0.5)
+    _write(tmpdir.join('night2', 'light.fit').strpath, imagetyp='LIGHT',
+           object='SZ Lyn', airmass=1.7)
+    return tmpdir
+
+
+@pytest.fixture
+def catalog(archive, request):
+    catalog = cat.HeaderCatalog(archive.join('catalog.sqlite').strpath)
+    request.addfinalizer(catalog.close)
+    catalog.update(archive.strpath)
+    return catalog
+
+
+def test_catalog_queries(archive, catalog):
+    assert len(catalog) == 3
+    flats = catalog.query(imagetyp='flat', filter='r',
+                          date_obs=('2015-03-01', '2015-04-01'))
+    assert list(flats['path']) == [archive.join('night1', 'flat.fit').strpath]
+    lights = catalog.query(imagetyp='light', object='sz lyn',
+                           airmass=(None, 1.5))
+    assert len(lights) == 1
+    np.testing.assert_allclose(lights['ra'][0], 122.39875)
+    assert lights['filter'].mask[0]
+    assert len(catalog.query(bincount=2)) == 1
+    assert len(catalog.query(imagetyp=['FLAT', 'LIGHT'])) == 3
+
+
+def test_catalog_query_keywords_and_patterns(archive, catalog):
+    # Exact values must match the whole value.
+    assert len(catalog.query(instrume='aspen')) == 0
+    flats = catalog.query(instrume='*aspen*')
+    assert list(flats['instrume']) == ['Aspen CG16M']
+    assert len(catalog.query(instrume=['*sbig*', 'aspen cg16m'])) == 1
+    assert len(catalog.query(object='sz*', imagetyp='light')) == 2
+    # Keywords that contain an underscore or a dash.
+    assert len(catalog.query(cd1_1=0.5)) == 1
+    assert len(catalog.query(date_obs='2015-03-10*')) == 1
+
+
+def test_catalog_update_is_incremental(archive, catalog):
+    assert catalog.update(archive.strpath) == 0
+    changed = archive.join('night1', 'flat.fit').strpath
+    fits.setval(changed, 'filter', value='V')
+    stat = os.stat(changed)
+    os.utime(changed, (stat.st_atime, stat.st_mtime + 10))
+    archive.join('night2', 'light.fit').remove()
+    assert catalog.update(archive.strpath) == 1
+    assert len(catalog) == 2
+    assert catalog.query(imagetyp='flat')['filter'][0] == 'V'
+    assert catalog.header(changed)['FILTER'] == 'V'
@@ -0,0 +1,211 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import errno
+import hashlib
+import os
+
+import pytest
+
+from .. import file_transfer as ft
+
+
+@pytest.fixture
+def source(tmpdir):
+    source = tmpdir.mkdir('source').join('image.fit')
+    source.write('SIMPLE')
+    return source
+
+
+@pytest.mark.parametrize('link_mode', ft.LINK_MODES)
+def test_transfer_file(source, tmpdir, link_mode):
+    dest = tmpdir.mkdir('dest')
+    used = ft.transfer_file(source.strpath, dest.strpath,
+                            link_mode=link_mode)
+    placed = dest.join('image.fit')
+    assert placed.read() == 'SIMPLE'
+    assert source.check() == (link_mode != 'move')
+    if link_mode == 'hardlink':
+        assert os.path.samefile(source.strpath, placed.strpath)
+    if link_mode == 'symlink':
+        assert placed.readlink() == source.strpath
+    if link_mode == 'reflink':
+        # Many file systems, e.g. tmpfs, cannot clone files.
+        assert used in ('reflink', 'copy')
+    else:
+        assert used == link_mode
+
+
+@pytest.mark.parametrize('link_mode', ['hardlink', 'reflink'])
+def test_transfer_file_copies_across_file_systems(source, tmpdir,
+                                                  monkeypatch, link_mode):
+    def cross_device(*arg):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    monkeypatch.setattr(ft.os, 'link', cross_device)
+    monkeypatch.setattr(ft, '_reflink', cross_device)
+    dest = tmpdir.mkdir('dest')
+    assert ft.transfer_file(source.strpath, dest.strpath,
+                            link_mode=link_mode) == 'copy'
+    placed = dest.join('image.fit')
+    assert placed.read() == 'SIMPLE'
+    assert not os.path.samefile(source.strpath, placed.strpath)
+
+
+@pytest.mark.parametrize('link_mode', ft.LINK_MODES)
+def test_transfer_file_keeps_existing_file(source, tmpdir, link_mode):
+    dest = tmpdir.mkdir('dest')
+    dest.join('image.fit').write('OTHER NIGHT')
+    with pytest.raises(OSError) as e:
+        ft.transfer_file(source.strpath, dest.strpath, link_mode=link_mode)
+    assert e.value.errno == errno.EEXIST
+    assert dest.join('image.fit').read() == 'OTHER NIGHT'
+    assert source.check()
+
+
+def test_transfer_file_leaves_no_partial_copy(source, tmpdir, monkeypatch):
+    def cut_short(source, destination):
+        with open(destination, 'w') as f:
+            f.write('SIM')
+        raise IOError(errno.EIO, 'Input/output error')
+
+    monkeypatch.setattr(ft.shutil, 'copy2', cut_short)
+    dest = tmpdir.mkdir('dest')
+    with pytest.raises(IOError):
+        ft.transfer_file(source.strpath, dest.strpath)
+    assert dest.listdir() == []
+
+
+def test_transfer_file_bad_mode(source, tmpdir):
+    with pytest.raises(ValueError):
+        ft.transfer_file(source.strpath, tmpdir.strpath, link_mode='teleport')
+
+
+@pytest.mark.parametrize('link_mode', ft.LINK_MODES)
+def test_is_placed(source, tmpdir, link_mode):
+    dest = tmpdir.mkdir('dest')
+    assert not ft.is_placed(source.strpath, dest.strpath, link_mode)
+    ft.transfer_file(source.strpath, dest.strpath, link_mode=link_mode)
+    assert ft.is_placed(source.strpath, dest.strpath, link_mode)
+
+
+def test_is_placed_rejects_partial_copy(source, tmpdir):
+    dest = tmpdir.mkdir('dest')
+    dest.join('image.fit').write('SIM')
+    assert not ft.is_placed(source.strpath, dest.strpath, 'copy')
+
+
+def test_placement_journal(tmpdir):
+    path = tmpdir.join('journal.sqlite').strpath
+    with ft.PlacementJournal(path) as journal:
+        assert not journal.has_plan
+        journal.write_plan([('a.fit', 'BIAS'), ('b.fit', 'DARK')],
+                           source='night', link_mode='move',
+                           destination='tree')
+        first, second = journal.pending()
+        journal.mark_done(first[0])
+        journal.mark_failed(second[0], OSError('disk full'))
+    with ft.PlacementJournal(path) as journal:
+        assert journal.has_plan
+        assert journal.info('link_mode') == 'move'
+        assert journal.info('destination') == 'tree'
+        assert len(journal) == 2
+        assert [p[1:] for p in journal.pending()] == [('b.fit', 'DARK', None)]
+
+
+def test_copy_verified(source, tmpdir):
+    copy = tmpdir.join('copy.fit')
+    digest = ft.copy_verified(source.strpath, copy.strpath)
+    assert digest == hashlib.sha1(b'SIMPLE').hexdigest()
+    assert copy.read() == 'SIMPLE'
+    assert copy.mtime() == source.mtime()
+
+
+def test_copy_verified_removes_bad_copy(source, tmpdir, monkeypatch):
+    fsync = os.fsync
+
+    def truncate(fd):
+        # As if the storage lost the end of the file.
+        os.ftruncate(fd, 3)
+        fsync(fd)
+
+    monkeypatch.setattr(ft.os, 'fsync', truncate)
+    copy = tmpdir.join('copy.fit')
+    with pytest.raises(ft.TransferError):
+        ft.copy_verified(source.strpath, copy.strpath)
+    assert not copy.check()
+
+
+@pytest.mark.parametrize('link_mode', ['copy', 'move', 'hardlink'])
+def test_transfer_file_with_manifest(source, tmpdir, monkeypatch,
+                                     link_mode):
+    def cross_device(*arg):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    rename = os.rename
+
+    def rename_across(old, new):
+        if old == source.strpath:
+            cross_device()
+        rename(old, new)
+
+    # Make the move and the hard link copy, as they would between file
+    # systems.
+    monkeypatch.setattr(ft.os, 'rename', rename_across)
+    monkeypatch.setattr(ft.os, 'link', cross_device)
+    dest = tmpdir.mkdir('dest')
+    with ft.TransferManifest.for_directory(tmpdir.strpath) as manifest:
+        ft.transfer_file(source.strpath, dest.strpath, link_mode=link_mode,
+                         manifest=manifest)
+        assert manifest.read() == {
+            os.path.join('dest', 'image.fit'):
+                hashlib.sha1(b'SIMPLE').hexdigest()}
+    assert os.path.basename(manifest.path) == 'transfers.sha1'
+    assert source.check() == (link_mode != 'move')
+
+
+@pytest.mark.parametrize('link_mode', ['copy', 'move', 'reflink'])
+def test_transfer_file_prepares_copy(source, tmpdir, link_mode):
+    def prepare(path):
+        with open(path, 'a') as f:
+            f.write(' = T')
+
+    dest = tmpdir.mkdir('dest')
+    with ft.TransferManifest.for_directory(tmpdir.strpath) as manifest:
+        ft.transfer_file(source.strpath, dest.strpath, link_mode=link_mode,
+                         manifest=manifest, prepare=prepare)
+        digests = manifest.read()
+    placed = dest.join('image.fit')
+    assert placed.read() == 'SIMPLE = T'
+    # A move within a file system is hashed too.
+    assert digests == {os.path.join('dest', 'image.fit'):
+                       hashlib.sha1(b'SIMPLE = T').hexdigest()}
+    if link_mode != 'move':
+        assert source.read() == 'SIMPLE'
+        assert placed.mtime() == source.mtime()
+    assert [p.basename for p in dest.listdir()] == ['image.fit']
+
+
+def test_is_placed_with_fits_checksum(source, tmpdir):
+    dest = tmpdir.mkdir('dest')
+    placed = dest.join('image.fit')
+    placed.write('SIMPLE' + ' ' * 2880)
+    placed.setmtime(source.mtime())
+    assert not ft.is_placed(source.strpath, dest.strpath, 'copy')
+    assert ft.is_placed(source.strpath, dest.strpath, 'copy',
+                        fits_checksum=True)
+    placed.write('SIMPLE' + ' ' * 80)
+    placed.setmtime(source.mtime())
+    assert not ft.is_placed(source.strpath, dest.strpath, 'copy',
+                            fits_checksum=True)
+
+
+def test_transfer_manifest_keeps_last_hash(tmpdir):
+    path = tmpdir.join('sums.md5').strpath
+    with ft.TransferManifest(path, algorithm='md5') as manifest:
+        manifest.record(tmpdir.join('a.fit').strpath, 'old')
+        manifest.record(tmpdir.join('a.fit').strpath, 'new')
+    with ft.TransferManifest(path, algorithm='md5') as manifest:
+        assert manifest.read() == {'a.fit': 'new'}
+    with open(path) as f:
+        assert f.readline() == 'old  a.fit\n'
@@ -0,0 +1,57 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+
+import pytest
+
+from .. import fits_walk
+
+
+@pytest.fixture
+def archive(tmpdir):
+    for name in ['night1/a.fit', 'night1/b.fits.gz', 'night1/f.fit.bz2',
+                 'night1/notes.txt', 'night1/Manifest.manifest.fits',
+                 'night2/cal/c.fts', 'night2/readme', '.hidden/d.fit',
+                 'skipped/e.fit', 'top.fit']:
+        tmpdir.join(name).ensure()
+    return tmpdir
+
+
+def test_walk_finds_fits_directories(archive):
+    found = list(fits_walk.walk_fits_directories(archive.strpath))
+    relative = [(os.path.relpath(d, archive.strpath), files)
+                for d, files in found]
+    assert relative == [('.', ['top.fit']),
+                        ('night1', ['a.fit', 'b.fits.gz', 'f.fit.bz2']),
+                        ('night2/cal', ['c.fts']),
+                        ('skipped', ['e.fit'])]
+
+
+def test_walk_excludes(archive):
+    found = fits_walk.walk_fits_directories(
+        archive.strpath, exclude=[archive.join('skipped').strpath])
+    assert archive.join('skipped').strpath not in [d for d, _ in found]
+
+
+def test_walk_does_not_loop_through_links(archive):
+    archive.join('night1', 'loop').mksymlinkto(archive)
+    found = [d for d, _ in
+             fits_walk.walk_fits_directories(archive.strpath,
+                                             follow_links=True)]
+    assert len(found) == len(set(os.path.realpath(d) for d in found))
+
+
+def test_fits_files(archive):
+    assert fits_walk.fits_files(archive.join('night1').strpath) == \
+        ['a.fit', 'b.fits.gz', 'f.fit.bz2']
+
+
+def test_source_directories(archive):
+    night1 = archive.join('night1').strpath
+    assert fits_walk.source_directories([night1]) == {night1: 'night1'}
+    found = fits_walk.source_directories(
+        [archive.strpath], exclude=[archive.join('skipped').strpath],
+        recursive=True)
+    assert list(found.values()) == [archive.basename, 'night1',
+                                    'night2_cal']
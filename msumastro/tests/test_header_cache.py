@@ -0,0 +1,74 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+
+from .. import image_collection as tff
+from .. import header_cache as hc
+
+
+@pytest.fixture
+def cache_file(tmpdir):
+    return tmpdir.join('headers.sqlite').strpath
+
+
+def test_header_cache_round_trip(triage_setup, cache_file):
+    name = os.path.join(triage_setup.test_dir, 'filter_object_light.fit')
+    with hc.HeaderCache(cache_file) as cache:
+        assert cache.raw_header(name) is None
+        header = cache.header(name)
+        assert cache.misses == 1
+        assert cache.header(name).tostring() == header.tostring()
+        assert cache.hits == 1
+    with hc.HeaderCache(cache_file) as cache:
+        assert cache.header(name)['filter'] == 'R'
+        assert cache.hits == 1
+
+
+def test_header_cache_detects_changed_file(triage_setup, cache_file):
+    name = os.path.join(triage_setup.test_dir, 'filter_object_light.fit')
+    with hc.HeaderCache(cache_file) as cache:
+        cache.header(name)
+        fits.setval(name, 'filter', value='V')
+        stat = os.stat(name)
+        os.utime(name, (stat.st_atime, stat.st_mtime + 10))
+        assert cache.raw_header(name) is None
+        assert cache.header(name)['filter'] == 'V'
+
+
+def test_collection_warm_scan_does_not_read_files(triage_setup, cache_file,
+                                                  monkeypatch):
+    keywords = ['imagetyp', 'filter']
+    cold = tff.ImageFileCollection(triage_setup.test_dir, keywords=keywords,
+                                   header_cache=cache_file)
+
+    def no_reading(*args, **kwd):
+        raise AssertionError('A file was read')
+
+    monkeypatch.setattr(hc.fits, 'getheader', no_reading)
+    monkeypatch.setattr(tff.fits, 'getheader', no_reading)
+    warm = tff.ImageFileCollection(triage_setup.test_dir, keywords=keywords,
+                                   header_cache=cache_file)
+    assert len(warm.summary) == triage_setup.n_test['files']
+    for key in ['file'] + keywords:
+        np.testing.assert_array_equal(cold.summary[key], warm.summary[key])
+
+
+def test_collection_header_cache_in_directory(triage_setup):
+    tff.ImageFileCollection(triage_setup.test_dir, keywords=['imagetyp'],
+                            header_cache=True)
+    cache_path = os.path.join(triage_setup.test_dir,
+                              hc.HeaderCache.DEFAULT_NAME)
+    assert os.path.exists(cache_path)
+    # Entries for deleted files are removed on the next scan
+    os.remove(os.path.join(triage_setup.test_dir, 'filter_object_light.fit'))
+    tff.ImageFileCollection(triage_setup.test_dir, keywords=['imagetyp'],
+                            header_cache=True)
+    with hc.HeaderCache(cache_path) as cache:
+        n_cached, = cache._connection.execute(
+            'SELECT COUNT(*) FROM headers').fetchone()
+    assert n_cached == triage_setup.n_test['files'] - 1
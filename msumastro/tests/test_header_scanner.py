@@ -0,0 +1,173 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import bz2
+import gzip
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+
+from .. import image_collection as tff
+from .. import header_scanner as hs
+from ..header_processing.feder import Feder
+
+
+@pytest.fixture
+def odd_header_file(tmpdir):
+    hdu = fits.PrimaryHDU(data=np.zeros((5, 7), dtype=np.int16))
+    hdr = hdu.header
+    hdr['object'] = "M'31 "
+    hdr['exptime'] = 30.0
+    hdr['ccd-temp'] = -20
+    hdr['flipped'] = False
+    hdr['jd'] = (2457104.5, 'with a comment / and a slash')
+    hdr['cplx'] = complex(1.5, -2)
+    hdr['longstr'] = 'x' * 100 + 'y' * 30
+    hdr['hierarch eso det dit'] = 1.25
+    hdr['undef'] = None
+    hdr.add_history('first')
+    hdr.add_history('second')
+    ext = fits.ImageHDU(data=np.ones((3, 4, 2), dtype=np.float64))
+    ext.header['extname'] = 'SECOND'
+    name = tmpdir.join('odd.fit').strpath
+    fits.HDUList([hdu, ext]).writeto(name)
+    return name
+
+
+def test_scanner_values_match_astropy(odd_header_file):
+    astropy_header = fits.getheader(odd_header_file)
+    scanned = hs.scan_header(odd_header_file)
+    for key in ['naxis1', 'object', 'exptime', 'ccd-temp', 'flipped', 'jd',
+                'cplx', 'longstr', 'eso det dit']:
+        assert scanned[key] == astropy_header[key]
+        assert type(scanned[key]) == type(astropy_header[key])
+    assert scanned['undef'] is None
+    assert scanned['history'] == ['first', 'second']
+
+
+def test_scanner_keeps_only_requested_keywords(odd_header_file):
+    scanned = hs.scan_header(odd_header_file, keywords=['EXPTIME', 'object'])
+    assert set(scanned) == set(['EXPTIME', 'OBJECT'])
+    assert 'exptime' in scanned
+    assert 'naxis' not in scanned
+
+
+def test_scanner_keeps_synonyms():
+    feder = Feder()
+    cards = ['{0:<8}= {1:<70}'.format(name, "'12:00:00'")
+             for name in feder.RA.names]
+    scanned = hs.ScannedHeader(cards, keywords=[feder.RA])
+    assert set(scanned) == set(name.upper() for name in feder.RA.names)
+
+
+def test_scanner_reads_extension(odd_header_file):
+    scanned = hs.scan_header(odd_header_file, ext=1)
+    assert scanned['extname'] == 'SECOND'
+    assert scanned['naxis3'] == 2
+
+
+def test_scanner_rejects_non_fits(tmpdir):
+    name = tmpdir.join('not_fits.fit')
+    name.write('hello' * 1000)
+    with pytest.raises(ValueError):
+        hs.read_header_bytes(name.strpath)
+
+
+@pytest.mark.parametrize('value,expected', [
+    ("'O''Brien '  / comment", "O'Brien"),
+    ('  T', True),
+    ('-12 / n', -12),
+    ('1.5D3', 1500.0),
+    ('', None),
+])
+def test_parse_value(value, expected):
+    assert hs.parse_value(value) == expected
+
+
+@pytest.mark.parametrize('header_cache', [False, True])
+def test_collection_scanner_engine_matches_astropy(triage_setup,
+                                                   header_cache):
+    keywords = ['imagetyp', 'filter', 'object', 'ra', 'objctra']
+    by_astropy = tff.ImageFileCollection(triage_setup.test_dir,
+                                         keywords=keywords)
+    by_scanner = tff.ImageFileCollection(triage_setup.test_dir,
+                                         keywords=keywords,
+                                         header_cache=header_cache,
+                                         engine='scanner')
+    for key in ['file'] + keywords:
+        np.testing.assert_array_equal(by_astropy.summary[key],
+                                      by_scanner.summary[key])
+
+
+def test_collection_scanner_engine_all_keywords(triage_setup):
+    by_astropy = tff.ImageFileCollection(triage_setup.test_dir,
+                                         keywords='*')
+    by_scanner = tff.ImageFileCollection(triage_setup.test_dir,
+                                         keywords='*', engine='scanner')
+    assert (set(by_astropy.summary.colnames) ==
+            set(by_scanner.summary.colnames))
+
+
+def test_collection_astropy_engine_scans_only_compressed(triage_setup,
+                                                         monkeypatch):
+    read = []
+
+    def read_header_bytes(file_name, ext=0):
+        read.append(file_name)
+        return hs.read_header_bytes(file_name, ext=ext)
+
+    monkeypatch.setattr(tff, 'read_header_bytes', read_header_bytes)
+    ic = tff.ImageFileCollection(triage_setup.test_dir, keywords=['imagetyp'])
+    # Only compressed files are read by the scanner; astropy reads the rest.
+    assert len(read) == triage_setup.n_test['compressed']
+    assert all(name.endswith('.gz') for name in read)
+    assert len(ic.summary) == triage_setup.n_test['files']
+
+
+def test_collection_unknown_engine(triage_setup):
+    with pytest.raises(ValueError):
+        tff.ImageFileCollection(triage_setup.test_dir, engine='magic')
+
+
+@pytest.mark.parametrize('opener,kind', [(gzip.open, 'gzip'),
+                                         (bz2.BZ2File, 'bzip2')])
+def test_scanner_reads_compressed(odd_header_file, opener, kind):
+    name = odd_header_file + '.cmp'
+    with open(odd_header_file, 'rb') as f_in:
+        with opener(name, 'wb') as f_out:
+            f_out.write(f_in.read())
+    assert hs.compression(name) == kind
+    assert hs.compression(odd_header_file) is None
+    assert hs.scan_header(name)['longstr'] == \
+        hs.scan_header(odd_header_file)['longstr']
+    assert hs.scan_header(name, ext=1)['extname'] == 'SECOND'
+
+
+def test_scanner_stops_decompressing_at_end(tmpdir, monkeypatch):
+    name = tmpdir.join('big.fit.gz').strpath
+    hdu = fits.PrimaryHDU(data=np.arange(500000, dtype=np.int32))
+    with gzip.open(name, 'wb') as f_out:
+        hdu.writeto(f_out)
+    bytes_read = []
+
+    class CountingGzipFile(gzip.GzipFile):
+        def read(self, size=-1):
+            data = super(CountingGzipFile, self).read(size)
+            bytes_read.append(len(data))
+            return data
+
+    monkeypatch.setattr(hs, '_COMPRESSION',
+                        [(b'\x1f\x8b', 'gzip', CountingGzipFile)])
+    assert hs.scan_header(name)['naxis1'] == 500000
+    assert sum(bytes_read) == hs.BLOCK_SIZE
+
+
+def test_collection_reads_compressed_header(triage_setup):
+    name = 'filter_object_light.fit.gz'
+    collection = tff.ImageFileCollection(triage_setup.test_dir,
+                                         keywords=['filter'])
+    row = collection.summary['file'] == name
+    expected = fits.getheader(os.path.join(triage_setup.test_dir, name))
+    assert collection.summary['filter'][row][0] == expected['filter']
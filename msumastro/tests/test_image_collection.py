@@ -5,12 +5,17 @@ import os
 from shutil import rmtree
 from tempfile import mkdtemp
 from glob import iglob, glob
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:  # python 2
+    from inspect import getargspec
 import logging
 import stat
 
 import astropy.io.fits as fits
 import numpy as np
 import pytest
+from ccdproc import ImageFileCollection as RealIFC
 
 from .. import image_collection as tff
 from ..header_processing.patchers import IRAF_image_type
@@ -518,3 +523,42 @@ class TestImageFileCollection(object):
         new_len = len(ic.summary) - triage_setup.n_test['compressed']
         print(ic.summary['file'])
         assert new_len == 2 * original_len
+
+
+def test_collection_of_some_files(triage_setup):
+    names = ['filter_object_light.fit', 'no_filter_no_object_bias.fit',
+             'not_in_directory.fit']
+    ic = tff.ImageFileCollection(triage_setup.test_dir, keywords=['imagetyp'],
+                                 filenames=names)
+    assert sorted(ic.files) == sorted(names[:2])
+    assert len(ic.summary) == 2
+
+
+# Private methods of ccdproc's ImageFileCollection that msumastro overrides,
+# with the arguments and defaults they are overridden with.
+_OVERRIDDEN = {
+    '_fits_summary': (['self', 'header_keywords'], None),
+    '_dict_from_fits_header': (['self', 'file_name', 'input_summary',
+                                'missing_marker'], (None, None)),
+    '_fits_files_in_directory': (['self', 'extensions', 'compressed'],
+                                 (None, True)),
+}
+
+
+@pytest.mark.parametrize('name', sorted(_OVERRIDDEN))
+def test_overridden_ccdproc_signatures(name):
+    # A ccdproc release that changes these would no longer call the
+    # overrides as they expect.
+    args, defaults = _OVERRIDDEN[name]
+    for cls in [RealIFC, tff.ImageFileCollection]:
+        spec = getargspec(getattr(cls, name))
+        assert (spec.args, spec.defaults) == (args, defaults)
+
+
+def test_summary_matches_ccdproc(triage_setup):
+    # _dict_from_fits_header follows ccdproc's; the summaries must agree.
+    ours = tff.ImageFileCollection(triage_setup.test_dir, keywords='*')
+    theirs = RealIFC(triage_setup.test_dir, keywords='*')
+    assert ours.summary.colnames == theirs.summary.colnames
+    for name in ours.summary.colnames:
+        assert list(ours.summary[name]) == list(theirs.summary[name])
@@ -1,9 +1,10 @@
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
+import numpy as np
 import pytest
 
-from astropy.table import Table
+from astropy.table import Table, MaskedColumn
 from astropy.extern import six
 
 from .. import table_tree as tt
@@ -208,3 +209,290 @@ def test_grouper_walk(testing_table, expected_tree):
         grouping_keys = grouping_string.split(',')
         grouper = tt.TableTree(testing_table, grouping_keys, index_with)
         validate_walk(grouper, good_tree)
+
+
+def test_grouper_matches_table_group_by():
+    # Enough rows that groups are not in row order.
+    n_rows = 1000
+    rows = np.arange(n_rows)
+    table = Table()
+    table['object'] = np.array(['M101', 'M13', 'SA110'])[rows % 3]
+    table['exptime'] = (rows % 5) * 10.0
+    table['file'] = ['img-{0:04d}.fit'.format(r) for r in rows[::-1]]
+    tree = tt.TableTree(table, ['object', 'exptime'], 'file')
+    grouped = table.group_by(['object', 'exptime'])
+    leaves = [(p, f) for p, c, f in tree.walk() if f]
+    assert len(leaves) == len(grouped.groups)
+    for (parents, files), key, members in zip(leaves, grouped.groups.keys,
+                                              grouped.groups):
+        assert parents == list(key)
+        assert files == list(members['file'])
+
+
+def test_grouper_rejects_missing_values(testing_table):
+    table = Table(testing_table, masked=True)
+    table['b'].mask[1] = True
+    with pytest.raises(ValueError):
+        tt.TableTree(table, ['a', 'b'], 'index')
+
+
+def test_grouper_leaves_as_arrays(testing_table, expected_tree):
+    tree = tt.TableTree(testing_table, ['b', 'a'], 'index', as_arrays=True)
+    for parents, children, index in tree.walk():
+        if len(parents) == 2:
+            assert isinstance(index, np.ndarray)
+            assert not index.flags.writeable
+            assert list(index) == expected_tree['b,a'][parents[0]][parents[1]]
+
+
+@pytest.mark.parametrize('keys', ['a,b', 'b,a', 'c', 'c,b', 'a,b,c'])
+def test_compact_tree_matches_tree(testing_table, keys):
+    keys = keys.split(',')
+    tree = tt.TableTree(testing_table, keys, 'index')
+    compact = tt.CompactTableTree(testing_table, keys, 'index')
+    assert list(compact.keys()) == list(tree.keys())
+    walked = list(compact.walk())
+    assert len(walked) == len(list(tree.walk()))
+    for (parents, children, index), expected in zip(walked, tree.walk()):
+        assert parents == expected[0]
+        assert list(children) == list(expected[1])
+        assert list(index) == list(expected[2])
+        node = compact
+        for parent in parents:
+            node = node[parent]
+        if len(index):
+            assert not node.flags.writeable
+    assert compact.tree_keys == keys
+    assert compact.index_key == 'index'
+
+
+def test_compact_tree_does_not_add_keys(testing_table):
+    compact = tt.CompactTableTree(testing_table, ['a', 'b'], 'index')
+    with pytest.raises(KeyError):
+        compact[2]
+    with pytest.raises(KeyError):
+        compact[1]['z']
+    assert 'x' in compact[1]
+    assert 2 not in compact
+    assert len(compact) == 4
+    with pytest.raises(AttributeError):
+        compact.extra = 1
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_grouper_walk_options(testing_table, compact):
+    make_tree = tt.CompactTableTree if compact else tt.TableTree
+    tree = make_tree(testing_table, ['c', 'b'], 'index')
+    top_down = [(tuple(p), list(i)) for p, c, i in tree.walk()]
+    bottom_up = [(p, list(i)) for p, c, i in
+                 tree.walk(topdown=False, tuple_parents=True)]
+    assert sorted(bottom_up) == sorted(top_down)
+    # Each node comes after every node below it.
+    positions = dict((p, n) for n, (p, i) in enumerate(bottom_up))
+    for parents in positions:
+        if parents:
+            assert positions[parents[:-1]] > positions[parents]
+    assert bottom_up[-1][0] == ()
+    leaves = list(tree.walk(leaves_only=True))
+    assert [(tuple(p), list(i)) for p, c, i in leaves] == \
+        [(p, i) for p, i in top_down if i]
+
+
+def test_grouper_walk_deep_tree_without_recursion():
+    tree = tt.TableTree()
+    keys = list(range(5000))
+    tree.add_keys(keys, value=['deep'])
+    leaves = list(tree.walk(leaves_only=True))
+    assert leaves == [(keys, [], ['deep'])]
+
+
+def test_grouper_insert_and_remove_rows_without_table(testing_table):
+    tree = tt.TableTree()
+    tree.add_keys(['x', 1], value=[0, 1])
+    tree.add_keys(['y', 2], value=[2])
+    tree.remove_rows([1, 2])
+    assert _leaves(tree) == {('x', 1): [0]}
+    assert tree.table is None
+    with pytest.raises(ValueError):
+        tree.insert_rows(testing_table)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_grouper_select(testing_table, expected_tree, compact):
+    make_tree = tt.CompactTableTree if compact else tt.TableTree
+    tree = make_tree(testing_table, ['b', 'a'], 'index')
+    expected = expected_tree['b,a']
+    [(keys, branch)] = tree.select(b='x')
+    assert keys == ('x',)
+    assert sorted(branch.keys()) == sorted(expected['x'].keys())
+    # Leaving out the first key selects from every branch.
+    selected = tree.select(a=1)
+    assert [keys for keys, leaf in selected] == [('x', 1), ('y', 1)]
+    assert [list(leaf) for keys, leaf in selected] == [[0], [1]]
+    assert [keys for keys, leaf in tree.select({'a': [19, 7]})] == \
+        [('x', 7), ('z', 19)]
+    assert tree.select(b='y', a=7) == []
+    assert tree.select() == [((), tree)]
+    with pytest.raises(KeyError):
+        tree.select(c=4.1)
+
+
+def test_grouper_select_does_not_add_nodes(good_grouper):
+    keys_before = list(good_grouper.keys())
+    assert good_grouper.select(a=2, b='x') == []
+    assert list(good_grouper.keys()) == keys_before
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_grouper_save_and_load(testing_table, tmpdir, compact):
+    make_tree = tt.CompactTableTree if compact else tt.TableTree
+    tree = make_tree(testing_table, ['b', 'a'], 'index')
+    path = tmpdir.join('tree.npz').strpath
+    tree.save(path)
+    loaded = tt.TableTree.load(path, table=testing_table)
+    assert isinstance(loaded, tt.CompactTableTree)
+    assert isinstance(loaded['x'][1], np.memmap)
+    assert loaded.table is testing_table
+    assert loaded.tree_keys == ['b', 'a']
+    assert loaded.index_key == 'index'
+    assert [(p, list(c), list(i)) for p, c, i in loaded.walk()] == \
+        [(p, list(c), list(i)) for p, c, i in tree.walk()]
+    assert loaded.select(a=1)[1][0] == ('y', 1)
+    # Without a table the tree is loaded as it was saved.
+    assert list(tt.CompactTableTree.load(path).keys()) == ['x', 'y', 'z']
+
+
+def test_saved_tree_name_without_suffix(testing_table, tmpdir):
+    path = tmpdir.join('tree').strpath
+    tt.TableTree(testing_table, ['b', 'a'], 'index').save(path)
+    assert tmpdir.join('tree.npz').check()
+    assert tt.TableTree.load(path, table=testing_table) is not None
+    assert tt.TableTree.load(path + '.npz', table=testing_table) is not None
+
+
+def test_saved_tree_is_out_of_date_when_table_changes(testing_table,
+                                                      tmpdir):
+    path = tmpdir.join('tree.npz').strpath
+    tt.TableTree(testing_table, ['b', 'a'], 'index').save(path,
+                                                          fingerprint='v1')
+    assert tt.TableTree.load(path, fingerprint='v1') is not None
+    assert tt.TableTree.load(path, fingerprint='v2') is None
+    tt.TableTree(testing_table, ['b', 'a'], 'index').save(path)
+    changed = Table(testing_table, copy=True)
+    changed['a'][0] = 2
+    assert tt.TableTree.load(path, table=changed) is None
+    # Columns that are not in the tree do not matter.
+    changed = Table(testing_table, copy=True)
+    changed['c'][0] = 0
+    assert tt.TableTree.load(path, table=changed) is not None
+    assert tt.TableTree.load(tmpdir.join('missing.npz').strpath) is None
+
+
+def _leaves(tree):
+    return dict((tuple(p), sorted(i)) for p, c, i in
+                tree.walk(leaves_only=True))
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_grouper_insert_and_remove_rows(testing_table, as_arrays):
+    first, rest = testing_table[:2], testing_table[2:]
+    tree = tt.TableTree(Table(first), ['b', 'a'], 'index',
+                        as_arrays=as_arrays)
+    tree.select(a=1)
+    tree.insert_rows(Table(rest))
+    full = tt.TableTree(testing_table, ['b', 'a'], 'index')
+    assert _leaves(tree) == _leaves(full)
+    assert [keys for keys, leaf in tree.select(a=7)] == [('x', 7)]
+    assert list(tree.table['index']) == list(testing_table['index'])
+
+    # Removing the only row of a branch removes the branch.
+    tree.remove_rows([4, 1])
+    assert 'z' not in tree
+    assert list(tree['y'].keys()) == [5]
+    assert tree.select(b='z') == []
+    assert sorted(tree.table['index']) == [0, 2, 3]
+
+    # A removed row can be inserted again.
+    tree.insert_rows(Table(testing_table[4:]))
+    assert list(tree['z'][19]) == [4]
+    assert sorted(tree.table['index']) == [0, 2, 3, 4]
+
+
+def test_grouper_insert_and_remove_rows_check_index(testing_table):
+    tree = tt.TableTree(testing_table, ['b', 'a'], 'index')
+    before = _leaves(tree)
+    with pytest.raises(ValueError):
+        tree.insert_rows(Table(testing_table[3:]))
+    with pytest.raises(KeyError):
+        tree.remove_rows([0, 99])
+    assert _leaves(tree) == before
+    assert len(tree.table) == len(testing_table)
+
+
+@pytest.fixture
+def exposure_table():
+    table = Table()
+    table['exptime'] = [29.999, 30.0, 30.0, 60.0, 60.002, 120.0]
+    table['ccd-temp'] = [-20.2, -19.8, -10.4, -20.1, -9.6, 1.0]
+    table['file'] = ['f{0}.fit'.format(i) for i in range(len(table))]
+    return table
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_grouper_bins_by_tolerance(exposure_table, compact):
+    make_tree = tt.CompactTableTree if compact else tt.TableTree
+    tree = make_tree(exposure_table, ['exptime'], 'file',
+                     bins={'exptime': 0.01})
+    assert list(tree.keys()) == [30.0, 60.0, 120.0]
+    assert list(tree[30.0]) == ['f0.fit', 'f1.fit', 'f2.fit']
+    assert list(tree[60.0]) == ['f3.fit', 'f4.fit']
+
+
+@pytest.mark.parametrize('spec,expected', [
+    ([-30, -15, 0], {-30.0: ['f0.fit', 'f1.fit', 'f3.fit'],
+                     -15.0: ['f2.fit', 'f4.fit'],
+                     0.0: ['f5.fit']}),
+    ({'edges': [-15]}, {-np.inf: ['f0.fit', 'f1.fit', 'f3.fit'],
+                        -15.0: ['f2.fit', 'f4.fit', 'f5.fit']}),
+    ({'decimals': -1}, {-20.0: ['f0.fit', 'f1.fit', 'f3.fit'],
+                        -10.0: ['f2.fit', 'f4.fit'],
+                        0.0: ['f5.fit']}),
+])
+def test_grouper_bins_by_edges_and_rounding(exposure_table, spec, expected):
+    tree = tt.TableTree(exposure_table, ['ccd-temp'], 'file',
+                        bins={'ccd-temp': spec})
+    assert dict(tree) == expected
+
+
+def test_grouper_bad_bins(exposure_table):
+    with pytest.raises(ValueError):
+        tt.TableTree(exposure_table, ['exptime'], 'file',
+                     bins={'ccd-temp': 1})
+    with pytest.raises(ValueError):
+        tt.TableTree(exposure_table, ['exptime'], 'file',
+                     bins={'exptime': [30, 10]})
+    with pytest.raises(ValueError):
+        tt.TableTree(exposure_table, ['exptime'], 'file',
+                     bins={'exptime': {'width': 2}})
+
+
+@pytest.mark.parametrize('spec', [0.01, [10, 50], {'decimals': 0}])
+def test_grouper_bins_reject_nan(exposure_table, spec):
+    with_nan = Table(exposure_table, copy=True)
+    with_nan['exptime'][3] = np.nan
+    with pytest.raises(ValueError):
+        tt.TableTree(with_nan, ['exptime'], 'file', bins={'exptime': spec})
+    tree = tt.TableTree(exposure_table[:3], ['exptime'], 'file',
+                        bins={'exptime': spec})
+    before = _leaves(tree)
+    with pytest.raises(ValueError):
+        tree.insert_rows(with_nan[3:])
+    assert _leaves(tree) == before
+
+
+def test_grouper_insert_rows_into_bins(exposure_table):
+    tree = tt.TableTree(exposure_table[:4], ['exptime'], 'file',
+                        bins={'exptime': 0.01})
+    tree.insert_rows(exposure_table[4:])
+    assert list(tree.keys()) == [30.0, 60.0, 120.0]
+    assert tree[60.0] == ['f3.fit', 'f4.fit']
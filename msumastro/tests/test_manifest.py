@@ -0,0 +1,69 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+from astropy.table import Table, MaskedColumn
+
+from .. import manifest
+
+
+@pytest.fixture
+def manifest_table():
+    table = Table(masked=True)
+    table['file'] = ['a.fit', 'b.fit', 'c.fit']
+    table['exptime'] = MaskedColumn([1.0, 30.0, 0.0],
+                                    mask=[False, False, True])
+    table['filter'] = MaskedColumn(['R', '', 'V'], mask=[False, True, False])
+    # Header values of mixed type give an object column.
+    table['object'] = MaskedColumn(np.array(['m101', 12, None], dtype=object),
+                                   mask=[False, False, True])
+    return table
+
+
+@pytest.mark.parametrize('format', manifest.available_formats())
+def test_manifest_round_trip(tmpdir, manifest_table, format):
+    name = tmpdir.join(manifest.manifest_name('Manifest.txt',
+                                              format)).strpath
+    manifest.write_manifest(manifest_table, name, format=format)
+    # Writing twice must overwrite rather than fail.
+    manifest.write_manifest(manifest_table, name, format=format)
+    table = manifest.read_manifest(name)
+    assert table.colnames == manifest_table.colnames
+    np.testing.assert_array_equal(table['file'], manifest_table['file'])
+    assert table['exptime'][1] == 30.0
+    assert table['filter'][0] == 'R'
+    assert str(table['object'][1]) == '12'
+
+
+@pytest.mark.parametrize('format', manifest.available_formats())
+def test_manifest_subset_of_columns(tmpdir, manifest_table, format):
+    name = tmpdir.join(manifest.manifest_name('Manifest.txt',
+                                              format)).strpath
+    manifest.write_manifest(manifest_table, name, format=format)
+    table = manifest.read_manifest(name, columns=['filter', 'file'])
+    assert table.colnames == ['filter', 'file']
+    assert len(table) == len(manifest_table)
+
+
+def test_manifest_name():
+    assert manifest.manifest_name('Manifest.txt', 'ascii') == 'Manifest.txt'
+    assert (manifest.manifest_name('Manifest.txt', 'fits') ==
+            'Manifest.manifest.fits')
+    assert manifest._format_from_name('dir/Manifest.ecsv') == 'ecsv'
+
+
+def test_stack_tables(manifest_table):
+    other = Table(masked=True)
+    other['file'] = ['d.fit']
+    other['filter'] = [42]
+    other['airmass'] = [1.2]
+    stacked = manifest.stack_tables([manifest_table, other])
+    assert len(stacked) == 4
+    assert stacked.colnames[:2] == ['file', 'exptime']
+    assert 'airmass' in stacked.colnames
+    # Strings in one table and numbers in the other give strings.
+    assert stacked['filter'].dtype.kind in 'SU'
+    assert stacked['filter'][3] == '42'
+    assert stacked['exptime'].mask[3]
+    assert stacked['airmass'].mask[0]
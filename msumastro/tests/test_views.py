@@ -0,0 +1,86 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import json
+import os
+
+import pytest
+from astropy.table import Table, MaskedColumn
+
+from .. import views
+
+
+@pytest.fixture
+def table(tmpdir):
+    night1 = tmpdir.mkdir('night1')
+    night2 = tmpdir.mkdir('night2')
+    paths = [night1.join('a.fit'), night1.join('b.fit'),
+             night2.join('a.fit'), night2.join('c.fit')]
+    for path in paths:
+        path.write('SIMPLE')
+    table = Table(masked=True)
+    table['file'] = [p.strpath for p in paths]
+    table['object'] = MaskedColumn(['M101', 'M101', 'M101', ''],
+                                   mask=[False, False, False, True])
+    table['exptime'] = [30.0, 30.0, 30.0, 60.0]
+    table['date-obs'] = ['2015-03-10T03:00:00', '2015-03-10T04:00:00',
+                         '2015-03-11T03:00:00', '2015-03-11T05:00:00']
+    return table
+
+
+def test_view_tree(table):
+    tree = views.view_tree(table, ['date', 'object'])
+    assert sorted(tree.keys()) == ['2015-03-10', '2015-03-11']
+    assert len(tree['2015-03-10']['M101']) == 2
+    assert tree['2015-03-11']['No object'] == [table['file'][3]]
+
+
+def test_symlink_view_is_updated_in_place(table, tmpdir):
+    root = tmpdir.join('view')
+    views.write_view(table, ['object', 'exptime'], root.strpath)
+    links = sorted(p.relto(root) for p in root.visit() if p.islink())
+    assert links == [os.path.join('M101', '30.0', name)
+                     for name in ['b.fit', 'night1_a.fit', 'night2_a.fit']
+                     ] + [os.path.join('No object', '60.0', 'c.fit')]
+    unchanged = root.join('M101', '30.0', 'b.fit')
+    mtime = unchanged.lstat().mtime
+
+    table['object'][3] = 'M13'
+    table['object'].mask[3] = False
+    views.write_view(table, ['object', 'exptime'], root.strpath)
+    assert root.join('M13', '60.0', 'c.fit').readlink() == table['file'][3]
+    assert not root.join('No object').check()
+    assert unchanged.lstat().mtime == mtime
+
+
+@pytest.mark.parametrize('format', ['json', 'html'])
+def test_index_view(table, tmpdir, format):
+    root = tmpdir.join('view').strpath
+    assert views.write_view(table, ['date'], root, format=format)
+    assert not views.write_view(table, ['date'], root, format=format)
+    index = os.path.join(root, 'index.' + format)
+    with open(index) as f:
+        content = f.read()
+    if format == 'json':
+        assert json.loads(content)['tree']['2015-03-11'] == \
+            sorted(table['file'][2:])
+    else:
+        assert content.count('<a href=') == len(table)
+
+
+def test_symlink_names_are_unique(tmpdir):
+    paths = [tmpdir.join(d, 'cal', 'x.fit') for d in ['a', 'b']]
+    paths.append(tmpdir.join('a', 'x.fit'))
+    for path in paths:
+        path.ensure()
+    table = Table()
+    table['file'] = [p.strpath for p in paths]
+    table['imagetyp'] = ['FLAT'] * 3
+    root = tmpdir.join('view')
+    views.write_view(table, ['imagetyp'], root.strpath)
+    links = sorted(p.basename for p in root.join('FLAT').listdir())
+    assert links == ['a_cal_x.fit', 'a_x.fit', 'b_cal_x.fit']
+
+    table['file'][2] = table['file'][0]
+    with pytest.raises(ValueError):
+        views.write_view(table, ['imagetyp'], root.strpath)
@@ -0,0 +1,66 @@
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import threading
+
+import pytest
+
+from .. import watch
+
+
+def _write(directory, name, content='SIMPLE'):
+    directory.join(name).write(content, mode='a')
+
+
+def test_watcher_reports_settled_files_once(tmpdir):
+    _write(tmpdir, 'old.fit')
+    watcher = watch.DirectoryWatcher([tmpdir.strpath], settle_time=0,
+                                     use_inotify=False)
+    assert not watcher.scan()
+
+    _write(tmpdir, 'new.fit')
+    _write(tmpdir, 'notes.txt')
+    _write(tmpdir, '.partial.fit')
+    assert watcher.scan() == {tmpdir.strpath: ['new.fit']}
+    # Changes while the file is being processed are not reported...
+    _write(tmpdir, 'new.fit', 'patched')
+    assert not watcher.scan()
+    # ...and are taken as part of processing once it is acknowledged.
+    watcher.acknowledge(tmpdir.strpath, ['new.fit'])
+    assert not watcher.scan()
+
+    _write(tmpdir, 'old.fit', 'changed')
+    assert watcher.scan() == {tmpdir.strpath: ['old.fit']}
+
+
+def test_watcher_waits_for_files_to_settle(tmpdir):
+    watcher = watch.DirectoryWatcher([tmpdir.strpath], settle_time=3600,
+                                     include_existing=True,
+                                     use_inotify=False)
+    _write(tmpdir, 'growing.fit')
+    assert not watcher.scan()
+    assert watcher.has_pending
+
+
+@pytest.mark.parametrize('max_pending', [1, 4])
+def test_watch_directories_processes_each_file(tmpdir, max_pending):
+    first = tmpdir.mkdir('first')
+    second = tmpdir.mkdir('second')
+    for i in range(3):
+        _write(first, 'a{0}.fit'.format(i))
+    _write(second, 'b.fit')
+    processed = []
+    stop = threading.Event()
+
+    def process(directory, names):
+        processed.extend(names)
+        if len(processed) == 4:
+            stop.set()
+
+    n = watch.watch_directories([first.strpath, second.strpath], process,
+                                poll_interval=0.01, settle_time=0,
+                                max_pending=max_pending,
+                                include_existing=True, use_inotify=False,
+                                stop=stop)
+    assert n == 4
+    assert sorted(processed) == ['a0.fit', 'a1.fit', 'a2.fit', 'b.fit']
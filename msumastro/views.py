@@ -0,0 +1,279 @@
+"""
+Views of a set of images sorted into trees, without copying the images.
+
+A view is the tree that :func:`~msumastro.scripts.sort_files.sort_directory`
+would make, with levels given by a list of keywords, e.g. ``object``,
+``filter``, ``exptime``, but with the images left where they are. It is
+saved either as a "symlink farm", a directory tree of symbolic links to the
+images, or as a single index file, JSON or HTML, that lists the images in
+each branch of the tree. Several views of the same images take almost no
+space.
+
+Views are built from a table of header values, such as the summary of an
+:class:`~msumastro.ImageFileCollection` with a header cache, so only images
+that are new or have changed since the last time need to be read. Saving a
+view again changes only what is different: links that are no longer right
+are removed, missing ones are added and an index is rewritten only if its
+contents have changed.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import Counter
+import io
+import json
+import logging
+import os
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+from astropy.extern import six
+from astropy.extern.six.moves.urllib.request import pathname2url
+from astropy.table import Table, Column, MaskedColumn
+
+from .file_transfer import makedirs
+from .table_tree import TableTree
+
+__all__ = ['VIEW_FORMATS', 'DERIVED_KEYS', 'view_tree', 'write_view']
+
+logger = logging.getLogger(__name__)
+
+#: Ways a view can be saved.
+VIEW_FORMATS = ('symlink', 'json', 'html')
+
+#: Keys that can be used in a view but are not header keywords: the name of
+#: each, the keyword it is made from and how.
+DERIVED_KEYS = {
+    # Date, YYYY-MM-DD, from the start of the exposure.
+    'date': ('date-obs', lambda value: value[:10]),
+}
+
+# Name of the index file for each format that has one.
+_INDEX_NAMES = {'json': 'index.json', 'html': 'index.html'}
+
+
+def _as_strings(column):
+    """
+    Column converted to strings, with missing values masked.
+    """
+    mask = np.ma.getmaskarray(column)
+    return MaskedColumn(data=['' if m else str(v)
+                              for v, m in zip(column, mask)],
+                        mask=mask, name=column.name)
+
+
+def view_tree(table, tree_keys, file_column='file'):
+    """
+    Group the rows of a table into a tree.
+
+    Parameters
+    ----------
+    table : `~astropy.table.Table`
+        Table with a column of file paths and columns for the keys.
+    tree_keys : list of str
+        Columns whose values make the levels of the tree, outermost first;
+        keys in `DERIVED_KEYS` are made from other columns.
+    file_column : str, optional
+        Column that holds the path of each file.
+
+    Returns
+    -------
+    `~msumastro.table_tree.TableTree`
+        Files whose value of a key is missing are grouped under
+        ``'No <key>'`` at that level.
+    """
+    use = Table()
+    use[file_column] = table[file_column]
+    for key in tree_keys:
+        if key in table.colnames:
+            column = table[key]
+        elif key in DERIVED_KEYS:
+            source, derive = DERIVED_KEYS[key]
+            source_column = _as_strings(table[source])
+            column = MaskedColumn(
+                data=[derive(v) for v in source_column.filled('')],
+                mask=np.ma.getmaskarray(source_column), name=key)
+        else:
+            raise KeyError('No column {0} in table'.format(key))
+        mask = np.ma.getmaskarray(column)
+        if mask.any():
+            column = Column(data=['No ' + key if m else str(v)
+                                  for v, m in zip(column, mask)], name=key)
+        use[key] = column
+    return TableTree(use, list(tree_keys), file_column)
+
+
+def _unique_names(files):
+    """
+    Names of the links to files in one branch of a view.
+
+    Files from different directories that have the same name are told apart
+    by as many of their directories, innermost first, as it takes, e.g.
+    ``night1_cal_a.fit`` and ``night2_cal_a.fit``.
+    """
+    names = [os.path.basename(f) for f in files]
+    same_name = {}
+    for index, name in enumerate(names):
+        same_name.setdefault(name, []).append(index)
+    for name, indexes in same_name.items():
+        if len(indexes) == 1:
+            continue
+        directories = dict(
+            (i, os.path.dirname(os.path.abspath(files[i])).split(os.sep))
+            for i in indexes)
+        depth = 0
+        while directories:
+            depth += 1
+            prefixes = dict((i, '_'.join(d[-depth:]))
+                            for i, d in directories.items())
+            counts = Counter(prefixes.values())
+            for index, prefix in prefixes.items():
+                if counts[prefix] == 1 or depth >= len(directories[index]):
+                    names[index] = prefix + '_' + name
+                    del directories[index]
+    return names
+
+
+def _link_names(tree):
+    """
+    Map each path in a view, relative to its root, to the file it is for.
+
+    Raises
+    ------
+    ValueError
+        If two files would still have the same link, e.g. because the same
+        file is listed twice.
+    """
+    links = {}
+    for parents, _, files in tree.walk(leaves_only=True, tuple_parents=True):
+        branch = os.path.join(*[str(p) for p in parents])
+        for name, path in zip(_unique_names(files), files):
+            link = os.path.join(branch, name)
+            if link in links:
+                raise ValueError('{0} and {1} would both be {2} in the '
+                                 'view'.format(links[link], path, link))
+            links[link] = os.path.abspath(path)
+    return links
+
+
+def _write_symlinks(tree, root):
+    """
+    Make `root` a tree of symbolic links, changing only what is different.
+    """
+    wanted = _link_names(tree)
+    n_removed = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, root)
+            if not os.path.islink(path):
+                continue
+            if os.readlink(path) == wanted.get(relative):
+                del wanted[relative]
+            else:
+                os.remove(path)
+                n_removed += 1
+    for relative, target in sorted(wanted.items()):
+        path = os.path.join(root, relative)
+        makedirs(os.path.dirname(path))
+        os.symlink(target, path)
+    # Remove branches left empty, deepest first.
+    for directory, subdirectories, names in os.walk(root, topdown=False):
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+    logger.info('View %s: added %d links, removed %d', root, len(wanted),
+                n_removed)
+
+
+def _nested(tree):
+    """
+    The tree as nested dictionaries with lists of absolute paths as leaves.
+    """
+    def convert(node):
+        if isinstance(node, dict):
+            return dict((str(key), convert(value))
+                        for key, value in node.items())
+        return sorted(os.path.abspath(f) for f in node)
+    return convert(tree)
+
+
+def _html(nested, title):
+    lines = ['<!DOCTYPE html>', '<html>', '<head>',
+             '<meta charset="utf-8">',
+             '<title>{0}</title>'.format(escape(title)), '</head>', '<body>',
+             '<h1>{0}</h1>'.format(escape(title))]
+
+    def add(node, depth):
+        indent = '  ' * depth
+        lines.append(indent + '<ul>')
+        if isinstance(node, dict):
+            for key in sorted(node):
+                lines.append(indent + '<li>' + escape(key))
+                add(node[key], depth + 1)
+                lines.append(indent + '</li>')
+        else:
+            for path in node:
+                lines.append(indent + '<li><a href={0}>{1}</a></li>'.format(
+                    quoteattr('file://' + pathname2url(path)),
+                    escape(os.path.basename(path))))
+        lines.append(indent + '</ul>')
+
+    add(nested, 0)
+    lines.extend(['</body>', '</html>', ''])
+    return '\n'.join(lines)
+
+
+def write_view(table, tree_keys, root, format='symlink', file_column='file',
+               title=None):
+    """
+    Save a view of the files in a table.
+
+    Parameters
+    ----------
+    table : `~astropy.table.Table`
+        Table with a column of file paths and columns for the keys, e.g.
+        the summary of an `~msumastro.ImageFileCollection` with the
+        ``file`` column changed to the path of each file.
+    tree_keys : list of str
+        Keys that make the levels of the view; see :func:`view_tree`.
+    root : str
+        Directory in which the view is saved; it is created if needed.
+    format : str, optional
+        One of `VIEW_FORMATS`: ``'symlink'`` makes a tree of symbolic links
+        below `root`; ``'json'`` and ``'html'`` write an index file,
+        ``index.json`` or ``index.html``, in `root`.
+    file_column : str, optional
+        Column that holds the path of each file.
+    title : str, optional
+        Title of an HTML index; default is the keys.
+
+    Returns
+    -------
+    bool
+        ``False`` if an index was already up to date, otherwise ``True``.
+    """
+    if format not in VIEW_FORMATS:
+        raise ValueError('Unknown view format {0}'.format(format))
+    tree = view_tree(table, tree_keys, file_column=file_column)
+    makedirs(root)
+    if format == 'symlink':
+        _write_symlinks(tree, root)
+        return True
+
+    nested = _nested(tree)
+    if format == 'json':
+        content = six.text_type(json.dumps({'keys': list(tree_keys),
+                                            'tree': nested},
+                                           indent=1, sort_keys=True))
+    else:
+        content = _html(nested, title or ' / '.join(tree_keys))
+    index = os.path.join(root, _INDEX_NAMES[format])
+    try:
+        with io.open(index, encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    except IOError:
+        pass
+    with io.open(index, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
@@ -0,0 +1,298 @@
+"""
+Noticing FITS files as they are written to a directory.
+
+:class:`DirectoryWatcher` compares ``os.scandir`` listings of the
+directories it watches. A file is reported once its size and modification
+time have stopped changing for a while, so that files still being written by
+the camera software are not picked up half-written. If the optional package
+`inotify_simple <https://pypi.org/project/inotify_simple/>`_ is installed
+the watcher is woken by the kernel when a file is written instead of waiting
+out the full polling interval; the listing is still what decides which files
+are ready.
+
+:func:`watch_directories` runs a watcher in a background thread and hands
+batches of new files to a function in the calling thread through a queue of
+fixed length. When processing falls behind and the queue is full the watcher
+stops scanning until there is room, and the files that arrive meanwhile are
+handed over together as one batch.
+"""
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+from astropy.extern.six.moves import queue
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from .fits_walk import is_fits_name, scandir
+
+__all__ = ['DirectoryWatcher', 'watch_directories']
+
+logger = logging.getLogger(__name__)
+
+
+def _snapshot(directory):
+    """
+    Size and modification time of each FITS file in a directory.
+    """
+    files = {}
+    if scandir is not None:
+        for entry in scandir(directory):
+            if (entry.name.startswith('.') or
+                    not is_fits_name(entry.name) or not entry.is_file()):
+                continue
+            stat = entry.stat()
+            files[entry.name] = (stat.st_size, stat.st_mtime)
+    else:
+        for name in os.listdir(directory):
+            full_name = os.path.join(directory, name)
+            if (name.startswith('.') or not is_fits_name(name) or
+                    not os.path.isfile(full_name)):
+                continue
+            stat = os.stat(full_name)
+            files[name] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class DirectoryWatcher(object):
+    """
+    Find the FITS files in some directories that are new or have changed.
+
+    Parameters
+    ----------
+    directories : list of str
+        Directories to watch; their subdirectories are not watched.
+    settle_time : float, optional
+        Seconds for which the size and modification time of a file must not
+        change before it is reported.
+    include_existing : bool, optional
+        If ``True``, files already in the directories are reported by the
+        first scans; by default only files that appear or change afterwards
+        are reported.
+    use_inotify : bool, optional
+        Whether to wait for file system events with ``inotify_simple``.
+        Default is to use it if it is installed.
+    """
+    def __init__(self, directories, settle_time=2.0, include_existing=False,
+                 use_inotify=None):
+        self.directories = list(directories)
+        self.settle_time = settle_time
+        # Size and modification time of each file when last reported.
+        self._reported = dict((d, {}) for d in self.directories)
+        # Files not yet settled: signature and when it was first seen.
+        self._pending = dict((d, {}) for d in self.directories)
+        # Files reported but not yet acknowledged.
+        self._in_flight = dict((d, set()) for d in self.directories)
+        self._lock = threading.Lock()
+        if not include_existing:
+            for directory in self.directories:
+                self._reported[directory] = _snapshot(directory)
+
+        if use_inotify is None:
+            use_inotify = INotify is not None
+        if use_inotify and INotify is None:
+            raise ImportError('inotify_simple is needed to use inotify')
+        self._inotify = None
+        if use_inotify:
+            self._inotify = INotify()
+            watch_flags = (flags.CLOSE_WRITE | flags.MOVED_TO |
+                           flags.CREATE | flags.MODIFY)
+            for directory in self.directories:
+                self._inotify.add_watch(directory, watch_flags)
+
+    def scan(self):
+        """
+        List the directories and return the files ready to be processed.
+
+        Returns
+        -------
+        OrderedDict
+            Keys are directories and values are lists of the names of files
+            that are new or have changed and have settled. Directories with
+            no such files are left out. Each file is reported once for each
+            change; it is not reported again until it has been passed to
+            :meth:`acknowledge`.
+        """
+        now = time.time()
+        ready = OrderedDict()
+        with self._lock:
+            for directory in self.directories:
+                try:
+                    current = _snapshot(directory)
+                except OSError as e:
+                    logger.warning('Unable to list directory %s: %s',
+                                   directory, e)
+                    continue
+                reported = self._reported[directory]
+                pending = self._pending[directory]
+                in_flight = self._in_flight[directory]
+                for gone in set(reported) - set(current):
+                    del reported[gone]
+                for gone in set(pending) - set(current):
+                    del pending[gone]
+
+                names = []
+                for name in sorted(current):
+                    signature = current[name]
+                    if name in in_flight or reported.get(name) == signature:
+                        continue
+                    first_seen = pending.get(name)
+                    if first_seen is None or first_seen[0] != signature:
+                        pending[name] = (signature, now)
+                        if self.settle_time > 0:
+                            continue
+                    elif now - first_seen[1] < self.settle_time:
+                        continue
+                    del pending[name]
+                    reported[name] = signature
+                    in_flight.add(name)
+                    names.append(name)
+                if names:
+                    ready[directory] = names
+        return ready
+
+    def acknowledge(self, directory, names):
+        """
+        Record that files have been processed.
+
+        Their current size and modification time is taken as processed, so
+        that changes made in processing them, like patching their headers,
+        do not cause them to be reported again.
+
+        Parameters
+        ----------
+        directory : str
+            Directory the files are in.
+        names : list of str
+            Names of the files, as returned by :meth:`scan`.
+        """
+        with self._lock:
+            in_flight = self._in_flight[directory]
+            reported = self._reported[directory]
+            for name in names:
+                in_flight.discard(name)
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except OSError:
+                    reported.pop(name, None)
+                    continue
+                reported[name] = (stat.st_size, stat.st_mtime)
+
+    @property
+    def has_pending(self):
+        """
+        ``True`` if some files have been seen but have not yet settled.
+        """
+        with self._lock:
+            return any(self._pending.values())
+
+    def wait(self, timeout):
+        """
+        Wait until a file is written or `timeout` seconds pass.
+
+        Without inotify this always waits for `timeout` seconds.
+        """
+        if self._inotify is None:
+            time.sleep(timeout)
+            return
+        self._inotify.read(timeout=int(timeout * 1000))
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def _produce(watcher, batches, stop, poll_interval):
+    """
+    Scan with `watcher` and put batches of ready files on the queue.
+    """
+    while not stop.is_set():
+        for batch in watcher.scan().items():
+            # Blocks while the queue is full, which is the back pressure.
+            while not stop.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+        if watcher.has_pending:
+            interval = min(poll_interval, watcher.settle_time)
+        else:
+            interval = poll_interval
+        watcher.wait(interval)
+
+
+def watch_directories(directories, process, poll_interval=5.0,
+                      settle_time=2.0, max_pending=4, include_existing=False,
+                      use_inotify=None, stop=None):
+    """
+    Process FITS files as they are written to some directories.
+
+    Parameters
+    ----------
+    directories : list of str
+        Directories to watch.
+    process : callable
+        Called as ``process(directory, names)`` in the calling thread with
+        the names of new or changed files in `directory`. An exception it
+        raises is logged and the files are not offered again unless they
+        change.
+    poll_interval : float, optional
+        Seconds between scans of the directories.
+    settle_time : float, optional
+        Seconds a file must be unchanged before it is processed.
+    max_pending : int, optional
+        Number of batches that can wait to be processed before scanning is
+        paused.
+    include_existing : bool, optional
+        If ``True``, also process the files already in the directories.
+    use_inotify : bool, optional
+        See :class:`DirectoryWatcher`.
+    stop : `threading.Event`, optional
+        Watching ends, after the batches already waiting are processed,
+        once this is set. Default is to watch until interrupted.
+
+    Returns
+    -------
+    int
+        Number of files processed.
+    """
+    stop = stop or threading.Event()
+    watcher = DirectoryWatcher(directories, settle_time=settle_time,
+                               include_existing=include_existing,
+                               use_inotify=use_inotify)
+    batches = queue.Queue(maxsize=max_pending)
+    producer = threading.Thread(target=_produce,
+                                args=(watcher, batches, stop, poll_interval))
+    producer.daemon = True
+    producer.start()
+    n_processed = 0
+    try:
+        while not stop.is_set() or not batches.empty():
+            try:
+                directory, names = batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            logger.info('Processing %d new files in %s', len(names),
+                        directory)
+            try:
+                process(directory, names)
+            except Exception:
+                logger.exception('Unable to process files %s in %s',
+                                 names, directory)
+            watcher.acknowledge(directory, names)
+            n_processed += len(names)
+    finally:
+        stop.set()
+        producer.join()
+        watcher.close()
+    return n_processed
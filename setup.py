@@ -15,7 +15,9 @@ class PyTest(TestCommand):
         errcode = pytest.main(self.test_args)
         sys.exit(errcode)
 
-INSTALL_REQUIRES = ['astropy>=2.0', 'numpy', 'ccdproc>=1.0']
+# msumastro.ImageFileCollection overrides private methods of ccdproc's;
+# see test_overridden_ccdproc_signatures before widening this range.
+INSTALL_REQUIRES = ['astropy>=2.0', 'numpy', 'ccdproc>=1.0,<2.0']
 
 versioneer_cmdclass = versioneer.get_cmdclass()
 versioneer_cmdclass['test'] = PyTest
@@ -49,7 +51,15 @@ setup(
             ('run_standard_header_process.py = '
              'msumastro.scripts.run_standard_header_process:main'),
             ('sort_files.py = '
-             'msumastro.scripts.sort_files:main')
+             'msumastro.scripts.sort_files:main'),
+            ('astrometry_ledger.py = '
+             'msumastro.scripts.astrometry_ledger:main'),
+            ('header_catalog.py = '
+             'msumastro.scripts.header_catalog:main'),
+            ('run_watch.py = '
+             'msumastro.scripts.run_watch:main'),
+            ('make_views.py = '
+             'msumastro.scripts.make_views:main')
         ]
     },
     classifiers=['Development Status :: 4 - Beta',